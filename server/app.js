@@ -10,6 +10,7 @@ const mqttHandler = require('./mqtt/mqttHandler');
 const dbHandler = require('./db/dbHandler');
 const socketHandler = require('./socketio/socketHandler');
 const scheduleHandler = require('./scheduler/scheduleHandler');
+const workerHandler = require('./worker/workerHandler');
 
 const sensorDataRouter = require('./routes/sensorData')
 const roomDataRouter = require('./routes/roomData')
@@ -31,6 +32,8 @@ const initializeApp = async () => {
         const io = await socketHandler.connect(server);
         const mqttClient = await mqttHandler.connect(io);
         const scheduler = await scheduleHandler.schedulePredictions(io);
+        const statsScheduler = await scheduleHandler.scheduleStatsUpdate();
+        workerHandler.start().catch((err) => console.error(`[APP] ${colors.red(`Error starting the prediction worker: ${err}`)}`));
 
 
         app.use('/api/sensordata', sensorDataRouter);
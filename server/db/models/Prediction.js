@@ -1,8 +1,12 @@
 const { Schema, model } = require('mongoose');
 
+// Forecasts are made in steps of 3 hours, up to 24 hours ahead
+const PREDICTION_STEP = 3;
+const MAX_PREDICTIONS = 24;
+
 function validatePredictionsLength(val) {
     console.log(val);
-    return val.length === 3;
+    return val.length > 0 && val.length % PREDICTION_STEP === 0 && val.length <= MAX_PREDICTIONS;
 }
 
 const predictionSchema = new Schema({
@@ -13,7 +17,7 @@ const predictionSchema = new Schema({
     modelType: {
         type: String,
         required: true,
-        enum: ['LSTM', 'GRU', 'CNN']
+        enum: ['LSTM', 'GRU', 'CNN', 'ENSEMBLE']
     },
     timestamp: {
         type: Date,
@@ -44,7 +48,7 @@ const predictionSchema = new Schema({
                 }
             },
         ],
-        validate: [validatePredictionsLength, 'The "predictions" array must contain exactly 3 objects each of which represents a prediction made for the upcoming hour(s).'],
+        validate: [validatePredictionsLength, 'The "predictions" array must contain a multiple of 3 objects (at most 24), each of which represents a prediction made for the upcoming hour(s).'],
     },
 });
 
@@ -0,0 +1,263 @@
+import argparse
+import asyncio
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+from queue import Empty
+
+import numpy as np
+
+from workload import sensor_names, parametric_profiles, generate_hourly, hourly_to_readings, insert_readings
+
+# End-to-end benchmark of the hourly forecast job (predict.db_handler()).
+# Every scale runs in a separate process: a database stand-in (mongomock or a local mongod)
+# is seeded with synthetic 'sensordatas' for the requested number of sensors, after which
+# the fetch -> preprocess_input -> predict -> save_predictions flow is timed.
+# The wall time, the per-stage timings of db_handler() and the peak RSS of every run are
+# written to a JSON results file:
+#   python ./ml/benchmark.py --sensors 50 500 5000
+#   python ./ml/benchmark.py --mongo-uri mongodb://localhost:27017 --backend tflite
+#   python ./ml/benchmark.py --async --predict-args --write-concurrency 8
+# The models are the ones loaded by predict.py, '--backend stand-in' replaces them with a
+# persistence forecast (the last 3 input hours), so the benchmark also runs without TensorFlow.
+
+DEFAULT_SENSORS = [50, 500, 5000]
+DEFAULT_OUTPUT = './ml/benchmarks/results.json'
+BENCHMARK_DB = 'benchmark'
+INSERT_BATCH_SIZE = 10000
+SEED_HOURS = 9
+# Interval in seconds at which a running scale process is checked for an exit without a result
+RESULT_POLL_SECONDS = 5
+
+# Forecast of the stand-in backend: repeats the last 3 hours of the input window.
+# Supports the single model and the ensemble (list of windows) interfaces.
+class StandInModel:
+    def predict(self, x, batch_size=None, verbose=0):
+        if isinstance(x, list):
+            outputs = [window[:, -3:, :].copy() for window in x]
+            return outputs + [sum(outputs) / len(outputs)]
+
+        return x[:, -3:, :].copy()
+
+# Peak resident set size of the current process in MB.
+# Uses VmHWM, which can be reset, and falls back to ru_maxrss.
+def peak_rss():
+    try:
+        with open('/proc/self/status', 'r') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+# Resets the peak RSS (Linux only), so the seeding does not count towards the peak of a run
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+    except OSError:
+        pass
+
+def connect_stand_in(mongo_uri):
+    if mongo_uri:
+        from pymongo import MongoClient
+        return MongoClient(mongo_uri)
+
+    import mongomock
+    return mongomock.MongoClient()
+
+# Seeds the 'sensordatas' collection with the synthetic readings of the last hours (workload.py),
+# without gaps or outliers so every sensor has a full input window.
+# Returns the number of inserted documents.
+def seed_database(db, sensors, readings_per_hour, seed=0):
+    now = datetime.datetime.now()
+    end_time = now.replace(minute=0, second=0, microsecond=0) + datetime.timedelta(hours=1)
+    start_time = end_time - datetime.timedelta(hours=SEED_HOURS)
+
+    db['sensordatas'].create_index([('sensor', 1), ('timestamp', 1)])
+
+    rng = np.random.default_rng(seed)
+    mean, std = parametric_profiles(len(sensors), rng)
+
+    count = 0
+    batch = []
+    for sensor_idx, sensor in enumerate(sensors):
+        df = generate_hourly(sensor, None, mean[sensor_idx], std[sensor_idx], start_time, SEED_HOURS, rng)
+        batch.extend(hourly_to_readings(df, readings_per_hour, rng))
+        if len(batch) >= INSERT_BATCH_SIZE:
+            count += insert_readings(db['sensordatas'], batch, INSERT_BATCH_SIZE)
+            batch = []
+    count += insert_readings(db['sensordatas'], batch, INSERT_BATCH_SIZE)
+
+    return count
+
+# Points predict.py at the synthetic sensors: the sensor encoder is refitted on the synthetic names,
+# their lookup tables are copied from the real sensors and the room types are assigned round-robin.
+def setup_predict(predict, sensors, backend):
+    from sklearn.preprocessing import LabelEncoder
+
+    predict.load_obj_data()
+
+    real_sensors = len(predict.sensor_label_encoder.classes_)
+    predict.sensor_label_encoder = LabelEncoder().fit(sensors)
+    table_idx = np.arange(len(sensors)) % real_sensors
+    predict.normalization_table = np.asarray(predict.normalization_table)[table_idx]
+    predict.threshold_table = np.asarray(predict.threshold_table)[table_idx]
+
+    roomtypes = list(predict.roomtype_label_encoder.classes_)
+    predict.roomtype_mapping = {sensor: roomtypes[idx % len(roomtypes)] for idx, sensor in enumerate(predict.sensor_label_encoder.classes_)}
+
+    if backend == 'stand-in':
+        predict.model_LSTM = predict.model_GRU = predict.model_CNN = StandInModel()
+        predict.model_ensemble = StandInModel()
+    else:
+        predict.load_saved_model(backend)
+
+# Benchmarks a single scale, runs in its own process
+def run_scale(config):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import predict
+
+    sensors = sensor_names(config['sensors'], 'bench')
+    client = connect_stand_in(config['mongo_uri'])
+    client.drop_database(BENCHMARK_DB)
+    db = client[BENCHMARK_DB]
+
+    # The readings are rolled up once, like the scheduled rollup job does before every forecast
+    stage_start = time.perf_counter()
+    documents = seed_database(db, sensors, config['readings_per_hour'])
+    predict.update_rollup(db)
+    seed_time = time.perf_counter() - stage_start
+
+    stage_start = time.perf_counter()
+    setup_predict(predict, sensors, config['backend'])
+    setup_time = time.perf_counter() - stage_start
+
+    predict.client = client
+    predict.db = db
+    predict.SensorData = db['sensordatas']
+    predict.HourlySensorData = db[predict.ROLLUP_COLLECTION]
+    predict.Prediction = db['predictions']
+    if config['async']:
+        import predict_async
+        predict_async.SensorData = predict.SensorData
+        predict_async.HourlySensorData = predict.HourlySensorData
+        predict_async.Prediction = predict.Prediction
+        async_args = predict_async.parse_args(config['predict_args'])
+    else:
+        predict.args = predict.parse_args(config['predict_args'])
+
+    runs = []
+    for _ in range(config['repeats']):
+        reset_peak_rss()
+        run_start = time.perf_counter()
+        timings = asyncio.run(predict_async.db_handler_async(async_args)) if config['async'] else predict.db_handler()
+        wall = time.perf_counter() - run_start
+        runs.append({'wall': wall, 'peak_rss_mb': peak_rss(), **timings})
+
+    if config['mongo_uri']:
+        client.drop_database(BENCHMARK_DB)
+
+    return {
+        'sensors': config['sensors'],
+        'documents': documents,
+        'seed_time': seed_time,
+        'setup_time': setup_time,
+        'runs': runs,
+        'wall_median': statistics.median(run['wall'] for run in runs),
+        'peak_rss_mb': max(run['peak_rss_mb'] for run in runs)
+    }
+
+def run_scale_process(config, queue):
+    try:
+        queue.put(run_scale(config))
+    except Exception as err:
+        queue.put({'sensors': config['sensors'], 'error': repr(err)})
+        raise
+
+# Waits for the result of a scale process. A process that exits without a result
+# (e.g. killed by the OOM killer at a large scale) is recorded as a failed scale instead of blocking the run.
+def wait_for_result(process, queue, nr_of_sensors):
+    while process.is_alive():
+        try:
+            return queue.get(timeout=RESULT_POLL_SECONDS)
+        except Empty:
+            pass
+
+    # The result may have been put right before the exit
+    try:
+        return queue.get(timeout=RESULT_POLL_SECONDS)
+    except Empty:
+        return {'sensors': nr_of_sensors, 'error': f"Benchmark process exited with code {process.exitcode} without a result"}
+
+def run_benchmark(args):
+    context = multiprocessing.get_context('spawn')
+    results = []
+
+    for nr_of_sensors in args.sensors:
+        config = {
+            'sensors': nr_of_sensors,
+            'mongo_uri': args.mongo_uri,
+            'backend': args.backend,
+            'readings_per_hour': args.readings_per_hour,
+            'repeats': args.repeats,
+            'predict_args': args.predict_args,
+            'async': args.use_async
+        }
+
+        queue = context.Queue()
+        process = context.Process(target=run_scale_process, args=(config, queue))
+        process.start()
+        result = wait_for_result(process, queue, nr_of_sensors)
+        process.join()
+        results.append(result)
+
+        if 'error' in result:
+            print(f"[BENCHMARK] {nr_of_sensors} sensors failed: {result['error']}")
+        else:
+            print(f"[BENCHMARK] {nr_of_sensors} sensors: wall={result['wall_median']:.2f}s peak_rss={result['peak_rss_mb']:.0f}MB "
+                  f"({result['documents']} documents seeded in {result['seed_time']:.2f}s)")
+
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of the hourly forecast job.')
+    parser.add_argument('--sensors', type=int, nargs='+', default=DEFAULT_SENSORS, help='Numbers of sensors to benchmark.')
+    parser.add_argument('--mongo-uri', default=None, help='URI of a local mongod, mongomock is used by default. The benchmark database is dropped afterwards.')
+    parser.add_argument('--backend', choices=['keras', 'tflite', 'stand-in'], default='keras', help='Inference backend of predict.py, stand-in replaces the models with a persistence forecast.')
+    parser.add_argument('--readings-per-hour', type=int, default=6)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--async', dest='use_async', action='store_true', help='Benchmark the pipelined job of predict_async.py, --predict-args may also hold its flags.')
+    parser.add_argument('--predict-args', nargs=argparse.REMAINDER, default=[], help='Flags passed to predict.py, e.g. --predict-args --horizon 24.')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    args = parser.parse_args()
+
+    results = run_benchmark(args)
+
+    report = {
+        'created': datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'mongo': 'mongod' if args.mongo_uri else 'mongomock',
+        'backend': args.backend,
+        'readings_per_hour': args.readings_per_hour,
+        'repeats': args.repeats,
+        'predict_args': args.predict_args,
+        'async': args.use_async,
+        'results': results
+    }
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=4)
+
+    print(f"[BENCHMARK] Results written to {args.output}")
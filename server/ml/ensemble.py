@@ -0,0 +1,18 @@
+import tensorflow as tf
+from keras.models import Model
+
+# Fused ensemble of the forecast models (Keras backend).
+# Takes one input window per model and returns the output of every model
+# followed by their weighted average, all in a single forward pass.
+# Every model has its own input so that the recursive forecasts can feed back their own predictions.
+class EnsembleModel(Model):
+    def __init__(self, members, member_weights):
+        super().__init__()
+        self.members = members
+        self.member_weights = member_weights
+
+    def call(self, inputs):
+        outputs = [member(x, training=False) for member, x in zip(self.members, inputs)]
+        ensemble = tf.add_n([weight * output for weight, output in zip(self.member_weights, outputs)])
+
+        return outputs + [ensemble]
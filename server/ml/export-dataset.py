@@ -0,0 +1,173 @@
+import argparse
+import csv
+import datetime
+import math
+import os
+import sys
+
+import pandas as pd
+from pymongo import MongoClient
+from dotenv import load_dotenv
+
+import predict
+from hourly_data import hourly_average_pipeline
+from rollup import ROLLUP_COLLECTION, find_buckets
+from sensor_store import write_sensor_table
+
+# Exports the readings collected in the database as a training dataset.
+# The readings are averaged per sensor and hour by the database (hourly_data.py) or read from the
+# hourly rollup collection (rollup.py), and written as per-sensor hourly tables with the columns
+# of the preprocess-sort output (sensor, hour, eCO2, sound, light, roomtype, day).
+# The tables are written to a folder of their own (DEFAULT_OUTPUT), existing tables are only replaced
+# with --overwrite. To train on them, they are copied into the input folder of remove-outliers.py
+# (../resources/NU-Heartbeat-Oct-23/data/processed/bysensor) and passed through impute-missing.py and train.py:
+#   python ./ml/export-dataset.py --since 2024-01-01T00:00:00
+#   python ./ml/export-dataset.py --source rollup --format npy --output ../resources/exported/rollup --overwrite
+# Sensors are aggregated in batches of --sensor-batch-size, every aggregation uses the (sensor, timestamp)
+# index and returns its rows sorted by sensor and time through a cursor of --cursor-batch-size documents.
+# CSV rows are written as they arrive, so the memory use does not depend on the size of the collection,
+# the binary tables of sensor_store.py hold a single sensor in memory.
+
+load_dotenv()
+
+TABLE_COLUMNS = ['sensor', 'hour', 'eCO2', 'sound', 'light', 'roomtype', 'day']
+DEFAULT_OUTPUT = '../resources/exported/bysensor'
+SENSOR_BATCH_SIZE = 100
+CURSOR_BATCH_SIZE = 10000
+
+# Rounds half up like Math.round() in preprocess-average
+def round_half_up(value):
+    return int(math.floor(value + 0.5))
+
+# Converts an hourly average into a row of the per-sensor tables.
+# Returns None for hours without a value for every metric.
+def to_row(hourly_average, roomtype):
+    values = [hourly_average.get(col) for col in ['eCO2', 'sound', 'color_r', 'color_g', 'color_b']]
+    if any(value is None for value in values):
+        return None
+
+    eCO2, sound, color_r, color_g, color_b = values
+
+    return [hourly_average['sensor'], int(hourly_average['hour']), round_half_up(eCO2), round_half_up(sound),
+            round_half_up((color_r + color_g + color_b) / 3), roomtype, int(hourly_average['day'])]
+
+# Writes the rows of a single sensor to <output_folder>/<sensor>.csv as they arrive
+class CsvTableWriter:
+    def __init__(self, output_folder, sensor):
+        self.sensor = sensor
+        self.file = open(os.path.join(output_folder, f'{sensor}.csv'), 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(TABLE_COLUMNS)
+        self.rows = 0
+
+    def write(self, row):
+        self.writer.writerow(row)
+        self.rows += 1
+
+    def close(self):
+        self.file.close()
+
+# Collects the rows of a single sensor and writes them as a binary table (sensor_store.py)
+class NpyTableWriter:
+    def __init__(self, output_folder, sensor):
+        self.output_folder = output_folder
+        self.sensor = sensor
+        self.table = []
+        self.rows = 0
+
+    def write(self, row):
+        self.table.append(row)
+        self.rows += 1
+
+    def close(self):
+        if self.rows > 0:
+            write_sensor_table(pd.DataFrame(self.table, columns=TABLE_COLUMNS), self.output_folder, self.sensor)
+
+# Returns a cursor over the hourly averages of the provided sensors, sorted by sensor and time
+def stream_hourly_averages(db, source, sensors, start_time, end_time, cursor_batch_size):
+    if source == 'rollup':
+        return find_buckets(db[ROLLUP_COLLECTION], sensors, start_time, end_time).batch_size(cursor_batch_size)
+
+    pipeline = hourly_average_pipeline(start_time, end_time, sensors)
+    return db['sensordatas'].aggregate(pipeline, allowDiskUse=True, batchSize=cursor_batch_size)
+
+# Returns the tables of the provided sensors that already exist in the output folder
+def existing_tables(output_folder, sensors, table_format='csv'):
+    extension = '.csv' if table_format == 'csv' else '.npy'
+    paths = [os.path.join(output_folder, f'{sensor}{extension}') for sensor in sensors]
+
+    return [path for path in paths if os.path.exists(path)]
+
+# Streams the hourly averages of every sensor into its table.
+# Sensors without a room type are skipped, since the room type is part of the model input.
+# Raises a FileExistsError before anything is written if a table would be replaced, unless overwrite is set.
+# Returns the number of written rows per sensor.
+def export_dataset(db, output_folder, roomtype_mapping, start_time, end_time, source='raw', table_format='csv',
+                   sensors=None, sensor_batch_size=SENSOR_BATCH_SIZE, cursor_batch_size=CURSOR_BATCH_SIZE, overwrite=False):
+    table_writer = CsvTableWriter if table_format == 'csv' else NpyTableWriter
+
+    collection = db[ROLLUP_COLLECTION] if source == 'rollup' else db['sensordatas']
+    if sensors is None:
+        sensors = sorted(collection.distinct('sensor'))
+
+    skipped = [sensor for sensor in sensors if sensor not in roomtype_mapping]
+    for sensor in skipped:
+        print(f"[EXPORT] Skipping {sensor}, the sensor has no room type.")
+    sensors = [sensor for sensor in sensors if sensor in roomtype_mapping]
+
+    existing = existing_tables(output_folder, sensors, table_format)
+    if existing and not overwrite:
+        raise FileExistsError(f"{len(existing)} table(s) already exist in {output_folder} (e.g. {existing[0]}), pass --overwrite to replace them.")
+    os.makedirs(output_folder, exist_ok=True)
+
+    exported = {}
+    for i in range(0, len(sensors), sensor_batch_size):
+        writer = None
+        for hourly_average in stream_hourly_averages(db, source, sensors[i:i+sensor_batch_size], start_time, end_time, cursor_batch_size):
+            sensor = hourly_average['sensor']
+            if writer is None or writer.sensor != sensor:
+                if writer is not None:
+                    writer.close()
+                    exported[writer.sensor] = writer.rows
+                writer = table_writer(output_folder, sensor)
+
+            row = to_row(hourly_average, roomtype_mapping[sensor])
+            if row is not None:
+                writer.write(row)
+
+        if writer is not None:
+            writer.close()
+            exported[writer.sensor] = writer.rows
+
+    return exported
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Exports the readings of the database as per-sensor hourly tables.')
+    parser.add_argument('--source', choices=['raw', 'rollup'], default='raw', help='Raw readings (sensordatas) or the hourly rollup collection.')
+    parser.add_argument('--since', type=datetime.datetime.fromisoformat, default=datetime.datetime(1970, 1, 1), help='Start of the exported period (ISO format), all readings by default.')
+    parser.add_argument('--until', type=datetime.datetime.fromisoformat, default=None, help='End of the exported period (ISO format), the start of the current hour by default.')
+    parser.add_argument('--sensors', nargs='+', default=None, help='Exported sensors, all sensors of the collection by default.')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help=f'Folder of the per-sensor tables ({DEFAULT_OUTPUT} by default).')
+    parser.add_argument('--format', choices=['csv', 'npy'], default='csv', help='Format of the per-sensor tables, npy writes the binary tables of sensor_store.py.')
+    parser.add_argument('--sensor-batch-size', type=int, default=SENSOR_BATCH_SIZE, help='Number of sensors aggregated at once.')
+    parser.add_argument('--cursor-batch-size', type=int, default=CURSOR_BATCH_SIZE, help='Number of documents returned by the database per cursor batch.')
+    parser.add_argument('--overwrite', action='store_true', help='Replaces the tables that already exist in the output folder.')
+    args = parser.parse_args()
+
+    end_time = args.until or datetime.datetime.now().replace(minute=0, second=0, microsecond=0)
+
+    predict.load_room_data()
+
+    client = MongoClient(os.getenv('DB_URI'))
+    db = client['test']
+
+    try:
+        exported = export_dataset(db, args.output, predict.roomtype_mapping, args.since, end_time, args.source, args.format,
+                                  args.sensors, args.sensor_batch_size, args.cursor_batch_size, args.overwrite)
+    except FileExistsError as err:
+        print(f"[EXPORT] {err}")
+        sys.exit(1)
+    finally:
+        client.close()
+
+    print(f"[EXPORT] Exported {sum(exported.values())} hourly row(s) of {len(exported)} sensor(s) from {args.since} to {end_time} to {args.output}.")
@@ -0,0 +1,125 @@
+import argparse
+import datetime
+import os
+
+import numpy as np
+
+from sensor_store import write_sensor_table
+from parallel import DEFAULT_WORKERS, run_per_sensor, report_failures
+from workload import (TABLE_COLUMNS, sensor_names, load_roomtypes, assign_roomtypes, parametric_profiles, lookup_profiles,
+                      generate_hourly, hourly_to_readings, insert_readings)
+
+# Generates a synthetic workload for scale testing (see workload.py):
+#   - per-sensor hourly tables (sensor, hour, eCO2, sound, light, roomtype, day), the input of
+#     remove-outliers.py, impute-missing.py and train.py, as CSV (like preprocess-sort) or binary tables
+#   - optionally the raw readings of the same hours in a 'sensordatas' collection, the input of
+#     predict.py, incremental_stats.py and benchmark.py
+#   python ./ml/generate-workload.py --sensors 4400 --days 28 --workers 8
+#   python ./ml/generate-workload.py --sensors 500 --days 2 --mongo-uri mongodb://localhost:27017 --no-tables
+# Every sensor is generated from its own seed, so the output does not depend on the number of workers.
+
+DEFAULT_OUTPUT = '../resources/synthetic/bysensor'
+DEFAULT_DB = 'synthetic'
+
+# Collections of the worker process, a MongoClient can not be passed between processes.
+# Only filled in the workers (or in the main process with a single worker), after the fork.
+collections = {}
+
+def get_collection(mongo_uri, db_name):
+    if (mongo_uri, db_name) not in collections:
+        from pymongo import MongoClient
+        collections[(mongo_uri, db_name)] = MongoClient(mongo_uri)[db_name]['sensordatas']
+
+    return collections[(mongo_uri, db_name)]
+
+# Generates and writes the workload of a single sensor.
+# Returns the number of hourly rows and raw readings.
+def process_sensor(sensor_idx, sensor_name, roomtype, mean, std, config):
+    rng = np.random.default_rng([config['seed'], sensor_idx])
+
+    df = generate_hourly(sensor_name, roomtype, mean, std, config['start_time'], config['hours'], rng,
+                         config['gap_rate'], config['mean_gap_hours'], config['outlier_rate'])
+
+    if config['output']:
+        if config['format'] == 'csv':
+            os.makedirs(config['output'], exist_ok=True)
+            df[TABLE_COLUMNS].to_csv(os.path.join(config['output'], f'{sensor_name}.csv'), index=False)
+        else:
+            write_sensor_table(df[TABLE_COLUMNS], config['output'], sensor_name)
+
+    readings = 0
+    if config['mongo_uri']:
+        collection = get_collection(config['mongo_uri'], config['db'])
+        readings = insert_readings(collection, hourly_to_readings(df, config['readings_per_hour'], rng))
+
+    return len(df), readings
+
+def generate_workload(args):
+    rng = np.random.default_rng(args.seed)
+    sensors = sensor_names(args.sensors, args.prefix)
+    roomtypes = assign_roomtypes(sensors, args.roomtypes or load_roomtypes())
+
+    if args.profile == 'lookup':
+        mean, std = lookup_profiles(len(sensors), rng)
+    else:
+        mean, std = parametric_profiles(len(sensors), rng)
+
+    start_time = datetime.datetime.strptime(args.start, '%Y-%m-%d') if args.start else \
+        datetime.datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - datetime.timedelta(days=args.days)
+
+    config = {
+        'seed': args.seed,
+        'start_time': start_time,
+        'hours': args.days * 24,
+        'gap_rate': args.gap_rate,
+        'mean_gap_hours': args.mean_gap_hours,
+        'outlier_rate': args.outlier_rate,
+        'output': None if args.no_tables else args.output,
+        'format': args.format,
+        'mongo_uri': args.mongo_uri,
+        'db': args.db,
+        'readings_per_hour': args.readings_per_hour
+    }
+
+    # The index is created with a client of its own, the worker processes must not inherit a client across fork()
+    if args.mongo_uri:
+        from pymongo import MongoClient
+        client = MongoClient(args.mongo_uri)
+        client[args.db]['sensordatas'].create_index([('sensor', 1), ('timestamp', 1)])
+        client.close()
+
+    tasks = {
+        sensor_name: (sensor_idx, sensor_name, roomtypes[sensor_name], mean[sensor_idx], std[sensor_idx], config)
+        for sensor_idx, sensor_name in enumerate(sensors)
+    }
+
+    results, failures = run_per_sensor(process_sensor, tasks, args.workers)
+    report_failures('generate-workload', results, failures)
+
+    rows = sum(result[0] for result in results.values())
+    readings = sum(result[1] for result in results.values())
+    print(f"[generate-workload] Generated {rows} hourly row(s) and {readings} reading(s) for {len(sensors)} sensor(s) "
+          f"from {start_time} ({args.days} day(s)).")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generates a synthetic sensor workload for scale testing.')
+    parser.add_argument('--sensors', type=int, default=440, help='Number of synthetic sensors (440 by default, 10x the dataset).')
+    parser.add_argument('--days', type=int, default=28, help='Number of generated days (28 by default).')
+    parser.add_argument('--start', default=None, help='First generated day (YYYY-MM-DD), --days before today by default.')
+    parser.add_argument('--profile', choices=['parametric', 'lookup'], default='parametric', help='Source of the day/hour seasonality, lookup copies the statistics of the real sensors.')
+    parser.add_argument('--gap-rate', type=float, default=0.002, help='Probability that a gap of missing hours starts at any hour.')
+    parser.add_argument('--mean-gap-hours', type=float, default=6, help='Mean length of the gaps in hours.')
+    parser.add_argument('--outlier-rate', type=float, default=0.005, help='Share of the hours containing an outlier.')
+    parser.add_argument('--roomtypes', nargs='+', default=None, help='Room types assigned round-robin, the classes of the room type encoder by default.')
+    parser.add_argument('--prefix', default='synth', help='Prefix of the sensor names.')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='Folder of the per-sensor tables.')
+    parser.add_argument('--format', choices=['csv', 'npy'], default='csv', help='Format of the per-sensor tables, npy writes the binary tables of sensor_store.py.')
+    parser.add_argument('--no-tables', action='store_true', help='Only write the raw readings.')
+    parser.add_argument('--mongo-uri', default=None, help='Writes the raw readings to the sensordatas collection of --db.')
+    parser.add_argument('--db', default=DEFAULT_DB)
+    parser.add_argument('--readings-per-hour', type=int, default=6)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Number of worker processes, sensors are processed serially by default (1).')
+    args = parser.parse_args()
+
+    generate_workload(args)
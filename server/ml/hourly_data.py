@@ -0,0 +1,87 @@
+import numpy as np
+
+# Hourly averages of the raw sensor readings (the 'sensordatas' collection).
+# Rows follow the conventions of the training data: 'hour' is the hour in which
+# the readings were recorded and 'day' is the day of the week (0 = Sunday).
+
+# Aggregation pipeline computing the hourly averages of the readings recorded
+# between start_time and end_time, optionally limited to the provided sensors.
+# Every resulting document holds the sensor, the start of the hour ('timestamp'),
+# the day and hour, the number of readings and the averaged metrics.
+def hourly_average_pipeline(start_time, end_time, sensors=None):
+    match = {
+        "timestamp": {
+            "$gte": start_time,
+            "$lt": end_time
+        }
+    }
+    if sensors is not None:
+        match["sensor"] = {"$in": list(sensors)}
+
+    return [
+        {
+            "$match": match
+        },
+        {
+            "$group": {
+                "_id": {
+                    "sensor": "$sensor",
+                    "year": {"$year": "$timestamp"},
+                    "month": {"$month": "$timestamp"},
+                    "dayOfMonth": {"$dayOfMonth": "$timestamp"},
+                    "hour": {"$hour": "$timestamp"}
+                },
+                "dayOfWeek": {"$first": {"$subtract": [{"$dayOfWeek": "$timestamp"}, 1]}},
+                "count": {"$sum": 1},
+                "avg_eCO2": {"$avg": "$eCO2"},
+                "avg_sound": {"$avg": "$sound"},
+                "avg_color_r": {"$avg": "$color_r"},
+                "avg_color_g": {"$avg": "$color_g"},
+                "avg_color_b": {"$avg": "$color_b"}
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "sensor": "$_id.sensor",
+                "timestamp": {
+                    "$dateFromParts": {
+                        "year": "$_id.year",
+                        "month": "$_id.month",
+                        "day": "$_id.dayOfMonth",
+                        "hour": "$_id.hour"
+                    }
+                },
+                "day": "$dayOfWeek",
+                "hour": "$_id.hour",
+                "count": "$count",
+                "eCO2": "$avg_eCO2",
+                "sound": "$avg_sound",
+                "color_r": "$avg_color_r",
+                "color_g": "$avg_color_g",
+                "color_b": "$avg_color_b"
+            }
+        },
+        {
+            "$sort": {
+                "sensor": 1,
+                "timestamp": 1
+            }
+        }
+    ]
+
+# Converts the documents returned by hourly_average_pipeline() into a DataFrame
+# with the 'sensor', 'timestamp', 'day', 'hour', 'eCO2', 'sound' and 'light' columns.
+# Metrics are truncated to integers the same way predict.py does for its input.
+# pandas is imported here, so the pipeline can be used without it (predict.py, rollup.py).
+def to_hourly_frame(docs):
+    import pandas as pd
+
+    df = pd.DataFrame(list(docs), columns=['sensor', 'timestamp', 'day', 'hour', 'eCO2', 'sound', 'color_r', 'color_g', 'color_b'])
+
+    df['light'] = (df['color_r'] + df['color_g'] + df['color_b']) / 3
+    for col in ['eCO2', 'sound', 'light']:
+        df[col] = np.trunc(df[col].astype(float))
+    df[['day', 'hour']] = df[['day', 'hour']].astype(int)
+
+    return df[['sensor', 'timestamp', 'day', 'hour', 'eCO2', 'sound', 'light']]
@@ -1,100 +1,42 @@
-import pandas as pd
-import os
+import argparse
 
-def circular_day_difference(current_day, next_day):
-    return (next_day - current_day) % 7
+from sensor_store import list_sensor_tables, read_sensor_table, write_sensor_table
+from parallel import DEFAULT_WORKERS, run_per_sensor, report_failures
+from preprocessing import impute_missing_hours
 
-def construct_new_row(missing_day, hour, stats, sensor, roomtype):
-    new_row = {'day': missing_day, 'hour': hour}
-    for col in ['eCO2', 'sound', 'light']:
-        new_row[col] = stats[col].get((missing_day, hour), None)
-    new_row['sensor'] = sensor
-    new_row['roomtype'] = roomtype
-    return new_row
-
-def calculate_day_hour_stats(df):
-    grouped = df.groupby(['day', 'hour'])
-    stats = {}
-    for name, group in grouped:
-        for col in ['eCO2', 'sound', 'light']:
-            if col not in stats:
-                stats[col] = {}
-            stats[col][name] = group[col].mean()
-
-    return stats
-
-def process_folder(input_folder, output_folder):
-    files = os.listdir(input_folder)
-
-    for file in files:
-        if file.endswith('.csv'):
-            file_path = os.path.join(input_folder, file)
-            df = pd.read_csv(file_path)
-
-            stats = calculate_day_hour_stats(df)
-            
-            sensor = df.iloc[0]['sensor']
-            roomtype = df.iloc[0]['roomtype']
+# Imputes the hours missing in the table of a single sensor
+# with the mean values of the corresponding day-hour.
+def process_sensor(sensor_name, file_path, output_folder, min_gap_hours=1):
+    df = read_sensor_table(file_path)
 
-            new_rows = []
-            insert_indices = []
-
-            for idx in range(0,len(df) - 1):
-                current_day, next_day = df.loc[idx, 'day'], df.loc[idx + 1, 'day']
-
-                day_diff = circular_day_difference(current_day, next_day)
-                if day_diff > 1:
-                    if current_day < next_day:
-                        for missing_day in range(current_day + 1, next_day):
-                            print("Found missing day:", missing_day, "idx", idx, "idx+1", idx+1)
-                            insert_indices.append(idx + 1)
-                            for hour in range(24):
-                                new_rows.append(construct_new_row(missing_day, hour, stats, sensor, roomtype))
-                    else:
-                        for missing_day in range(current_day + 1, 7):
-                            print("Found missing day:", missing_day, "idx", idx, "idx+1", idx+1)
-                            insert_indices.append(idx + 1)
-                            for hour in range(24):
-                                new_rows.append(construct_new_row(missing_day, hour, stats, sensor, roomtype))
-
-                        for missing_day in range(0, next_day):
-                            print("Found missing day:", missing_day, "idx", idx, "idx+1", idx+1)
-                            insert_indices.append(idx + 1)
-                            for hour in range(24):
-                                new_rows.append(construct_new_row(missing_day, hour, stats, sensor, roomtype))
-            
-            insert_counter = 0
-            new_dfs = []
-
-            last_idx = 0
-
-            for idx in insert_indices:
-                rows_to_insert = []
-                for hour in range(24):
-                    row = new_rows[insert_counter]
-                    rows_to_insert.append(row)
-                    insert_counter += 1
+    df, nr_of_imputed = impute_missing_hours(df, min_gap_hours)
+    print(f"Imputed {nr_of_imputed} missing hour(s) for {sensor_name}.")
+    
+    for col in ['eCO2', 'sound', 'light']:
+        df[col] = df[col].round(0).astype(int)
 
-                rows_df = pd.DataFrame(rows_to_insert)
-                new_dfs.append(df.iloc[last_idx:idx])
-                new_dfs.append(rows_df)
-                last_idx = idx
+    write_sensor_table(df, output_folder, sensor_name)
 
-            new_dfs.append(df.iloc[last_idx:])
+# Parses the input folder contents and calls process_sensor() for every sensor table,
+# spreading the sensors over the provided number of worker processes.
+def process_folder(input_folder, output_folder, workers=DEFAULT_WORKERS, min_gap_hours=1):
+    tasks = {
+        sensor_name: (sensor_name, file_path, output_folder, min_gap_hours)
+        for sensor_name, file_path in list_sensor_tables(input_folder).items()
+    }
 
-            df = pd.concat(new_dfs, ignore_index=True)
-            
-            for col in ['eCO2', 'sound', 'light']:
-                df[col] = df[col].round(0).astype(int)
+    results, failures = run_per_sensor(process_sensor, tasks, workers)
+    report_failures('impute-missing', results, failures)
 
-            if not os.path.exists(output_folder):
-                os.makedirs(output_folder)
-            output_file_path = os.path.join(output_folder, file)
-            df.to_csv(output_file_path, index=False)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Imputes the missing hours of the per-sensor tables.')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Number of worker processes, sensors are processed serially by default (1).')
+    parser.add_argument('--min-gap-hours', type=int, default=1, help='Minimum number of consecutive missing hours to be imputed, use 24 to impute whole missing days only (1 by default).')
+    args = parser.parse_args()
 
-input_path = '../resources/NU-Heartbeat-Oct-23/data/processed/bysensor_nooutliers'
-output_path = '../resources/NU-Heartbeat-Oct-23/data/processed/bysensor_imputed'
-# input_path = '../resources/NU-Heartbeat-Oct-23/data/processed/test_input'
-# output_path = '../resources/NU-Heartbeat-Oct-23/data/processed/test_output'
+    input_path = '../resources/NU-Heartbeat-Oct-23/data/processed/bysensor_nooutliers'
+    output_path = '../resources/NU-Heartbeat-Oct-23/data/processed/bysensor_imputed'
+    # input_path = '../resources/NU-Heartbeat-Oct-23/data/processed/test_input'
+    # output_path = '../resources/NU-Heartbeat-Oct-23/data/processed/test_output'
 
-process_folder(input_path, output_path)
\ No newline at end of file
+    process_folder(input_path, output_path, args.workers, args.min_gap_hours)
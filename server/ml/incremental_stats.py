@@ -0,0 +1,285 @@
+import argparse
+import datetime
+import json
+import os
+import pickle
+import sys
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+from hourly_data import hourly_average_pipeline, to_hourly_frame
+from preprocessing import OUTLIER_THRESHOLD, complete_day_mask
+from lookup_tables import METRICS, NR_OF_DAYS, NR_OF_HOURS, normalization_params_toJSON, thresholds_toJSON, export_lookup_tables
+from sensor_store import list_sensor_tables, read_sensor_table
+from threshold_fitting import fit_thresholds
+
+# Incremental update of the normalization parameters and thresholds.
+# Instead of recomputing them from the full history (train.py), running statistics
+# are kept per (sensor, day, hour, metric) cell and merged with the new hourly data
+# fetched from the database since the last update:
+#   count, mean, m2 - Welford/Chan running statistics, std = sqrt(m2 / (count - 1)) like pandas
+#   reservoir       - ring buffer with the latest RESERVOIR_SIZE values of the cell,
+#                     used to refit the thresholds of the cells that received new data
+# The state is initialized once from the per-sensor tables used for training, --since is the end
+# of the training data (the tables hold no timestamps), from which the recorded data is merged:
+#   python ./ml/incremental_stats.py init --since 2023-11-01
+# and then updated with the hourly averages of the whole days recorded since the last update:
+#   python ./ml/incremental_stats.py update
+# The hourly averages are cleaned like the training data (remove-outliers.py) before they are merged:
+# partial days and outliers (with respect to the running statistics of their day-hour) are dropped.
+# Both commands write the normalization_params/thresholds pkl and JSON files,
+# which are picked up by predict.py (predict_worker.py) and mqttHandler.js.
+
+load_dotenv()
+
+OBJ_PATH = './ml/obj'
+STATS_PATH = f'{OBJ_PATH}/running_stats.npz'
+RESERVOIR_SIZE = 64
+MIN_THRESHOLD_SAMPLES = 3
+
+# Creates empty running statistics for the provided sensors
+def empty_stats(sensors):
+    shape = (len(sensors), NR_OF_DAYS, NR_OF_HOURS, len(METRICS))
+
+    return {
+        'sensors': np.asarray(sensors, dtype=str),
+        'count': np.zeros(shape, dtype=np.int64),
+        'mean': np.zeros(shape, dtype=np.float64),
+        'm2': np.zeros(shape, dtype=np.float64),
+        'reservoir': np.full(shape + (RESERVOIR_SIZE,), np.nan, dtype=np.float32),
+        'reservoir_next': np.zeros(shape, dtype=np.int64),
+        'last_update': np.asarray('')
+    }
+
+def load_stats(path=STATS_PATH):
+    try:
+        with np.load(path) as data:
+            return {key: data[key] for key in data.files}
+    except FileNotFoundError:
+        raise RuntimeError(f"The running statistics ({path}) are not initialized, run 'init' first.")
+
+def save_stats(stats, path=STATS_PATH):
+    # np.savez appends '.npz' to paths without it, so the temporary file keeps the extension
+    tmp_path = path[:-len('.npz')] + '.tmp.npz'
+    np.savez(tmp_path, **stats)
+    os.replace(tmp_path, path)
+
+# Merges a batch of observations into the running statistics.
+# sensor_idx, day and hour are arrays of length N, values is an (N, 3) array of the metrics.
+# Observations are reduced per cell first and then merged with Chan's parallel update,
+# so the result does not depend on how the history is split into batches.
+# Returns the boolean (S, 7, 24) mask of the cells that received new observations.
+def update_stats(stats, sensor_idx, day, hour, values):
+    shape = stats['count'].shape
+    nr_of_cells = int(np.prod(shape))
+
+    base = ((np.asarray(sensor_idx) * NR_OF_DAYS + np.asarray(day)) * NR_OF_HOURS + np.asarray(hour)) * len(METRICS)
+    cells = (base[:, None] + np.arange(len(METRICS))).ravel()
+    values = np.asarray(values, dtype=np.float64).ravel()
+
+    valid = ~np.isnan(values)
+    cells = cells[valid]
+    values = values[valid]
+
+    count_b = np.bincount(cells, minlength=nr_of_cells)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_b = np.bincount(cells, weights=values, minlength=nr_of_cells) / count_b
+    mean_b = np.nan_to_num(mean_b)
+    m2_b = np.bincount(cells, weights=(values - mean_b[cells]) ** 2, minlength=nr_of_cells)
+
+    count_a = stats['count'].reshape(-1)
+    mean_a = stats['mean'].reshape(-1)
+    m2_a = stats['m2'].reshape(-1)
+
+    count = count_a + count_b
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta = mean_b - mean_a
+        mean = np.where(count > 0, mean_a + delta * count_b / count, 0)
+        m2 = np.where(count > 0, m2_a + m2_b + delta ** 2 * count_a * count_b / count, 0)
+
+    stats['count'] = count.reshape(shape)
+    stats['mean'] = mean.reshape(shape)
+    stats['m2'] = m2.reshape(shape)
+
+    # Append the values to the ring buffers, in the order of the observations
+    order = np.argsort(cells, kind='stable')
+    cells = cells[order]
+    values = values[order]
+    rank = np.arange(len(cells)) - np.searchsorted(cells, cells)
+
+    reservoir = stats['reservoir'].reshape(nr_of_cells, RESERVOIR_SIZE)
+    reservoir_next = stats['reservoir_next'].reshape(-1)
+    keep = rank >= count_b[cells] - RESERVOIR_SIZE
+    reservoir[cells[keep], (reservoir_next[cells[keep]] + rank[keep]) % RESERVOIR_SIZE] = values[keep]
+    stats['reservoir_next'] = ((reservoir_next + count_b) % RESERVOIR_SIZE).reshape(shape)
+
+    return (count_b.reshape(shape) > 0).any(axis=-1)
+
+# Nested dict of the normalization parameters, in the format produced by train.py
+def to_normalization_params(stats):
+    count = stats['count']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        std = np.where(count > 1, np.sqrt(stats['m2'] / (count - 1)), np.nan)
+
+    normalization_params = {}
+    for sensor_idx, sensor_name in enumerate(stats['sensors']):
+        for day, hour in zip(*np.nonzero(count[sensor_idx].any(axis=-1))):
+            params = {}
+            for metric_idx, col in enumerate(METRICS):
+                params[f'mean_{col}'] = float(stats['mean'][sensor_idx, day, hour, metric_idx])
+                params[f'std_{col}'] = float(std[sensor_idx, day, hour, metric_idx])
+            normalization_params.setdefault(str(sensor_name), {}).setdefault(int(day), {})[int(hour)] = params
+
+    return normalization_params
+
+# Drops the rows the training pipeline would have removed (remove-outliers.py): the hours of partial days
+# and the outliers, whose z-score with respect to the running statistics of their day-hour exceeds
+# OUTLIER_THRESHOLD for any metric. df holds the hourly averages of to_hourly_frame(), sorted by sensor and time.
+# Returns the cleaned frame along with the number of dropped partial-day rows and outliers.
+def clean_hourly_frame(stats, df, sensor_idx):
+    if len(df) == 0:
+        return df, 0, 0
+
+    complete = pd.concat([complete_day_mask(group) for _, group in df.groupby('sensor', sort=False)]).reindex(df.index)
+
+    day = df['day'].to_numpy(dtype=int)
+    hour = df['hour'].to_numpy(dtype=int)
+    count = stats['count'][sensor_idx, day, hour]
+    mean = stats['mean'][sensor_idx, day, hour]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        std = np.sqrt(stats['m2'][sensor_idx, day, hour] / (count - 1))
+        zscores = np.abs(df[METRICS].to_numpy(dtype=np.float64) - mean) / std
+    zscores = np.where((count > 1) & (std > 0), zscores, 0)
+    outlier = (zscores > OUTLIER_THRESHOLD).any(axis=1)
+
+    keep = complete.to_numpy() & ~outlier
+    return df[keep], int((~complete).sum()), int((complete.to_numpy() & outlier).sum())
+
+# Refits the thresholds of the provided (S, 7, 24) cells on the values of their ring buffers,
+# the remaining cells keep their thresholds. All cells are fitted at once (threshold_fitting.py),
+# metrics with less than MIN_THRESHOLD_SAMPLES distinct values are left unchanged.
+def refit_thresholds(stats, thresholds, cells):
+    sensor_idx, day, hour = np.nonzero(cells)
+    values = stats['reservoir'][sensor_idx, day, hour]
+    fitted = fit_thresholds(values)
+
+    sorted_values = np.sort(values, axis=-1)
+    distinct = np.sum((np.diff(sorted_values, axis=-1) > 0), axis=-1) + (~np.isnan(sorted_values[..., 0]))
+    refit = distinct >= MIN_THRESHOLD_SAMPLES
+
+    for cell_idx, metric_idx in zip(*np.nonzero(refit)):
+        sensor_name = str(stats['sensors'][sensor_idx[cell_idx]])
+        cell_thresholds = thresholds.setdefault(sensor_name, {}).setdefault(int(day[cell_idx]), {}).setdefault(int(hour[cell_idx]), {})
+        col = METRICS[metric_idx]
+        cell_thresholds[col] = {'medium': float(fitted[cell_idx, metric_idx, 0]), 'high': float(fitted[cell_idx, metric_idx, 1])}
+
+    return int(refit.sum())
+
+def load_thresholds():
+    with open(f'{OBJ_PATH}/thresholds.pkl', 'rb') as file:
+        return pickle.load(file)
+
+# Writes the pkl and JSON artifacts along with the compiled lookup tables read by predict.py and mqttHandler.js.
+# Every file is written to a temporary path first, so readers never see a partial file.
+def save_artifacts(normalization_params, thresholds, sensors):
+    artifacts = {
+        'normalization_params.pkl': lambda file: pickle.dump(normalization_params, file),
+        'thresholds.pkl': lambda file: pickle.dump(thresholds, file),
+        'normalization_params.json': lambda file: file.write(json.dumps(normalization_params_toJSON(normalization_params), indent=4).encode()),
+        'thresholds.json': lambda file: file.write(json.dumps(thresholds_toJSON(thresholds), indent=4).encode())
+    }
+
+    for name, write in artifacts.items():
+        path = f'{OBJ_PATH}/{name}'
+        with open(path + '.tmp', 'wb') as file:
+            write(file)
+        os.replace(path + '.tmp', path)
+
+    export_lookup_tables(normalization_params, thresholds, [str(sensor) for sensor in sensors], f'{OBJ_PATH}/lookup_tables')
+
+def load_sensors():
+    with open(f'{OBJ_PATH}/sensor_label_encoder.pkl', 'rb') as file:
+        return list(pickle.load(file).classes_)
+
+# Initializes the running statistics from the per-sensor tables used for training.
+# The tables hold no timestamps, so the end of the training data (since) is provided by the caller,
+# the last update is set to the start of that day and update() merges the data recorded from then on.
+def init(dataset_path, since):
+    stats = empty_stats(load_sensors())
+    sensor_index = {str(sensor_name): idx for idx, sensor_name in enumerate(stats['sensors'])}
+
+    for sensor_name, path in list_sensor_tables(dataset_path).items():
+        if sensor_name not in sensor_index:
+            print(f"[STATS] Skipping {sensor_name}, the sensor is not known to the models.")
+            continue
+
+        df = read_sensor_table(path)
+        update_stats(stats, np.full(len(df), sensor_index[sensor_name]), df['day'].to_numpy(dtype=int),
+                     df['hour'].to_numpy(dtype=int), df[METRICS].to_numpy())
+
+    last_update = since.replace(hour=0, minute=0, second=0, microsecond=0)
+    stats['last_update'] = np.asarray(last_update.isoformat())
+    save_stats(stats)
+
+    save_artifacts(to_normalization_params(stats), load_thresholds(), stats['sensors'])
+    print(f"[STATS] Initialized the running statistics of {len(sensor_index)} sensor(s), last update set to {last_update}.")
+
+# Merges the hourly averages of the whole days recorded between the last update and the start of the current day.
+# The current day is left for the next update, since partial days are dropped by clean_hourly_frame().
+def update():
+    stats = load_stats()
+    if str(stats['last_update']) == '':
+        raise RuntimeError("The running statistics are not initialized, run 'init' first.")
+
+    start_time = datetime.datetime.fromisoformat(str(stats['last_update']))
+    end_time = datetime.datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    if end_time <= start_time:
+        print(f"[STATS] Nothing to update, last update at {start_time}.")
+        return
+
+    sensor_index = {str(sensor_name): idx for idx, sensor_name in enumerate(stats['sensors'])}
+
+    client = MongoClient(os.getenv('DB_URI'))
+    db = client['test']
+    docs = db['sensordatas'].aggregate(hourly_average_pipeline(start_time, end_time, list(sensor_index)), allowDiskUse=True)
+    df = to_hourly_frame(docs)
+    client.close()
+
+    df, partial, outliers = clean_hourly_frame(stats, df, df['sensor'].map(sensor_index).to_numpy(dtype=int))
+
+    cells = update_stats(stats, df['sensor'].map(sensor_index).to_numpy(dtype=int), df['day'].to_numpy(dtype=int),
+                         df['hour'].to_numpy(dtype=int), df[METRICS].to_numpy())
+
+    thresholds = load_thresholds()
+    refitted = refit_thresholds(stats, thresholds, cells)
+
+    stats['last_update'] = np.asarray(end_time.isoformat())
+    save_artifacts(to_normalization_params(stats), thresholds, stats['sensors'])
+    save_stats(stats)
+
+    print(f"[STATS] Merged {len(df)} hourly average(s) from {start_time} to {end_time} "
+          f"({partial} of partial days and {outliers} outlier(s) dropped), "
+          f"{int(cells.sum())} day-hour cell(s) updated, {refitted} threshold(s) refitted.")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Incremental update of the normalization parameters and thresholds.')
+    parser.add_argument('command', choices=['init', 'update'])
+    parser.add_argument('--dataset', default=os.getenv('PROCESSED_BYSENSOR_REM_DATA_PATH'),
+                        help='Folder of the per-sensor tables used to initialize the statistics.')
+    parser.add_argument('--since', type=datetime.datetime.fromisoformat, default=None,
+                        help='Day after the last day of the training data (ISO format), the recordings from then on are merged by update.')
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'init':
+            if args.since is None:
+                parser.error("--since is required by init, the per-sensor tables hold no timestamps.")
+            init(args.dataset, args.since)
+        else:
+            update()
+    except RuntimeError as err:
+        print(f"[STATS] {err}")
+        sys.exit(1)
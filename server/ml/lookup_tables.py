@@ -0,0 +1,207 @@
+import json
+import os
+import pickle
+import sys
+
+import numpy as np
+
+# Dense lookup tables for the per sensor/day/hour statistics.
+# The nested dicts produced by train.py ([sensor][day][hour]...) are compiled into
+# NumPy arrays indexed by (sensor_idx, day, hour, metric), where sensor_idx follows
+# the order of the sensor label encoder classes.
+# Keys of the nested dicts may be either integers (pickle) or strings (JSON),
+# so the tables can be compiled from both serialized formats.
+# The compiled tables are stored as a versioned artifact (see save_lookup_tables()),
+# which is memory-mapped by predict.py and read by mqttHandler.js.
+
+METRICS = ['eCO2', 'sound', 'light']
+THRESHOLD_LEVELS = ['medium', 'high']
+NR_OF_DAYS = 7
+NR_OF_HOURS = 24
+
+LOOKUP_TABLES_PATH = './ml/obj/lookup_tables'
+LOOKUP_TABLES_VERSION = 1
+MANIFEST_FILE = 'manifest.json'
+
+# Compiles normalization_params into an array of shape (sensors, days, hours, metrics, 2).
+# The last axis holds the (mean, std) pair, cells missing in the dict are set to NaN.
+def compile_normalization_table(normalization_params, sensors):
+    table = np.full((len(sensors), NR_OF_DAYS, NR_OF_HOURS, len(METRICS), 2), np.nan)
+
+    for sensor_idx, sensor in enumerate(sensors):
+        for day, hours in normalization_params.get(sensor, {}).items():
+            for hour, values in hours.items():
+                table[sensor_idx, int(day), int(hour)] = [[values[f'mean_{col}'], values[f'std_{col}']] for col in METRICS]
+
+    return table
+
+# Applies the per day-hour z-score normalization to values of shape (..., metrics).
+# sensor_idx, day and hour are broadcast against the leading dimensions of values.
+# Metrics with a standard deviation of 0 are normalized to 0.
+def normalize(table, values, sensor_idx, day, hour):
+    params = table[sensor_idx, day, hour]
+    mean, std = params[..., 0], params[..., 1]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(std == 0, 0, (values - mean) / std)
+
+# Inverse of normalize(), maps the z-scores back to the original scale.
+def denormalize(table, values, sensor_idx, day, hour):
+    params = table[sensor_idx, day, hour]
+    mean, std = params[..., 0], params[..., 1]
+
+    return values * std + mean
+
+# Compiles thresholds into an array of shape (sensors, days, hours, metrics, 2).
+# The last axis holds the ('medium', 'high') thresholds, cells missing in the dict are set to NaN.
+def compile_threshold_table(thresholds, sensors):
+    table = np.full((len(sensors), NR_OF_DAYS, NR_OF_HOURS, len(METRICS), len(THRESHOLD_LEVELS)), np.nan)
+
+    for sensor_idx, sensor in enumerate(sensors):
+        for day, hours in thresholds.get(sensor, {}).items():
+            for hour, cols in hours.items():
+                table[sensor_idx, int(day), int(hour)] = [[cols[col][level] for level in THRESHOLD_LEVELS] for col in METRICS]
+
+    return table
+
+# Calculates the color codes for values of shape (..., metrics).
+# A metric counts as high when it exceeds the 'high' threshold, as medium when it only exceeds the 'medium' one.
+# Two or more high metrics result in 'red', two or more medium metrics
+# or a high and a medium metric result in 'orange', anything else is 'green'.
+def classify_color_codes(table, values, sensor_idx, day, hour):
+    levels = table[sensor_idx, day, hour]
+
+    is_high = values > levels[..., 1]
+    is_medium = ~is_high & (values > levels[..., 0])
+    high_count = is_high.sum(axis=-1)
+    medium_count = is_medium.sum(axis=-1)
+
+    return np.select(
+        [high_count >= 2, medium_count >= 2, (high_count >= 1) & (medium_count >= 1)],
+        ['red', 'orange', 'orange'],
+        'green'
+    )
+
+# Converters of the nested dicts into their JSON representation (string keys)
+def normalization_params_toJSON(normalization_params):
+    json_obj = {}
+    for sensor_name, days in normalization_params.items():
+        sensor_data = {}
+        for day, hours in days.items():
+            day_data = {}
+            for hour, values in hours.items():
+                key = f"{hour}"
+                day_data[key] = {
+                    'std_eCO2': values['std_eCO2'],
+                    'mean_eCO2': values['mean_eCO2'],
+                    'std_sound': values['std_sound'],
+                    'mean_sound': values['mean_sound'],
+                    'std_light': values['std_light'],
+                    'mean_light': values['mean_light'],
+                }
+            sensor_data[str(day)] = day_data
+        json_obj[sensor_name] = sensor_data
+
+    return json_obj
+
+def thresholds_toJSON(thresholds):
+    json_obj = {}
+    for sensor_name, days in thresholds.items():
+        sensor_data = {}
+        for day, hours in days.items():
+            day_data = {}
+            for hour, cols in hours.items():
+                hour_data = {}
+                for col, levels in cols.items():
+                    col_data = {}
+                    for level, value in levels.items():
+                        col_data[level] = value
+                    hour_data[col] = col_data
+                day_data[str(hour)] = hour_data
+            sensor_data[str(day)] = day_data
+        json_obj[sensor_name] = sensor_data
+    return json_obj
+
+# Writes the compiled tables as a versioned artifact in the provided folder:
+#   normalization.npy - float32 (sensors, days, hours, metrics, [mean, std]) table
+#   thresholds.npy    - float32 (sensors, days, hours, metrics, [medium, high]) table
+#   manifest.json     - version, sensor index, axis labels and the shape, dtype and
+#                       data offset of every table, so they can be read without a .npy parser
+# Every file is written to a temporary path first and the manifest is replaced last.
+def save_lookup_tables(folder, sensors, normalization_table, threshold_table):
+    os.makedirs(folder, exist_ok=True)
+
+    manifest = {
+        'version': LOOKUP_TABLES_VERSION,
+        'sensors': [str(sensor) for sensor in sensors],
+        'days': NR_OF_DAYS,
+        'hours': NR_OF_HOURS,
+        'metrics': METRICS,
+        'tables': {}
+    }
+
+    tables = {
+        'normalization': (normalization_table, ['mean', 'std']),
+        'thresholds': (threshold_table, THRESHOLD_LEVELS)
+    }
+    for name, (table, levels) in tables.items():
+        table = np.ascontiguousarray(table, dtype='<f4')
+        path = os.path.join(folder, f'{name}.npy')
+
+        with open(path + '.tmp', 'wb') as file:
+            np.save(file, table)
+        offset = os.path.getsize(path + '.tmp') - table.nbytes
+        os.replace(path + '.tmp', path)
+
+        manifest['tables'][name] = {
+            'file': f'{name}.npy',
+            'dtype': 'float32',
+            'byte_order': 'little',
+            'shape': list(table.shape),
+            'offset': offset,
+            'levels': levels
+        }
+
+    path = os.path.join(folder, MANIFEST_FILE)
+    with open(path + '.tmp', 'w') as file:
+        json.dump(manifest, file)
+    os.replace(path + '.tmp', path)
+
+# Loads the artifact written by save_lookup_tables().
+# Returns the sensor index and the memory-mapped normalization and threshold tables.
+def load_lookup_tables(folder=LOOKUP_TABLES_PATH, mmap_mode='r'):
+    with open(os.path.join(folder, MANIFEST_FILE), 'r') as file:
+        manifest = json.load(file)
+
+    if manifest['version'] != LOOKUP_TABLES_VERSION:
+        raise ValueError(f"Unsupported lookup tables version: {manifest['version']}")
+
+    normalization_table = np.load(os.path.join(folder, manifest['tables']['normalization']['file']), mmap_mode=mmap_mode)
+    threshold_table = np.load(os.path.join(folder, manifest['tables']['thresholds']['file']), mmap_mode=mmap_mode)
+
+    return manifest['sensors'], normalization_table, threshold_table
+
+# Compiles and saves the artifact from the nested dicts
+def export_lookup_tables(normalization_params, thresholds, sensors, folder=LOOKUP_TABLES_PATH):
+    save_lookup_tables(
+        folder,
+        sensors,
+        compile_normalization_table(normalization_params, sensors),
+        compile_threshold_table(thresholds, sensors)
+    )
+
+# Generates the artifact from the pickled dicts of the provided obj folder, e.g.
+# python ./ml/lookup_tables.py ./ml/obj
+if __name__ == '__main__':
+    obj_path = sys.argv[1] if len(sys.argv) > 1 else './ml/obj'
+
+    with open(os.path.join(obj_path, 'normalization_params.pkl'), 'rb') as file:
+        normalization_params = pickle.load(file)
+
+    with open(os.path.join(obj_path, 'thresholds.pkl'), 'rb') as file:
+        thresholds = pickle.load(file)
+
+    with open(os.path.join(obj_path, 'sensor_label_encoder.pkl'), 'rb') as file:
+        sensors = list(pickle.load(file).classes_)
+
+    export_lookup_tables(normalization_params, thresholds, sensors, os.path.join(obj_path, 'lookup_tables'))
@@ -0,0 +1,45 @@
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+# Process pool execution of the per-sensor preprocessing stages.
+# Sensors are independent, so every sensor is handled as a separate task.
+
+# Default number of worker processes, can be overridden with the PREPROCESS_WORKERS env variable
+DEFAULT_WORKERS = int(os.getenv('PREPROCESS_WORKERS', 1))
+
+# Runs func(*args) for every entry of tasks (dict of sensor name -> args).
+# With a single worker the tasks run serially in the current process.
+# Returns the results (dict of sensor name -> return value, in the order of tasks)
+# and the failures (dict of sensor name -> formatted exception), a failing sensor
+# does not abort the remaining ones.
+def run_per_sensor(func, tasks, workers=DEFAULT_WORKERS):
+    results = {}
+    failures = {}
+
+    if workers <= 1:
+        for sensor_name, args in tasks.items():
+            try:
+                results[sensor_name] = func(*args)
+            except Exception:
+                failures[sensor_name] = traceback.format_exc()
+
+        return results, failures
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {sensor_name: executor.submit(func, *args) for sensor_name, args in tasks.items()}
+
+        for sensor_name, future in futures.items():
+            try:
+                results[sensor_name] = future.result()
+            except Exception:
+                failures[sensor_name] = traceback.format_exc()
+
+    return results, failures
+
+# Prints the summary of a run_per_sensor() call along with the errors of failed sensors
+def report_failures(stage, results, failures):
+    print(f"[{stage}] Processed {len(results)} sensor(s), {len(failures)} failed.")
+
+    for sensor_name, error in failures.items():
+        print(f"[{stage}] Failed to process {sensor_name}:\n{error}")
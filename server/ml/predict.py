@@ -1,45 +1,154 @@
-from keras.models import load_model
-from pymongo import MongoClient
+import time
+IMPORT_START = time.perf_counter()
+
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
-import pandas as pd
+import numpy as np
 import pickle
+import json
 import os
 import sys
-import tensorflow as tf
 import argparse
 
+from lookup_tables import compile_normalization_table, compile_threshold_table, normalize, denormalize, classify_color_codes, \
+    load_lookup_tables, LOOKUP_TABLES_PATH, MANIFEST_FILE
+from rollup import ROLLUP_COLLECTION, update_rollup, find_buckets
+
+# Heavy modules (pandas, TensorFlow/Keras or the TFLite runtime) are imported when they are first needed,
+# the time spent on the module level imports is reported by --profile-startup
+IMPORT_TIME = time.perf_counter() - IMPORT_START
+
+# Maximum number of sensors passed through a model in a single forward pass
+INFERENCE_BATCH_SIZE = 1024
+
+# Maximum number of upserts sent to the database in a single bulk write
+WRITE_BATCH_SIZE = 1000
+
+# Number of hours in the input window and predicted by a single forward pass of the models.
+# Longer horizons are forecasted recursively in steps of MODEL_HORIZON hours.
+WINDOW_SIZE = 6
+MODEL_HORIZON = 3
+MAX_HORIZON = 24
+
+# Model types of the forecasts, the ensemble forecast is the weighted average of the other ones.
+# Weights can be set with the ENSEMBLE_WEIGHTS env variable, e.g. '0.4,0.3,0.3' (in the order of MODEL_TYPES).
+MODEL_TYPES = ["LSTM", "GRU", "CNN"]
+ENSEMBLE_MODEL_TYPE = "ENSEMBLE"
+
 # Disable AVX warnings (might also disable errors output)
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3' 
 load_dotenv()
 
-# Load XLSX data to match Device IDs with room types
-XLSX_data = pd.read_excel(os.getenv('ROOM_DATA_PATH'))
-roomtype_mapping = dict(zip(
-    XLSX_data['Device ID'].dropna(),
-    XLSX_data['Room type'].dropna()
-))
+# Inference backend of the models ('keras' or 'tflite'), can be set with the PREDICT_BACKEND env variable
+DEFAULT_BACKEND = os.getenv('PREDICT_BACKEND', 'keras')
+TFLITE_MODELS_PATH = './ml/models/tflite'
+
+# Cache of the room types read from the XLSX file, invalidated when the file changes
+ROOMTYPE_CACHE_PATH = './ml/obj/roomtype_mapping.json'
+
+# Number of sensors and forecast upserts, reported next to the timings by --profile-startup
+PROFILE_COUNTERS = ['sensors', 'raw_fallback', 'matched', 'modified', 'upserted', 'failed']
+
+# Load XLSX data to match Device IDs with room types.
+# The mapping is cached as JSON along with the path, size and modification time of the XLSX file,
+# so the file is only parsed again when it changes.
+def load_room_data():
+    global roomtype_mapping
+    
+    xlsx_path = os.getenv('ROOM_DATA_PATH')
+    source = {
+        'path': os.path.abspath(xlsx_path),
+        'size': os.path.getsize(xlsx_path),
+        'mtime': os.path.getmtime(xlsx_path)
+    }
+    
+    try:
+        with open(ROOMTYPE_CACHE_PATH, 'r') as file:
+            cache = json.load(file)
+        if cache['source'] == source:
+            roomtype_mapping = cache['mapping']
+            return
+    except (OSError, ValueError, KeyError):
+        pass
+    
+    import pandas as pd
+    
+    XLSX_data = pd.read_excel(xlsx_path)
+    roomtype_mapping = dict(zip(
+        XLSX_data['Device ID'].dropna(),
+        XLSX_data['Room type'].dropna()
+    ))
+    
+    with open(ROOMTYPE_CACHE_PATH + '.tmp', 'w') as file:
+        json.dump({'source': source, 'mapping': roomtype_mapping}, file)
+    os.replace(ROOMTYPE_CACHE_PATH + '.tmp', ROOMTYPE_CACHE_PATH)
 
 # Add parsing of command line args
-parser = argparse.ArgumentParser(description='Description of your script')
-parser.add_argument('--hist', action='store_true', default=True, help='Use this flag for predicting based on historical data (past 6 hours). This flag is used by default.')
-parser.add_argument('--live', action='store_true', help='Use this flag for predicting based on live data (past 6 hours + current hour).')
-args = parser.parse_args()
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Description of your script')
+    parser.add_argument('--hist', action='store_true', default=True, help='Use this flag for predicting based on historical data (past 6 hours). This flag is used by default.')
+    parser.add_argument('--live', action='store_true', help='Use this flag for predicting based on live data (past 6 hours + current hour).')
+    parser.add_argument('--fetch-batch-size', type=int, default=0, help='Number of sensors fetched per aggregation. All sensors are fetched in a single aggregation by default (0).')
+    parser.add_argument('--backend', choices=['keras', 'tflite'], default=DEFAULT_BACKEND, help='Inference backend of the models. The TFLite models have to be exported with tflite_export.py first.')
+    parser.add_argument('--no-ensemble', dest='ensemble', action='store_false', help='Use this flag for running the models one after another instead of the fused ensemble model, no ensemble forecast is made.')
+    parser.add_argument('--profile-startup', action='store_true', help='Use this flag for printing the time spent in each phase of the run (imports, XLSX, pickles, models, DB, inference, writes).')
+    parser.add_argument('--source', choices=['rollup', 'raw'], default='rollup', help='Source of the hourly averages: the hourly rollup collection (default), falling back to the raw readings for the sensors whose buckets are missing or incomplete, or the raw readings.')
+    parser.add_argument('--update-rollup', action='store_true', help='Use this flag for rolling up the new hours (rollup.py) before reading the rollup collection, by default it is only read.')
+    parser.add_argument('--horizon', type=int, default=MODEL_HORIZON, help=f'Number of hours to forecast, a multiple of {MODEL_HORIZON} up to {MAX_HORIZON}. Hours beyond {MODEL_HORIZON} are forecasted recursively.')
+    parsed_args = parser.parse_args(argv)
+
+    if parsed_args.horizon % MODEL_HORIZON != 0 or not MODEL_HORIZON <= parsed_args.horizon <= MAX_HORIZON:
+        parser.error(f"--horizon must be a multiple of {MODEL_HORIZON} between {MODEL_HORIZON} and {MAX_HORIZON}.")
 
-if args.live:
-    print("Flag --live is used.")
-    args.hist = False
+    if parsed_args.live:
+        print("Flag --live is used.")
+        parsed_args.hist = False
 
-if args.hist:
-    print("Flag --hist is used.")
+    if parsed_args.hist:
+        print("Flag --hist is used.")
+    
+    return parsed_args
 
-# Load saved models
-def load_saved_model():
-    global model_LSTM, model_GRU, model_CNN
+# Imports the runtime of the inference backend.
+# The TFLite models are run without importing TensorFlow/Keras (see tflite_backend.py).
+def import_backend(backend=DEFAULT_BACKEND):
+    global load_model, EnsembleModel, TFLiteModel, TFLiteEnsembleModel
+    
+    if backend == 'tflite':
+        from tflite_backend import TFLiteModel, TFLiteEnsembleModel
+    else:
+        from keras.models import load_model
+        from ensemble import EnsembleModel
+
+# Load saved models, either the Keras .h5 models or their TFLite export (tflite_export.py)
+def load_saved_model(backend=DEFAULT_BACKEND):
+    global model_LSTM, model_GRU, model_CNN, model_ensemble
+    
+    import_backend(backend)
+    
+    if backend == 'tflite':
+        model_LSTM = TFLiteModel(f'{TFLITE_MODELS_PATH}/model_LSTM.tflite')
+        model_GRU = TFLiteModel(f'{TFLITE_MODELS_PATH}/model_GRU.tflite')
+        model_CNN = TFLiteModel(f'{TFLITE_MODELS_PATH}/model_CNN.tflite')
+        model_ensemble = TFLiteEnsembleModel([model_LSTM, model_GRU, model_CNN], get_ensemble_weights())
+        return
     
     model_LSTM = load_model('./ml/models/model_LSTM.h5')
     model_GRU = load_model('./ml/models/model_GRU.h5')
     model_CNN = load_model('./ml/models/model_CNN.h5')
+    model_ensemble = EnsembleModel([model_LSTM, model_GRU, model_CNN], get_ensemble_weights())
+
+# Weights of the ensemble forecast, equal by default, normalized to a sum of 1
+def get_ensemble_weights():
+    weights = os.getenv('ENSEMBLE_WEIGHTS')
+    weights = [float(weight) for weight in weights.split(',')] if weights else [1.0] * len(MODEL_TYPES)
+
+    if len(weights) != len(MODEL_TYPES) or sum(weights) <= 0:
+        raise ValueError(f"ENSEMBLE_WEIGHTS must contain {len(MODEL_TYPES)} weights with a positive sum.")
+
+    return [weight / sum(weights) for weight in weights]
 
 # Load additional serialized data for processing data
 def load_obj_data():
@@ -48,13 +157,9 @@ def load_obj_data():
     global sensor_label_encoder
     global x_test_example
     global roomtype_label_encoder
+    global normalization_table
+    global threshold_table
     
-    with open('./ml/obj/normalization_params.pkl', 'rb') as file:
-        normalization_params = pickle.load(file)
-    
-    with open('./ml/obj/thresholds.pkl', 'rb') as file:
-        thresholds = pickle.load(file)
-        
     with open('./ml/obj/sensor_label_encoder.pkl', 'rb') as file:
         sensor_label_encoder = pickle.load(file)
         
@@ -63,316 +168,407 @@ def load_obj_data():
         
     with open('./ml/obj/test_input.pkl', 'rb') as file:
         x_test_example = pickle.load(file)
+    
+    # The memory-mapped lookup tables are used when they match the sensor label encoder,
+    # otherwise the tables are compiled from the pickled dicts
+    if os.path.exists(f'{LOOKUP_TABLES_PATH}/{MANIFEST_FILE}'):
+        sensors, normalization_table, threshold_table = load_lookup_tables(LOOKUP_TABLES_PATH)
+        if sensors == [str(sensor) for sensor in sensor_label_encoder.classes_]:
+            return
+        print("Sensors of the lookup tables do not match the sensor label encoder, loading the pickled dicts.")
 
-# Loads the historical/live data (past 6 hours w/ or w/o current hour recordings)
-# Calls predict() function for every sensor, for which the recordings for the past 6 hours exist
-def db_handler():
-    global client, db, SensorData, Prediction
+    with open('./ml/obj/normalization_params.pkl', 'rb') as file:
+        normalization_params = pickle.load(file)
+    
+    with open('./ml/obj/thresholds.pkl', 'rb') as file:
+        thresholds = pickle.load(file)
+    
+    normalization_table = compile_normalization_table(normalization_params, sensor_label_encoder.classes_)
+    threshold_table = compile_threshold_table(thresholds, sensor_label_encoder.classes_)
+
+# Builds the aggregation pipeline for the historical/live data of the provided sensors.
+# Groups the recordings by sensor, day and hour, so a single aggregation
+# returns the hourly averages of every sensor in the list.
+def build_pipeline(sensors, start_time, end_time, current_time):
+    if args.hist:
+        match_end = end_time
+        hour_expr = {"$hour": "$timestamp"}
+    elif args.live:
+        match_end = current_time
+        hour_expr = {
+            "$cond": {
+                "if": {"$eq": [{"$hour": "$timestamp"}, current_time.hour]},
+                "then": current_time.hour-1,
+                "else": {"$hour": "$timestamp"}
+            }
+        }
+
+    return [
+        {
+            "$match": {
+                "sensor": {"$in": list(sensors)},
+                "timestamp": {
+                    "$gte": start_time,
+                    "$lt": match_end
+                }
+            }
+        },
+        {
+            "$group": {
+                "_id": {
+                    "sensor": "$sensor",
+                    "hour": hour_expr,
+                    "dayOfWeek": {"$subtract": [{"$dayOfWeek": "$timestamp"}, 1]}
+                },
+                "avg_eCO2": {"$avg": "$eCO2"},
+                "avg_sound": {"$avg": "$sound"},
+                "avg_color_r": {"$avg": "$color_r"},
+                "avg_color_g": {"$avg": "$color_g"},
+                "avg_color_b": {"$avg": "$color_b"}
+            }
+        },
+        {
+            "$addFields": {
+                "hour_category": {
+                    "$cond": {
+                        "if": {"$lt": ["$_id.hour", start_time.hour]},
+                        "then": 1,
+                        "else": 0
+                    }
+                },
+                "day": "$_id.dayOfWeek",
+            }
+        },
+        {
+            "$sort": {
+                "_id.sensor": 1,
+                "hour_category": 1,
+                "_id.hour": 1
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "hour": {
+                    "$mod": [
+                        { "$add": ["$_id.hour", 1] },
+                        24
+                    ]
+                },
+                "sensor": "$_id.sensor",
+                "eCO2": "$avg_eCO2",
+                "sound": "$avg_sound",
+                "color_r": "$avg_color_r",
+                "color_g": "$avg_color_g",
+                "color_b": "$avg_color_b",
+                "day": {
+                    "$cond": {
+                        "if": { "$eq": ["$_id.hour", 23] },
+                        "then": {"$mod": [{"$add": ["$_id.dayOfWeek", 1]}, 7]},
+                        "else": "$_id.dayOfWeek"
+                    }
+                }
+            }
+        }
+    ]
+
+# Fetches the hourly averages for all provided sensors.
+# Sensors are queried in chunks of args.fetch_batch_size (all at once by default),
+# the results are split per sensor in memory, keeping the order returned by the pipeline.
+def fetch_sensor_data(sensors, start_time, end_time, current_time):
+    batch_size = args.fetch_batch_size if args.fetch_batch_size > 0 else len(sensors)
+    sensor_data = {sensor: [] for sensor in sensors}
+
+    for i in range(0, len(sensors), max(batch_size, 1)):
+        pipeline = build_pipeline(sensors[i:i+batch_size], start_time, end_time, current_time)
+        for hourlyData in SensorData.aggregate(pipeline):
+            sensor_data[hourlyData['sensor']].append(hourlyData)
+
+    return sensor_data
+
+# Merges the readings of another bucket into a bucket of the rollup collection,
+# the merged bucket is only complete if both buckets are
+def merge_buckets(bucket, other):
+    count = bucket['count'] + other['count']
+    for col in ['eCO2', 'sound', 'color_r', 'color_g', 'color_b']:
+        bucket[col] = (bucket[col] * bucket['count'] + other[col] * other['count']) / count
+    bucket['count'] = count
+    bucket['complete'] = bucket.get('complete', False) and other.get('complete', False)
+
+# Adds a bucket of the rollup collection to the data of its sensor.
+# With --live the bucket of the last hour is merged into the previous one (weighted by the number
+# of readings), like build_pipeline() averages the readings of the last hour into the previous hour.
+def append_bucket(sensor_data, bucket, end_time):
+    data = sensor_data[bucket['sensor']]
+    if bucket['timestamp'] >= end_time:
+        bucket['timestamp'] = end_time - timedelta(hours=1)
+        if len(data) > 0 and data[-1]['timestamp'] == bucket['timestamp']:
+            merge_buckets(data[-1], bucket)
+            return
+    data.append(bucket)
+
+# Sets the 'hour' and 'day' of the buckets to the end of the bucket, like build_pipeline()
+def label_buckets(sensor_data):
+    for data in sensor_data.values():
+        for bucket in data:
+            bucket_end = bucket['timestamp'] + timedelta(hours=1)
+            bucket['hour'] = bucket_end.hour
+            bucket['day'] = bucket_end.isoweekday() % 7
+
+    return sensor_data
+
+# End of the rollup buckets fetched for a window ending at end_time, --live includes the last hour
+def rollup_fetch_end(end_time):
+    return end_time + timedelta(hours=1) if args.live else end_time
+
+# Fetches the hourly buckets of the rollup collection (rollup.py) for all provided sensors,
+# in the format of build_pipeline(): 'hour' and 'day' refer to the end of the bucket.
+def fetch_rollup_data(sensors, start_time, end_time):
+    batch_size = args.fetch_batch_size if args.fetch_batch_size > 0 else len(sensors)
+    sensor_data = {sensor: [] for sensor in sensors}
+
+    for i in range(0, len(sensors), max(batch_size, 1)):
+        for bucket in find_buckets(HourlySensorData, sensors[i:i+batch_size], start_time, rollup_fetch_end(end_time)):
+            append_bucket(sensor_data, bucket, end_time)
+
+    return label_buckets(sensor_data)
+
+# Returns the sensors whose 6-hour window can not be taken from the rollup collection:
+# buckets are missing or were rolled up before all readings of their hour arrived.
+# With --live the bucket of the current hour is never complete, so the raw readings are used.
+def incomplete_sensors(sensor_data):
+    return [
+        sensor for sensor, data in sensor_data.items()
+        if len(data) != WINDOW_SIZE or not all(bucket.get('complete', False) for bucket in data)
+    ]
+
+# Replaces the data of the sensors with incomplete rollup windows with the averages of their raw readings.
+# Returns the number of replaced sensors.
+def fill_from_raw(sensor_data, start_time, end_time, current_time):
+    sensors = incomplete_sensors(sensor_data)
+    if len(sensors) > 0:
+        sensor_data.update(fetch_sensor_data(sensors, start_time, end_time, current_time))
+
+    return len(sensors)
+
+# Database client, created once and reused by subsequent db_handler() calls
+client = None
+
+# Connects to the database
+def connect_db():
+    global client, db, SensorData, HourlySensorData, Prediction
     
     client = MongoClient(os.getenv('DB_URI'))
     db = client['test']
     SensorData = db['sensordatas']
+    HourlySensorData = db[ROLLUP_COLLECTION]
     Prediction = db['predictions']
-    
+
+# Returns the current time (an hour ago, see build_pipeline()) and the start and end of the 6-hour input window
+def get_time_window():
     current_time = datetime.now().replace(microsecond=0) - timedelta(hours=1)
     start_time = current_time.replace(minute=0, second=0, microsecond=0) - timedelta(hours=6)
     end_time = current_time.replace(minute=0, second=0, microsecond=0)
     
-    sensorlist = sensor_label_encoder.classes_
+    return current_time, start_time, end_time
+
+# Loads the historical/live data (past 6 hours w/ or w/o current hour recordings),
+# from the hourly rollup collection or the raw readings (--source raw).
+# The rollup collection is only read, it is brought up to date by the scheduled rollup job (or --update-rollup),
+# the sensors with missing or incomplete buckets are read from the raw readings instead.
+# Calls predict() function for every sensor, for which the recordings for the past 6 hours exist
+# Returns the time (in seconds) spent in each stage of the run.
+def db_handler():
+    timings = {}
+    stage_start = time.perf_counter()
+    
+    if client is None:
+        connect_db()
+    
+    current_time, start_time, end_time = get_time_window()
+    
+    sensorlist = list(sensor_label_encoder.classes_)
     # sensorlist = ["thingy071"]
     
-    for sensor in sensorlist:
-        if args.hist:
-            pipeline = [
-                {
-                    "$match": {
-                        "sensor": sensor,
-                        "timestamp": {
-                            "$gte": start_time,
-                            "$lt": end_time
-                        }
-                    }
-                },
-                {
-                    "$group": {
-                        "_id": {
-                            "hour": {"$hour": "$timestamp"},
-                            "dayOfWeek": {"$subtract": [{"$dayOfWeek": "$timestamp"}, 1]}
-                        },
-                        "avg_eCO2": {"$avg": "$eCO2"},
-                        "avg_sound": {"$avg": "$sound"},
-                        "avg_color_r": {"$avg": "$color_r"},
-                        "avg_color_g": {"$avg": "$color_g"},
-                        "avg_color_b": {"$avg": "$color_b"}
-                    }
-                },
-                {
-                    "$addFields": {
-                        "hour_category": {
-                            "$cond": {
-                                "if": {"$lt": ["$_id.hour", start_time.hour]},
-                                "then": 1,
-                                "else": 0
-                            }
-                        },
-                        "day": "$_id.dayOfWeek",
-                    }
-                },
-                {
-                    "$sort": {
-                        "hour_category": 1,
-                        "_id.hour": 1
-                    }
-                },
-                {
-                    "$project": {
-                        "_id": 0,
-                        "hour": {
-                            "$mod": [
-                                { "$add": ["$_id.hour", 1] },
-                                24
-                            ]
-                        },
-                        "sensor": sensor,
-                        "eCO2": "$avg_eCO2",
-                        "sound": "$avg_sound",
-                        "color_r": "$avg_color_r",
-                        "color_g": "$avg_color_g",
-                        "color_b": "$avg_color_b",
-                        "day": {
-                            "$cond": {
-                                "if": { "$eq": ["$_id.hour", 23] },
-                                "then": {"$mod": [{"$add": ["$_id.dayOfWeek", 1]}, 7]},
-                                "else": "$_id.dayOfWeek"
-                            }
-                        }
-                    }
-                }
-            ]
-        elif args.live:
-            pipeline = [
-                {
-                    "$match": {
-                        "sensor": sensor,
-                        "timestamp": {
-                            "$gte": start_time,
-                            "$lt": current_time
-                        }
-                    }
-                },
-                {
-                    "$group": {
-                        "_id": {
-                            "hour": {
-                                "$cond": {
-                                    "if": {"$eq": [{"$hour": "$timestamp"}, current_time.hour]},
-                                    "then": current_time.hour-1,
-                                    "else": {"$hour": "$timestamp"}
-                                }
-                            },
-                            "dayOfWeek": {"$subtract": [{"$dayOfWeek": "$timestamp"}, 1]}
-                        },
-                        "avg_eCO2": {"$avg": "$eCO2"},
-                        "avg_sound": {"$avg": "$sound"},
-                        "avg_color_r": {"$avg": "$color_r"},
-                        "avg_color_g": {"$avg": "$color_g"},
-                        "avg_color_b": {"$avg": "$color_b"}
-                    }
-                },
-                {
-                    "$addFields": {
-                        "hour_category": {
-                            "$cond": {
-                                "if": {"$lt": ["$_id.hour", start_time.hour]},
-                                "then": 1,
-                                "else": 0
-                            }
-                        },
-                        "day": "$_id.dayOfWeek",
-                    }
-                },
-                {
-                    "$sort": {
-                        "hour_category": 1,
-                        "_id.hour": 1
-                    }
-                },
-                {
-                    "$project": {
-                        "_id": 0,
-                        "hour": {
-                            "$mod": [
-                                { "$add": ["$_id.hour", 1] },
-                                24
-                            ]
-                        },
-                        "sensor": sensor,
-                        "eCO2": "$avg_eCO2",
-                        "sound": "$avg_sound",
-                        "color_r": "$avg_color_r",
-                        "color_g": "$avg_color_g",
-                        "color_b": "$avg_color_b",
-                        "day": {
-                            "$cond": {
-                                "if": { "$eq": ["$_id.hour", 23] },
-                                "then": {"$mod": [{"$add": ["$_id.dayOfWeek", 1]}, 7]},
-                                "else": "$_id.dayOfWeek"
-                            }
-                        }
-                    }
-                }
-            ]
-        
-        data = list(SensorData.aggregate(pipeline))
-        
-        if (len(data) == 6):
-            global labels
-            
-            labels = get_labels(data)
-            data = preprocess_input(data)
-            
-            df_predictions = predict("LSTM", data)
-            save_predictions("LSTM", df_predictions)
-            
-            df_predictions = predict("GRU", data)
-            save_predictions("GRU", df_predictions)
-            
-            df_predictions = predict("CNN", data)
-            save_predictions("CNN", df_predictions)
-            
-def calcColorCode(row):
-    highCounter = 0
-    midCounter = 0
-        
-    # for metric in ['eCO2', 'light', 'sound']:
-    #     if row[metric] > thresholds[row['sensor']][row['day']][row['hour']][metric]['high']:
-    #         return 'red'
-    #     elif row[metric] > thresholds[row['sensor']][row['day']][row['hour']][metric]['medium']:
-    #         return 'orange'
-    
-    for metric in ['eCO2', 'light', 'sound']:
-        if row[metric] > thresholds[row['sensor']][row['day']][row['hour']][metric]['high']:
-            highCounter += 1
-        elif row[metric] > thresholds[row['sensor']][row['day']][row['hour']][metric]['medium']:
-            midCounter += 1
-        
-    if highCounter >= 2:
-        return 'red'
-    if midCounter >= 2:
-        return 'orange'
-    if highCounter >= 1 and midCounter >= 1:
-        return 'orange'
-
-    return 'green'
-                    
-def preprocess_input(data):
-    for hourlyData in data:
-        hourlyData['light'] = int((hourlyData['color_r'] + hourlyData['color_g'] + hourlyData['color_b']) / 3)
-        hourlyData['sound'] = int(hourlyData['sound'])
-        hourlyData['eCO2'] = int(hourlyData['eCO2'])
-        del hourlyData['color_r']
-        del hourlyData['color_g']
-        del hourlyData['color_b']
-    
-    df = pd.DataFrame(data)
+    if args.source == 'rollup':
+        if args.update_rollup:
+            update_rollup(db)
+            timings['rollup'] = time.perf_counter() - stage_start
+            stage_start = time.perf_counter()
+        sensor_data = fetch_rollup_data(sensorlist, start_time, end_time)
+        timings['raw_fallback'] = fill_from_raw(sensor_data, start_time, end_time, current_time)
+    else:
+        sensor_data = fetch_sensor_data(sensorlist, start_time, end_time, current_time)
+    timings['fetch'] = time.perf_counter() - stage_start
+    stage_start = time.perf_counter()
     
-    # Normalize metrics
-    for index, row in df.iterrows():
-        cols = ['eCO2', 'sound', 'light']
-        for col in cols:
-            mean = normalization_params[row['sensor']][row['day']][row['hour']][f"mean_{col}"]
-            std = normalization_params[row['sensor']][row['day']][row['hour']][f"std_{col}"]
+    # Stack the input of every sensor with a complete 6-hour window into a single batch
+    batch_data = [sensor_data[sensor] for sensor in sensorlist if len(sensor_data[sensor]) == WINDOW_SIZE]
+    batch_labels = [get_labels(data, args.horizon) for data in batch_data]
+    
+    if len(batch_data) == 0:
+        timings['preprocess'] = time.perf_counter() - stage_start
+        timings['sensors'] = 0
+        print("No sensors with complete data for the past 6 hours.")
+        return timings
+    
+    x_batch = preprocess_input(batch_data, batch_labels)
+    timings['preprocess'] = time.perf_counter() - stage_start
+    timings['sensors'] = len(batch_data)
+    
+    timings['inference'] = 0
+    timings['save'] = 0
+    
+    updated_at = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+    
+    stage_start = time.perf_counter()
+    forecasts = run_forecasts(x_batch, batch_labels)
+    timings['inference'] += time.perf_counter() - stage_start
+    
+    stage_start = time.perf_counter()
+    operations = build_operations(forecasts, updated_at)
+    timings['save'] += time.perf_counter() - stage_start
+    
+    stage_start = time.perf_counter()
+    timings.update(save_predictions(operations))
+    timings['save'] += time.perf_counter() - stage_start
+    
+    return timings
             
-            if std == 0:
-                df.at[index, col] = 0
-            else:
-                df.at[index, col] = (row[col] - mean) / std
-                
-    # One-hot encode day field
-    present_days = set(df['day'])
-    missing_days = set(range(7)) - present_days
-    for day in missing_days:
-        df[f'day_{day}'] = 0
-    one_hot_encoded = pd.get_dummies(df['day'], prefix='day')
-    df = pd.concat([df, one_hot_encoded], axis=1)
-    df.drop('day', axis=1, inplace=True)
+# Runs the fused ensemble model (or the models one after another with --no-ensemble) on a batch of inputs.
+# Returns a dict of model type -> the forecasts of the batch.
+def run_forecasts(x_batch, batch_labels):
+    if args.ensemble:
+        return predict_ensemble(x_batch, batch_labels)
+    
+    return {model_type: predict(model_type, x_batch, batch_labels) for model_type in MODEL_TYPES}
+
+# Builds the upserts of the forecasts returned by run_forecasts()
+def build_operations(forecasts, updated_at):
+    return [
+        build_prediction_update(model_type, df_predictions, updated_at)
+        for model_type, batch_predictions in forecasts.items()
+        for df_predictions in batch_predictions
+    ]
+
+# Converts the hourly averages of a batch of sensors into the model input of shape (N, 6, 13).
+# Normalizes the metrics on a per day-hour level and encodes the labels.
+def preprocess_input(batch_data, batch_labels):
+    hourly_data = [hourlyData for data in batch_data for hourlyData in data]
     
-    # Normalize sensor names
-    df['sensor'] = sensor_label_encoder.transform(df['sensor'])
+    sensor_idx = sensor_label_encoder.transform([hourlyData['sensor'] for hourlyData in hourly_data])
+    roomtype_idx = roomtype_label_encoder.transform([labels['roomtype'] for labels in batch_labels for _ in range(WINDOW_SIZE)])
+    hours = np.array([hourlyData['hour'] for hourlyData in hourly_data], dtype=int)
+    days = np.array([hourlyData['day'] for hourlyData in hourly_data], dtype=int)
     
-    # Normalize room types
-    df['roomtype'] = labels['roomtype']
-    df['roomtype'] = roomtype_label_encoder.transform(df['roomtype'])
+    metrics = np.trunc(np.array([
+        [
+            hourlyData['eCO2'],
+            hourlyData['sound'],
+            (hourlyData['color_r'] + hourlyData['color_g'] + hourlyData['color_b']) / 3
+        ]
+        for hourlyData in hourly_data
+    ], dtype=float))
     
-    # Reorder the columns
-    df = df[['sensor', 'hour', 'eCO2', 'sound', 'light', 'roomtype', 'day_0', 'day_1', 'day_2', 'day_3', 'day_4', 'day_5', 'day_6']]
+    # Normalize metrics
+    metrics = normalize(normalization_table, metrics, sensor_idx, days, hours)
     
-    return df.values.reshape(1, 6, 13)
+    return encode_rows(sensor_idx, hours, metrics, roomtype_idx, days).reshape(-1, WINDOW_SIZE, 13)
 
-# Saves the predictions to the database.
-# Does some additional processing in order to match the database schema.
-def save_predictions(model_type, df_predictions):    
-    df_predictions['colorCode'] = df_predictions.apply(lambda row: calcColorCode(row), axis=1)
+# Builds model input rows from the labels and the normalized metrics.
+# Columns: 'sensor', 'hour', 'eCO2', 'sound', 'light', 'roomtype', 'day_0', ..., 'day_6'
+# All arguments are broadcast against each other, the result has shape (..., 13).
+def encode_rows(sensor_idx, hours, metrics, roomtype_idx, days):
+    shape = np.broadcast_shapes(np.shape(sensor_idx), np.shape(hours), np.shape(metrics)[:-1], np.shape(roomtype_idx), np.shape(days))
+    
+    x = np.zeros(shape + (13,), dtype='float32')
+    x[..., 0] = sensor_idx
+    x[..., 1] = hours
+    x[..., 2:5] = metrics
+    x[..., 5] = roomtype_idx
+    # One-hot encode day field
+    x[..., 6:] = np.broadcast_to(days, shape)[..., np.newaxis] == np.arange(7)
     
-    # print(df_predictions)
+    return x
 
+# Builds the upsert of the predictions made by a model for a single sensor.
+# Does some additional processing in order to match the database schema.
+def build_prediction_update(model_type, df_predictions, updated_at):
     current_date = datetime.now()
     day_mapping = {0: 6, 1: 0, 2: 1, 3: 2, 4: 3, 5: 4, 6: 5}
 
-    for index, row in df_predictions.iterrows():
-        prediction_date = current_date - timedelta(days=current_date.weekday() - day_mapping[row['day']])
-        timestamp = prediction_date.replace(hour=row['hour'], minute=0, second=0).strftime('%Y-%m-%dT%H:%M:%S')
-        df_predictions.at[index, 'hour'] = timestamp
-    
-    df_predictions.rename(columns={'hour': 'timestamp'}, inplace=True)
-    
     json_predictions = []
-    for index, row in df_predictions.iterrows():
-        prediction_data = {
-            'timestamp': row['timestamp'],
-            'co2Level': row['eCO2'],
-            'lightLevel': row['light'],
-            'soundLevel': row['sound'],
-            'colorCode': row['colorCode']
-        }
+    for row in df_predictions.itertuples(index=False):
+        # Closest date with the predicted day of the week, so forecasts crossing midnight
+        # (or the end of the week) get the date of the next day
+        days_offset = (day_mapping[row.day] - current_date.weekday() + 3) % 7 - 3
+        prediction_date = current_date + timedelta(days=days_offset)
+        timestamp = prediction_date.replace(hour=row.hour, minute=0, second=0).strftime('%Y-%m-%dT%H:%M:%S')
         
-        json_predictions.append(prediction_data)
+        json_predictions.append({
+            'timestamp': timestamp,
+            'co2Level': int(row.eCO2),
+            'lightLevel': int(row.light),
+            'soundLevel': int(row.sound),
+            'colorCode': row.colorCode
+        })
     
-    result = Prediction.find_one_and_update(
+    return UpdateOne(
         {
             'sensor': df_predictions['sensor'][0],
             'modelType': model_type
         }, 
         {    
             '$set': {
-                'timestamp': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+                'timestamp': updated_at,
                 'predictions': json_predictions
             }
         },
-        upsert=True, 
-        return_document=True
+        upsert=True
     )
 
+# Saves the predictions to the database.
+# Sends the upserts as unordered bulk writes of at most WRITE_BATCH_SIZE operations,
+# a failed upsert does not prevent the remaining ones from being written.
+# Returns the number of matched, modified, upserted and failed upserts.
+def save_predictions(operations):
+    counts = {'matched': 0, 'modified': 0, 'upserted': 0, 'failed': 0}
+    
+    for i in range(0, len(operations), WRITE_BATCH_SIZE):
+        batch = operations[i:i+WRITE_BATCH_SIZE]
+        try:
+            add_write_counts(counts, Prediction.bulk_write(batch, ordered=False))
+        except BulkWriteError as err:
+            add_write_counts(counts, error=err)
+    
+    print(f"Saved predictions: {counts['matched']} matched, {counts['upserted']} upserted, {counts['failed']} failed.")
+    
+    return counts
+
+# Adds the result of a bulk write, or the details of its BulkWriteError, to the counts of save_predictions()
+def add_write_counts(counts, result=None, error=None):
+    if error is None:
+        counts['matched'] += result.matched_count
+        counts['modified'] += result.modified_count
+        counts['upserted'] += result.upserted_count
+    else:
+        counts['matched'] += error.details.get('nMatched', 0)
+        counts['modified'] += error.details.get('nModified', 0)
+        counts['upserted'] += error.details.get('nUpserted', 0)
+        counts['failed'] += len(error.details.get('writeErrors', []))
+
 # Save static values for predicted data:
 # hours, days, sensor, roomtype
-# These should stay intact regardless of the predicted values
-def get_labels(data):
+# These should stay intact regardless of the predicted values.
+# Labels are generated for the horizon hours following the last hour of the data.
+def get_labels(data, horizon=MODEL_HORIZON):
     labels = {}
     
     labels["sensor"] = data[0]["sensor"]
     labels["roomtype"] = roomtype_mapping.get(data[0]["sensor"])
-    labels["hour"] = [(data[5]["hour"] + 1) % 24, (data[5]["hour"] + 2) % 24, (data[5]["hour"] + 3) % 24]
-
-    days = []
-    for hour in labels["hour"]:
-        if hour < (data[5]["hour"]):
-            new_day = (data[5]["day"] + 1) % 7
-        else:
-            new_day = data[5]["day"]
-
-        days.append(new_day)
-
-    labels["day"] = days
+    last_hour, last_day = int(data[-1]["hour"]), int(data[-1]["day"])
+    labels["hour"] = [(last_hour + step) % 24 for step in range(1, horizon + 1)]
+    labels["day"] = [(last_day + (last_hour + step) // 24) % 7 for step in range(1, horizon + 1)]
     
     return labels
 
@@ -388,56 +584,122 @@ def get_model(model_type):
     return model
 
 # Main function for making predictions.
-# Denormalizes the values after predicting.
-def predict(model_type, x_test=None):
-    if x_test is None or len(x_test[0]) != 6:
+# Runs the model over the whole batch of sensors (N, 6, 13) and scatters the outputs back to the per-sensor labels.
+def predict(model_type, x_test=None, batch_labels=None):
+    if x_test is None or x_test.shape[1] != WINDOW_SIZE:
         print("Input data for prediction is not defined or incomplete.")
-        return
+        return []
 
     model = get_model(model_type)
+    [predictions] = forecast(model, [x_test], batch_labels)
+    
+    return denormalize_predictions(predictions, batch_labels)
+
+# Makes the forecasts of all models and of their ensemble with the fused ensemble model.
+# Returns the predictions of every sensor per model type.
+def predict_ensemble(x_test=None, batch_labels=None):
+    if x_test is None or x_test.shape[1] != WINDOW_SIZE:
+        print("Input data for prediction is not defined or incomplete.")
+        return {}
+
+    outputs = forecast(model_ensemble, [x_test] * len(MODEL_TYPES), batch_labels)
+    
+    return {
+        model_type: denormalize_predictions(predictions, batch_labels)
+        for model_type, predictions in zip(MODEL_TYPES + [ENSEMBLE_MODEL_TYPE], outputs)
+    }
 
-    predictions = model.predict(x_test, verbose=0)
-    
-    num_samples, prediction_horizon, num_features = predictions.shape
-    predictions = predictions.reshape((num_samples * prediction_horizon, num_features))
-    columns = ['sensor', 'hour', 'eCO2', 'sound', 'light', 'roomtype', 'day_0', 'day_1', 'day_2', 'day_3', 'day_4', 'day_5', 'day_6']
-    df_predictions = pd.DataFrame(predictions, columns=columns)
-    
-    # 1 No verification denormalization
-    # df_predictions['sensor'] = sensor_label_encoder.inverse_transform(df_predictions['sensor'].round().astype(int))
-    # df_predictions['roomtype'] = roomtype_label_encoder.inverse_transform(df_predictions['roomtype'].round().astype(int))
-    # df_predictions['hour'] = df_predictions['hour'].round().astype(int)
-    # day_cols = ['day_0', 'day_1', 'day_2', 'day_3', 'day_4', 'day_5', 'day_6']
-    # df_predictions['day'] = df_predictions[day_cols].idxmax(axis=1).str.replace('day_', '').astype(int)
-    # df_predictions.drop(day_cols, axis=1, inplace=True)
-    
-    # 2 Denormalize by replacing with predefined labels
-    df_predictions['sensor'] = labels['sensor']
-    df_predictions['roomtype'] = labels['roomtype']    
-    df_predictions['hour'] = labels['hour']
-    day_cols = ['day_0', 'day_1', 'day_2', 'day_3', 'day_4', 'day_5', 'day_6']
-    df_predictions.drop(day_cols, axis=1, inplace=True)
-    df_predictions['day'] = labels['day']
+# Runs the model on the input windows (one per model input) for the horizon of the labels.
+# Horizons longer than MODEL_HORIZON are forecasted recursively: the predicted hours are appended to the window,
+# with the sensor, hour, roomtype and day columns taken from the labels, and the model is run again
+# on the last 6 hours. Every step is a single batched forward pass over all sensors.
+# Returns the normalized predictions (N, horizon, 13) of every model output.
+def forecast(model, windows, batch_labels):
+    horizon = len(batch_labels[0]['hour'])
+
+    sensor_idx = windows[0][:, :1, 0]
+    roomtype_idx = windows[0][:, :1, 5]
+    hours = np.array([labels['hour'] for labels in batch_labels], dtype=int)
+    days = np.array([labels['day'] for labels in batch_labels], dtype=int)
+
+    steps = []
+    for step in range(0, horizon, MODEL_HORIZON):
+        outputs = model.predict(windows if len(windows) > 1 else windows[0], batch_size=INFERENCE_BATCH_SIZE, verbose=0)
+        outputs = outputs if isinstance(outputs, list) else [outputs]
+        steps.append(outputs)
+
+        if step + MODEL_HORIZON < horizon:
+            step_labels = slice(step, step + MODEL_HORIZON)
+            windows = [
+                np.concatenate([window, encode_rows(sensor_idx, hours[:, step_labels], output[..., 2:5], roomtype_idx, days[:, step_labels])], axis=1)[:, -WINDOW_SIZE:]
+                for window, output in zip(windows, outputs)
+            ]
+    
+    return [np.concatenate([outputs[idx] for outputs in steps], axis=1) for idx in range(len(steps[0]))]
+
+# Denormalizes the predicted values of a batch of sensors.
+# Returns a DataFrame with the predictions for every sensor.
+def denormalize_predictions(predictions, batch_labels):
+    import pandas as pd
+    
+    # Denormalize by replacing with predefined labels
+    sensor_idx = sensor_label_encoder.transform([labels['sensor'] for labels in batch_labels])
+    hours = np.array([labels['hour'] for labels in batch_labels], dtype=int)
+    days = np.array([labels['day'] for labels in batch_labels], dtype=int)
 
     # Denormalize metrics
-    for index, row in df_predictions.iterrows():
-        cols = ['eCO2', 'sound', 'light']
-        for col in cols:
-            mean = normalization_params[labels['sensor']][labels['day'][index]][labels['hour'][index]][f"mean_{col}"]
-            std = normalization_params[labels['sensor']][labels['day'][index]][labels['hour'][index]][f"std_{col}"]
-            
-            df_predictions.at[index, col] = (df_predictions.at[index, col] * std) + mean
-            df_predictions.at[index, col] = max(0, round(df_predictions.at[index, col]))
+    metrics = denormalize(normalization_table, predictions[..., 2:5], sensor_idx[:, np.newaxis], days, hours)
+    metrics = np.maximum(0, np.round(metrics)).astype(int)
+    
+    color_codes = classify_color_codes(threshold_table, metrics, sensor_idx[:, np.newaxis], days, hours)
+    
+    batch_predictions = []
+    for labels, values, colors in zip(batch_labels, metrics, color_codes):
+        batch_predictions.append(pd.DataFrame({
+            'sensor': labels['sensor'],
+            'hour': labels['hour'],
+            'eCO2': values[:, 0],
+            'sound': values[:, 1],
+            'light': values[:, 2],
+            'roomtype': labels['roomtype'],
+            'day': labels['day'],
+            'colorCode': colors
+        }))
     
-    # Convert column values to integer type
-    float_cols = ['eCO2', 'sound', 'light']
-    df_predictions[float_cols] = df_predictions[float_cols].round().astype(int)  
+    return batch_predictions
+
+# Runs func and adds the time spent in it to timings[phase]
+def run_phase(timings, phase, func, *func_args):
+    stage_start = time.perf_counter()
+    result = func(*func_args)
+    timings[phase] = timings.get(phase, 0) + time.perf_counter() - stage_start
+    
+    return result
+
+# Prints the time spent in each phase of the run along with its share of the total
+def print_profile(timings):
+    phases = {phase: value for phase, value in timings.items() if phase not in PROFILE_COUNTERS}
+    total = sum(phases.values())
     
-    return df_predictions
+    print("Startup profile:")
+    for phase, value in phases.items():
+        print(f"  {phase:<12}{value:8.3f}s {100 * value / total:6.1f}%")
+    print(f"  {'total':<12}{total:8.3f}s")
+    print("  " + " ".join(f"{counter}={timings[counter]}" for counter in PROFILE_COUNTERS if counter in timings))
 
-load_obj_data()
-load_saved_model()
-db_handler()
+if __name__ == '__main__':
+    args = parse_args()
+    timings = {'imports': IMPORT_TIME}
+    
+    run_phase(timings, 'imports', import_backend, args.backend)
+    run_phase(timings, 'xlsx', load_room_data)
+    run_phase(timings, 'pickles', load_obj_data)
+    run_phase(timings, 'models', load_saved_model, args.backend)
+    run_phase(timings, 'db', connect_db)
+    timings.update(db_handler())
+    
+    if args.profile_startup:
+        print_profile(timings)
 
-# Solely for testing purposes. Uses saved data for thingy001. Should not be used normally, might need adjustments.
-# predict(x_test_example)
\ No newline at end of file
+    # Solely for testing purposes. Uses saved data for thingy001. Should not be used normally, might need adjustments.
+    # predict(x_test_example)
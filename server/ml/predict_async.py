@@ -0,0 +1,273 @@
+import argparse
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+from pymongo.errors import BulkWriteError
+
+import predict
+from rollup import ROLLUP_COLLECTION, update_rollup, find_buckets
+
+# Optional: the motor driver runs the queries and writes on the event loop,
+# without it the pymongo calls of predict.py are run in threads
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError:
+    AsyncIOMotorClient = None
+
+# Pipelined variant of the hourly forecast job (predict.db_handler()).
+# The stages run as asyncio tasks connected by bounded queues, so the database I/O of one chunk of
+# sensors overlaps with the preprocessing and inference of the others and the run time is bound by
+# the slowest stage instead of the sum of all stages:
+#   fetch      - queries the hourly averages of --fetch-batch-size sensors at a time
+#   preprocess - builds the model input of the sensors with a complete 6-hour window
+#   inference  - combines the waiting inputs into micro-batches of up to INFERENCE_BATCH_SIZE sensors
+#                and runs the models in a separate thread (one batch at a time)
+#   save       - sends the upserts as bulk writes, up to --write-concurrency at the same time
+# Accepts the flags of predict.py along with the flags of the pipeline:
+#   python ./ml/predict_async.py --live --queue-size 4 --write-concurrency 4
+
+# Number of sensors per fetched chunk when --fetch-batch-size is not set
+ASYNC_FETCH_BATCH_SIZE = 256
+QUEUE_SIZE = 4
+WRITE_CONCURRENCY = 4
+
+# Collections used by the pipeline, motor collections if motor is installed
+async_client = None
+SensorData = None
+HourlySensorData = None
+Prediction = None
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Pipelined forecast job, the remaining flags are passed to predict.py.')
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE, help=f'Maximum number of chunks waiting between two stages ({QUEUE_SIZE} by default).')
+    parser.add_argument('--write-concurrency', type=int, default=WRITE_CONCURRENCY, help=f'Maximum number of bulk writes in flight ({WRITE_CONCURRENCY} by default).')
+    parsed_args, predict_argv = parser.parse_known_args(argv)
+
+    predict.args = predict.parse_args(predict_argv)
+    if predict.args.fetch_batch_size <= 0:
+        predict.args.fetch_batch_size = ASYNC_FETCH_BATCH_SIZE
+
+    return parsed_args
+
+# Connects to the database, the motor client is bound to the event loop of the run
+def connect_db():
+    global async_client, SensorData, HourlySensorData, Prediction
+
+    if predict.client is None:
+        predict.connect_db()
+
+    if AsyncIOMotorClient is None:
+        SensorData, HourlySensorData, Prediction = predict.SensorData, predict.HourlySensorData, predict.Prediction
+        return
+
+    async_client = AsyncIOMotorClient(os.getenv('DB_URI'))
+    db = async_client['test']
+    SensorData = db['sensordatas']
+    HourlySensorData = db[ROLLUP_COLLECTION]
+    Prediction = db['predictions']
+
+def close_db():
+    global async_client, SensorData, HourlySensorData, Prediction
+
+    if async_client is not None:
+        async_client.close()
+        async_client = None
+        SensorData = HourlySensorData = Prediction = None
+
+# Returns all documents of the cursor created by make_cursor
+async def find_all(make_cursor):
+    if async_client is not None:
+        return await make_cursor().to_list(length=None)
+
+    return await asyncio.to_thread(lambda: list(make_cursor()))
+
+async def bulk_write(operations):
+    if async_client is not None:
+        return await Prediction.bulk_write(operations, ordered=False)
+
+    return await asyncio.to_thread(Prediction.bulk_write, operations, ordered=False)
+
+# Fetches the hourly averages of the provided sensors from the raw readings
+async def fetch_raw(sensors, time_window):
+    current_time, start_time, end_time = time_window
+    sensor_data = {sensor: [] for sensor in sensors}
+
+    for hourlyData in await find_all(lambda: SensorData.aggregate(predict.build_pipeline(sensors, start_time, end_time, current_time))):
+        sensor_data[hourlyData['sensor']].append(hourlyData)
+
+    return sensor_data
+
+# Fetches the hourly averages of the sensors chunk by chunk, in the format of predict.fetch_sensor_data().
+# From the rollup collection, the sensors with missing or incomplete buckets are read from the raw readings.
+async def fetch_stage(sensors, time_window, out_queue, timings):
+    current_time, start_time, end_time = time_window
+    batch_size = predict.args.fetch_batch_size
+
+    for i in range(0, len(sensors), batch_size):
+        stage_start = time.perf_counter()
+        chunk = sensors[i:i+batch_size]
+
+        if predict.args.source == 'rollup':
+            sensor_data = {sensor: [] for sensor in chunk}
+            buckets = await find_all(lambda: find_buckets(HourlySensorData, chunk, start_time, predict.rollup_fetch_end(end_time)))
+            for bucket in buckets:
+                predict.append_bucket(sensor_data, bucket, end_time)
+            predict.label_buckets(sensor_data)
+
+            incomplete = predict.incomplete_sensors(sensor_data)
+            if len(incomplete) > 0:
+                sensor_data.update(await fetch_raw(incomplete, time_window))
+            timings['raw_fallback'] += len(incomplete)
+        else:
+            sensor_data = await fetch_raw(chunk, time_window)
+
+        timings['fetch'] += time.perf_counter() - stage_start
+        await out_queue.put((chunk, sensor_data))
+
+    await out_queue.put(None)
+
+# Builds the model input of the sensors with a complete 6-hour window
+async def preprocess_stage(in_queue, out_queue, timings):
+    while True:
+        item = await in_queue.get()
+        if item is None:
+            break
+
+        stage_start = time.perf_counter()
+        chunk, sensor_data = item
+        batch_data = [sensor_data[sensor] for sensor in chunk if len(sensor_data[sensor]) == predict.WINDOW_SIZE]
+        if len(batch_data) == 0:
+            timings['preprocess'] += time.perf_counter() - stage_start
+            continue
+
+        batch_labels = [predict.get_labels(data, predict.args.horizon) for data in batch_data]
+        x_batch = predict.preprocess_input(batch_data, batch_labels)
+        timings['preprocess'] += time.perf_counter() - stage_start
+        timings['sensors'] += len(batch_data)
+
+        await out_queue.put((x_batch, batch_labels))
+
+    await out_queue.put(None)
+
+# Runs the models on micro-batches of the inputs that are waiting in the queue
+async def inference_stage(in_queue, out_queue, executor, timings):
+    loop = asyncio.get_running_loop()
+    finished = False
+
+    while not finished:
+        item = await in_queue.get()
+        if item is None:
+            break
+
+        inputs = [item]
+        while sum(len(x_batch) for x_batch, _ in inputs) < predict.INFERENCE_BATCH_SIZE and not in_queue.empty():
+            item = in_queue.get_nowait()
+            if item is None:
+                finished = True
+                break
+            inputs.append(item)
+
+        x_batch = np.concatenate([x_batch for x_batch, _ in inputs])
+        batch_labels = [labels for _, chunk_labels in inputs for labels in chunk_labels]
+
+        stage_start = time.perf_counter()
+        forecasts = await loop.run_in_executor(executor, predict.run_forecasts, x_batch, batch_labels)
+        timings['inference'] += time.perf_counter() - stage_start
+
+        await out_queue.put(forecasts)
+
+    await out_queue.put(None)
+
+# Writes the forecasts with up to write_concurrency concurrent bulk writes.
+# A write slot is taken before a write is started, so the stage stops reading
+# from the queue while all slots are in use. The writes are awaited before the stage
+# returns and cancelled along with the stage.
+async def save_stage(in_queue, updated_at, write_concurrency, counts, timings):
+    slots = asyncio.Semaphore(write_concurrency)
+
+    async def write(batch):
+        stage_start = time.perf_counter()
+        try:
+            predict.add_write_counts(counts, await bulk_write(batch))
+        except BulkWriteError as err:
+            predict.add_write_counts(counts, error=err)
+        finally:
+            timings['save'] += time.perf_counter() - stage_start
+            slots.release()
+
+    async with asyncio.TaskGroup() as writes:
+        while True:
+            forecasts = await in_queue.get()
+            if forecasts is None:
+                break
+
+            operations = predict.build_operations(forecasts, updated_at)
+            for i in range(0, len(operations), predict.WRITE_BATCH_SIZE):
+                await slots.acquire()
+                writes.create_task(write(operations[i:i+predict.WRITE_BATCH_SIZE]))
+
+# Pipelined counterpart of predict.db_handler().
+# The stages run in a task group, if a stage fails the others are cancelled (instead of waiting
+# on their queues forever) and the errors are raised as an ExceptionGroup.
+# Returns the wall time of the pipeline ('pipeline') and the time spent in each stage,
+# which overlap and therefore add up to more than the wall time.
+async def db_handler_async(args):
+    timings = {'rollup': 0, 'fetch': 0, 'preprocess': 0, 'inference': 0, 'save': 0, 'sensors': 0, 'raw_fallback': 0}
+    counts = {'matched': 0, 'modified': 0, 'upserted': 0, 'failed': 0}
+
+    if SensorData is None:
+        connect_db()
+
+    if predict.args.source == 'rollup' and predict.args.update_rollup:
+        stage_start = time.perf_counter()
+        await asyncio.to_thread(update_rollup, predict.db)
+        timings['rollup'] = time.perf_counter() - stage_start
+
+    sensorlist = list(predict.sensor_label_encoder.classes_)
+    time_window = predict.get_time_window()
+    updated_at = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+
+    fetched, preprocessed, forecasted = (asyncio.Queue(maxsize=args.queue_size) for _ in range(3))
+
+    pipeline_start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            async with asyncio.TaskGroup() as stages:
+                stages.create_task(fetch_stage(sensorlist, time_window, fetched, timings))
+                stages.create_task(preprocess_stage(fetched, preprocessed, timings))
+                stages.create_task(inference_stage(preprocessed, forecasted, executor, timings))
+                stages.create_task(save_stage(forecasted, updated_at, args.write_concurrency, counts, timings))
+    finally:
+        close_db()
+    timings['pipeline'] = time.perf_counter() - pipeline_start
+
+    if timings['sensors'] == 0:
+        print("No sensors with complete data for the past 6 hours.")
+    print(f"Saved predictions: {counts['matched']} matched, {counts['upserted']} upserted, {counts['failed']} failed.")
+
+    timings.update(counts)
+    return timings
+
+# Prints the startup phases and the wall time of the pipeline, followed by the (overlapping) time of every stage
+def print_profile(timings):
+    stages = ['fetch', 'preprocess', 'inference', 'save']
+    predict.print_profile({phase: value for phase, value in timings.items() if phase not in stages})
+    print("  stages: " + " ".join(f"{stage}={timings[stage]:.3f}s" for stage in stages))
+
+if __name__ == '__main__':
+    args = parse_args()
+    timings = {'imports': predict.IMPORT_TIME}
+
+    predict.run_phase(timings, 'imports', predict.import_backend, predict.args.backend)
+    predict.run_phase(timings, 'xlsx', predict.load_room_data)
+    predict.run_phase(timings, 'pickles', predict.load_obj_data)
+    predict.run_phase(timings, 'models', predict.load_saved_model, predict.args.backend)
+    predict.run_phase(timings, 'db', predict.connect_db)
+    timings.update(asyncio.run(db_handler_async(args)))
+
+    if predict.args.profile_startup:
+        print_profile(timings)
@@ -0,0 +1,126 @@
+import contextlib
+import json
+import os
+import sys
+import time
+import traceback
+
+import predict
+
+# Long-lived prediction service.
+# Loads the room data, serialized objects and models once and then waits for requests
+# on stdin, one JSON object per line:
+#   {"id": 1, "cmd": "forecast", "args": ["--live"]}
+#   {"id": 2, "cmd": "shutdown"}
+# Every request is answered with a single JSON line on stdout containing the request id,
+# the status and the per-stage timings (in seconds) of the run.
+# Anything printed by the prediction code is redirected to stderr,
+# so stdout only carries the protocol messages.
+# The command line flags of the worker are the predict.py flags shared by all requests, e.g. the
+# inference backend the models are loaded with, the flags of a request are applied on top of them:
+#   python ./ml/predict_worker.py --backend tflite
+
+# Serialized objects that are refreshed by incremental_stats.py while the worker is running
+OBJ_DATA_FILES = ['./ml/obj/lookup_tables/manifest.json', './ml/obj/normalization_params.pkl', './ml/obj/thresholds.pkl']
+obj_data_mtimes = None
+# predict.py flags of the worker, parsed before every request along with the flags of the request
+worker_argv = []
+
+def get_obj_data_mtimes():
+    return [os.path.getmtime(path) if os.path.exists(path) else None for path in OBJ_DATA_FILES]
+
+# Writes a protocol message to stdout
+def respond(message):
+    sys.__stdout__.write(json.dumps(message) + '\n')
+    sys.__stdout__.flush()
+
+# Loads everything that is shared between the forecast runs
+def load():
+    global obj_data_mtimes
+    timings = {}
+    predict.args = predict.parse_args(worker_argv)
+
+    stage_start = time.perf_counter()
+    predict.load_room_data()
+    timings['room_data'] = time.perf_counter() - stage_start
+
+    stage_start = time.perf_counter()
+    obj_data_mtimes = get_obj_data_mtimes()
+    predict.load_obj_data()
+    timings['obj_data'] = time.perf_counter() - stage_start
+
+    stage_start = time.perf_counter()
+    predict.import_backend(predict.args.backend)
+    timings['imports'] = time.perf_counter() - stage_start
+
+    stage_start = time.perf_counter()
+    predict.load_saved_model(predict.args.backend)
+    timings['models'] = time.perf_counter() - stage_start
+
+    stage_start = time.perf_counter()
+    predict.connect_db()
+    timings['db'] = time.perf_counter() - stage_start
+
+    return timings
+
+# Reloads the normalization parameters and thresholds if they were updated since they were loaded
+def reload_obj_data_if_changed():
+    global obj_data_mtimes
+
+    mtimes = get_obj_data_mtimes()
+    if mtimes == obj_data_mtimes:
+        return False
+
+    obj_data_mtimes = mtimes
+    predict.load_obj_data()
+    print("Reloaded the normalization parameters and thresholds.")
+    return True
+
+# Runs a single forecast using the command line flags of predict.py.
+# The models are loaded once, so a request can not switch the backend of the worker.
+def run_forecast(request):
+    run_start = time.perf_counter()
+    reload_obj_data_if_changed()
+
+    backend = predict.args.backend
+    args = predict.parse_args(worker_argv + request.get('args', []))
+    if args.backend != backend:
+        raise ValueError(f"The worker runs the {backend} backend, restart it with --backend {args.backend} instead.")
+
+    predict.args = args
+    timings = predict.db_handler()
+    timings['total'] = time.perf_counter() - run_start
+
+    return timings
+
+def serve():
+    with contextlib.redirect_stdout(sys.stderr):
+        timings = load()
+    respond({'status': 'ready', 'timings': timings})
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get('id')
+
+            if request.get('cmd') == 'shutdown':
+                respond({'id': request_id, 'status': 'ok'})
+                break
+            elif request.get('cmd') == 'forecast':
+                with contextlib.redirect_stdout(sys.stderr):
+                    timings = run_forecast(request)
+                respond({'id': request_id, 'status': 'ok', 'timings': timings})
+            else:
+                respond({'id': request_id, 'status': 'error', 'error': f"Unknown command: {request.get('cmd')}"})
+        except (Exception, SystemExit) as err:
+            traceback.print_exc(file=sys.stderr)
+            respond({'id': request_id, 'status': 'error', 'error': str(err)})
+
+if __name__ == '__main__':
+    worker_argv = sys.argv[1:]
+    serve()
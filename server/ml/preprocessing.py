@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+
+# Vectorized building blocks of the preprocessing stages (remove-outliers.py, impute-missing.py).
+# Every function works on a per-sensor hourly table with 'day' and 'hour' columns.
+
+METRICS = ['eCO2', 'sound', 'light']
+OUTLIER_THRESHOLD = 2.5
+
+# Calculates the z-scores of the metrics with respect to the mean and standard deviation
+# of the corresponding day-hour, taking day-hour seasonality into account.
+# Metrics with a standard deviation of 0 get a z-score of 0.
+def day_hour_zscores(df, metrics=METRICS):
+    grouped = df.groupby(['day', 'hour'])[metrics]
+    mean = grouped.transform('mean')
+    std = grouped.transform('std')
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        zscores = (df[metrics] - mean) / std
+
+    return zscores.mask(std == 0, 0)
+
+# Detects outliers based on the z-score.
+# In case z-score for any metric exceed the threshold,
+# a row containing the metric will be marked as an outlier.
+# Adds the '<metric>_zscore', 'max_zscore' and 'is_outlier' columns to the table
+# and returns the outlier rows.
+def detect_outliers(df, threshold=OUTLIER_THRESHOLD, metrics=METRICS):
+    zscores = day_hour_zscores(df, metrics)
+
+    for col in metrics:
+        df[f'{col}_zscore'] = zscores[col]
+
+    df['max_zscore'] = zscores.abs().max(axis=1)
+    df['is_outlier'] = df['max_zscore'] > threshold
+
+    return df[df['is_outlier']]
+
+# Marks the rows that belong to complete days.
+# Consecutive rows with the same 'day' form a single day-run,
+# which is complete when all 24 hours are present in it.
+# Can be used on any hourly table, e.g. the data fetched for the live predictions.
+def complete_day_mask(df):
+    day_run = (df['day'] != df['day'].shift()).cumsum()
+    hours = df['hour'].where(df['hour'].isin(range(24)))
+
+    return hours.groupby(day_run).transform('nunique') == 24
+
+# Marks the rows with the same day as the previous row and an hour that is not later, which start a new week
+def new_week_mask(df):
+    day = df['day'].to_numpy(dtype=int)
+    hour = df['hour'].to_numpy(dtype=int)
+
+    new_week = (day == np.roll(day, 1)) & (hour <= np.roll(hour, 1))
+    if len(new_week) > 0:
+        new_week[0] = False
+
+    return new_week
+
+# Maps every row to an absolute hour, counting from hour 0 of day 0 before the first row.
+# The days between two consecutive rows are counted circularly (e.g. Saturday -> Monday is 2 days),
+# a row that starts a new week (new_week_mask()) is 7 days after the previous one.
+def absolute_hours(df):
+    day = df['day'].to_numpy(dtype=int)
+    hour = df['hour'].to_numpy(dtype=int)
+
+    day_step = (day - np.roll(day, 1)) % 7
+    day_step[new_week_mask(df)] = 7
+    if len(day_step) > 0:
+        day_step[0] = day[0]
+
+    return np.cumsum(day_step) * 24 + hour
+
+# Reindexes the table onto a full (week, day, hour) grid between its first and last row
+# and fills the missing rows with the mean values of the corresponding day-hour.
+# Only gaps of at least min_gap_hours consecutive hours are filled, so min_gap_hours=24
+# restricts the imputation to whole missing days. Gaps that end in a row starting a new week are
+# not filled, since their length is unknown (like the day-by-day imputation before). Label columns (e.g. 'sensor' and 'roomtype')
+# are copied from the first row. Returns the imputed table and the number of inserted rows.
+def impute_missing_hours(df, min_gap_hours=1, metrics=METRICS):
+    if len(df) == 0:
+        return df, 0
+
+    hours = absolute_hours(df)
+    grid = np.arange(hours[0], hours[-1] + 1)
+    is_missing = ~np.isin(grid, hours)
+
+    # Length of the gap every missing hour belongs to, gap i ends at row i
+    gap_id = np.cumsum(~is_missing)
+    gap_length = np.bincount(gap_id, weights=is_missing)[gap_id]
+    ends_week = np.append(new_week_mask(df), False)[gap_id]
+    missing = grid[is_missing & (gap_length >= min_gap_hours) & ~ends_week]
+
+    new_rows = pd.DataFrame({col: df[col].iloc[0] for col in df.columns}, index=range(len(missing)))
+    new_rows['day'] = (missing // 24) % 7
+    new_rows['hour'] = missing % 24
+    means = df.groupby(['day', 'hour'])[metrics].mean()
+    new_rows[metrics] = means.reindex(pd.MultiIndex.from_arrays([new_rows['day'], new_rows['hour']])).to_numpy()
+
+    order = np.argsort(np.concatenate([hours, missing]), kind='stable')
+    df = pd.concat([df, new_rows], ignore_index=True).iloc[order].reset_index(drop=True)
+
+    return df, len(missing)
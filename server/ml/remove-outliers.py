@@ -1,100 +1,61 @@
-import pandas as pd
-import os
+import argparse
 
-# Calculated z-score based on provided mean and standard deviation.
-def calculate_zscores(val, mean, std):
-    return (val - mean) / std if std != 0 else 0
+from sensor_store import list_sensor_tables, read_sensor_table, write_sensor_table
+from parallel import DEFAULT_WORKERS, run_per_sensor, report_failures
+from preprocessing import METRICS, OUTLIER_THRESHOLD, detect_outliers, complete_day_mask
 
-# Detects outliers based on the z-score.
-# In case z-score for any metric exceed the threshold, 
-# a row containing the metric will be marked as an outlier.
-def detect_outliers(df, stats):
-    threshold = 2.5
+# Reads the table of the provided sensor and calls detect_outliers(),
+# which compares every metric to the mean and standard deviation
+# of the corresponding day-hour, taking day-hour seasonality into account.
+def process_sensor_data(file_path, threshold=OUTLIER_THRESHOLD, metrics=METRICS):
+    df = read_sensor_table(file_path)
 
-    for col in ['eCO2', 'sound', 'light']:
-        col_mean = stats[f'{col}_mean']
-        col_std = stats[f'{col}_std']
-        df[f'{col}_zscore'] = df.apply(lambda x: calculate_zscores(x[col], col_mean[x['day'], x['hour']], col_std[x['day'], x['hour']]), axis=1)
-
-    df['max_zscore'] = df[['eCO2_zscore', 'sound_zscore', 'light_zscore']].abs().max(axis=1)
-    df['is_outlier'] = df['max_zscore'] > threshold
-
-    return df[df['is_outlier']]
-
-# Groups the entries for the dataset specific for provided sensor
-# by day and hour and calculated mean and standard deviation values
-# taking day-hour seasonality into account.
-# Given that statistical data, calls detect_outliers().
-def process_sensor_data(file_path):
-    df = pd.read_csv(file_path)
-
-    grouped = df.groupby(['day', 'hour'])
-    stats = {}
-    for name, group in grouped:
-        for col in ['eCO2', 'sound', 'light']:
-            if f'{col}_mean' not in stats:
-                stats[f'{col}_mean'] = {}
-                stats[f'{col}_std'] = {}
-            stats[f'{col}_mean'][name] = group[col].mean()
-            stats[f'{col}_std'][name] = group[col].std()
-
-    outliers = detect_outliers(df, stats)
+    outliers = detect_outliers(df, threshold, metrics)
 
     return df, outliers
 
 # Removes days that contain partial data (not all 24 hours of recordings are present).
 def remove_partial_days(df):
-    to_remove = []
-    prev_day = None
-    consecutive_hours = set(range(24))
-    day_indices = []
-
-    for index, row in df.iterrows():
-        current_day = row['day']
-        current_hour = row['hour']
-
-        if prev_day != current_day:
-            if len(consecutive_hours) != 0:
-                to_remove.extend(day_indices)
-            consecutive_hours = set(range(24))
-            day_indices = []
-
-        consecutive_hours.discard(current_hour)
-        day_indices.append(index)
-        prev_day = current_day
-
-    if len(consecutive_hours) != 0:
-        to_remove.extend(day_indices)
-        
-    print(to_remove)
+    to_remove = df.index[~complete_day_mask(df)]
+    print(f"Removed {len(to_remove)} rows of partial days.")
 
     return df.drop(to_remove)
 
-# Parses the input folder contents and for every CSV file:
+# Processes the table of a single sensor:
 #   1. Calls process_sensor_data(), which would remove the outliers
 #   2. Drops unnecessary columns, that were used for outlier detection
 #   3. Calls remove_partial_days(), which removes rows 
 #      for each day, for which at least one hour is missing
 #   4. Saves the preprocessed data to the output path.
-def process_folder(input_folder, output_folder):
-    files = os.listdir(input_folder)
+def process_sensor(sensor_name, file_path, output_folder, threshold=OUTLIER_THRESHOLD, metrics=METRICS):
+    df, outliers = process_sensor_data(file_path, threshold, metrics)
+
+    df = df.drop(outliers.index)
+    df = df.drop(columns=[f'{col}_zscore' for col in metrics] + ['max_zscore', 'is_outlier'])
+
+    df = remove_partial_days(df)
 
-    for file in files:
-        if file.endswith('.csv'):
-            file_path = os.path.join(input_folder, file)
-            df, outliers = process_sensor_data(file_path)
+    write_sensor_table(df, output_folder, sensor_name)
 
-            df = df.drop(outliers.index)
-            df = df.drop(columns=['eCO2_zscore', 'sound_zscore', 'light_zscore', 'max_zscore', 'is_outlier'])
+# Parses the input folder contents and calls process_sensor() for every sensor table,
+# spreading the sensors over the provided number of worker processes.
+def process_folder(input_folder, output_folder, workers=DEFAULT_WORKERS, threshold=OUTLIER_THRESHOLD, metrics=METRICS):
+    tasks = {
+        sensor_name: (sensor_name, file_path, output_folder, threshold, metrics)
+        for sensor_name, file_path in list_sensor_tables(input_folder).items()
+    }
 
-            df = remove_partial_days(df)
+    results, failures = run_per_sensor(process_sensor, tasks, workers)
+    report_failures('remove-outliers', results, failures)
 
-            if not os.path.exists(output_folder):
-                os.makedirs(output_folder)
-            output_file_path = os.path.join(output_folder, file)
-            df.to_csv(output_file_path, index=False)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Removes outliers and partial days from the per-sensor tables.')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Number of worker processes, sensors are processed serially by default (1).')
+    parser.add_argument('--threshold', type=float, default=OUTLIER_THRESHOLD, help=f'Z-score above which a row is marked as an outlier ({OUTLIER_THRESHOLD} by default).')
+    parser.add_argument('--metrics', nargs='+', default=METRICS, choices=METRICS, help='Metrics used for the outlier detection (all of them by default).')
+    args = parser.parse_args()
 
-input_path = '../resources/NU-Heartbeat-Oct-23/data/processed/bysensor'
-output_path = '../resources/NU-Heartbeat-Oct-23/data/processed/bysensor_nooutliers'
+    input_path = '../resources/NU-Heartbeat-Oct-23/data/processed/bysensor'
+    output_path = '../resources/NU-Heartbeat-Oct-23/data/processed/bysensor_nooutliers'
 
-process_folder(input_path, output_path)
\ No newline at end of file
+    process_folder(input_path, output_path, args.workers, args.threshold, args.metrics)
@@ -0,0 +1,124 @@
+import argparse
+import datetime
+import os
+
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+from dotenv import load_dotenv
+
+from hourly_data import hourly_average_pipeline
+
+# Hourly rollup of the raw sensor readings.
+# The 'hourlysensordatas' collection holds a single document per (sensor, hour bucket) with the
+# number of readings and the averaged metrics of the hour (see hourly_data.py), so the forecasts
+# read 6 pre-aggregated documents per sensor instead of averaging the raw readings every hour,
+# and the hourly history outlives the raw readings deleted by the database cleanup.
+# Every run recomputes the buckets from the last rolled-up hour (minus LATE_DATA_HOURS) up to the
+# current hour and replaces them as a whole, so runs are incremental and can safely be repeated.
+# A bucket is stored with 'complete': false until LATE_DATA_HOURS have passed after its hour,
+# complete buckets are not rewritten (unless forced), e.g. after the raw readings are deleted.
+# predict.py rolls up the new hours before every forecast, the script can also be run on its own,
+# e.g. to backfill the readings still present in the database:
+#   python ./ml/rollup.py
+#   python ./ml/rollup.py --since 2024-01-01T00:00:00 --force
+# The indexes of the collection are created once, by the setup run before the first forecast:
+#   python ./ml/rollup.py --setup
+
+ROLLUP_COLLECTION = 'hourlysensordatas'
+# Raw readings are kept for 3 days by the database cleanup (scheduleHandler.js),
+# an empty rollup is backfilled from the readings of this period
+RAW_RETENTION_DAYS = 3
+# Hours before the last rolled-up hour that are recomputed, to include readings that arrived late
+LATE_DATA_HOURS = 1
+# Maximum number of upserts sent to the database in a single bulk write
+WRITE_BATCH_SIZE = 1000
+
+# Creates the indexes of the rollup collection, the unique index keeps a single bucket per (sensor, hour)
+def ensure_indexes(collection):
+    collection.create_index([('sensor', 1), ('timestamp', 1)], unique=True)
+    collection.create_index([('timestamp', 1)])
+
+# Start of the first hour that has to be rolled up (again)
+def rollup_start(collection, now):
+    latest = collection.find_one({}, {'timestamp': 1}, sort=[('timestamp', -1)])
+    if latest is None:
+        return (now - datetime.timedelta(days=RAW_RETENTION_DAYS)).replace(minute=0, second=0, microsecond=0)
+
+    return latest['timestamp'] - datetime.timedelta(hours=LATE_DATA_HOURS)
+
+# Returns the (sensor, timestamp) keys of the complete buckets between start_time and end_time
+def complete_buckets(collection, start_time, end_time, sensors=None):
+    query = {'timestamp': {'$gte': start_time, '$lt': end_time}, 'complete': True}
+    if sensors is not None:
+        query['sensor'] = {'$in': list(sensors)}
+
+    return {(bucket['sensor'], bucket['timestamp']) for bucket in collection.find(query, {'_id': 0, 'sensor': 1, 'timestamp': 1})}
+
+# Recomputes the hourly buckets between start_time and end_time (the end of the current hour by default)
+# from the raw readings and upserts them into the rollup collection.
+# Complete buckets are skipped unless force is set, since their raw readings may already be deleted.
+# Returns the time range and the number of matched, upserted, skipped and failed buckets.
+def update_rollup(db, start_time=None, end_time=None, sensors=None, force=False):
+    now = datetime.datetime.now()
+    rollup = db[ROLLUP_COLLECTION]
+
+    if start_time is None:
+        start_time = rollup_start(rollup, now)
+    if end_time is None:
+        end_time = now.replace(minute=0, second=0, microsecond=0) + datetime.timedelta(hours=1)
+
+    skipped = set() if force else complete_buckets(rollup, start_time, end_time, sensors)
+
+    pipeline = hourly_average_pipeline(start_time, end_time, sensors)
+    operations = [
+        UpdateOne(
+            {'sensor': bucket['sensor'], 'timestamp': bucket['timestamp']},
+            {'$set': {**bucket, 'complete': bucket['timestamp'] + datetime.timedelta(hours=1 + LATE_DATA_HOURS) <= now, 'updatedAt': now}},
+            upsert=True
+        )
+        for bucket in db['sensordatas'].aggregate(pipeline, allowDiskUse=True)
+        if (bucket['sensor'], bucket['timestamp']) not in skipped
+    ]
+
+    counts = {'start': start_time, 'end': end_time, 'matched': 0, 'upserted': 0, 'skipped': len(skipped), 'failed': 0}
+    for i in range(0, len(operations), WRITE_BATCH_SIZE):
+        try:
+            result = rollup.bulk_write(operations[i:i+WRITE_BATCH_SIZE], ordered=False)
+            counts['matched'] += result.matched_count
+            counts['upserted'] += result.upserted_count
+        except BulkWriteError as err:
+            counts['matched'] += err.details.get('nMatched', 0)
+            counts['upserted'] += err.details.get('nUpserted', 0)
+            counts['failed'] += len(err.details.get('writeErrors', []))
+
+    return counts
+
+# Returns a cursor over the buckets of the provided sensors between start_time and end_time,
+# sorted by sensor and time. The 'complete' flag is kept, so readers can tell finished hours apart.
+def find_buckets(collection, sensors, start_time, end_time):
+    return collection.find(
+        {'sensor': {'$in': list(sensors)}, 'timestamp': {'$gte': start_time, '$lt': end_time}},
+        {'_id': 0, 'updatedAt': 0}
+    ).sort([('sensor', 1), ('timestamp', 1)])
+
+if __name__ == '__main__':
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description='Rolls up the raw sensor readings into hourly buckets.')
+    parser.add_argument('--since', type=datetime.datetime.fromisoformat, default=None,
+                        help='Start of the recomputed period (ISO format). By default the hours since the last run are rolled up, or the last 3 days on the first run.')
+    parser.add_argument('--force', action='store_true', help='Also recomputes the complete buckets, from the raw readings that are still present.')
+    parser.add_argument('--setup', action='store_true', help='Creates the indexes of the rollup collection before rolling up, required once before the first run.')
+    args = parser.parse_args()
+
+    client = MongoClient(os.getenv('DB_URI'))
+    db = client['test']
+    if args.setup:
+        ensure_indexes(db[ROLLUP_COLLECTION])
+        print(f"[ROLLUP] Created the indexes of {ROLLUP_COLLECTION}.")
+
+    counts = update_rollup(db, args.since, force=args.force)
+    client.close()
+
+    print(f"[ROLLUP] Rolled up the readings from {counts['start']} to {counts['end']}: "
+          f"{counts['upserted']} bucket(s) inserted, {counts['matched']} updated, {counts['skipped']} complete bucket(s) skipped, {counts['failed']} failed.")
@@ -0,0 +1,103 @@
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+# Shared reader/writer for the per-sensor hourly tables used by the ML scripts.
+# Every table is stored as two files in the same folder:
+#   <name>.npy  - matrix of the numeric columns, memory-mappable with np.load(mmap_mode='r')
+#   <name>.json - metadata: column order, original dtypes and the values of the label columns
+# Label columns (e.g. 'sensor' and 'roomtype') must hold a single value per table,
+# so they are stored once in the metadata instead of once per row.
+# CSV tables (e.g. the output of preprocess-sort) are still accepted as an input.
+
+FORMAT_VERSION = 1
+TABLE_EXTENSION = '.npy'
+METADATA_EXTENSION = '.json'
+
+# Returns the tables of the folder as a dict of table name -> path, sorted by name.
+# A binary table takes precedence over a CSV file with the same name.
+def list_sensor_tables(folder):
+    tables = {}
+
+    for file in sorted(os.listdir(folder)):
+        name, extension = os.path.splitext(file)
+        if extension == TABLE_EXTENSION or (extension == '.csv' and name not in tables):
+            tables[name] = os.path.join(folder, file)
+
+    return dict(sorted(tables.items()))
+
+def read_metadata(path):
+    with open(os.path.splitext(path)[0] + METADATA_EXTENSION, 'r') as file:
+        return json.load(file)
+
+# Reads a table into a DataFrame with the original column order and dtypes
+def read_sensor_table(path):
+    if path.endswith('.csv'):
+        return pd.read_csv(path)
+
+    metadata = read_metadata(path)
+    matrix = np.load(path)
+
+    df = pd.DataFrame(matrix, columns=metadata['numeric_columns'])
+    for col in metadata['numeric_columns']:
+        df[col] = df[col].astype(metadata['dtypes'][col])
+    for col, value in metadata['labels'].items():
+        df[col] = value
+
+    return df[metadata['columns']]
+
+# Memory-maps the numeric matrix of a table without copying it.
+# Returns the matrix and the names of its columns.
+def load_sensor_matrix(path):
+    metadata = read_metadata(path)
+
+    return np.load(path, mmap_mode='r'), metadata['numeric_columns']
+
+# Writes a DataFrame as <folder>/<name>.npy and <folder>/<name>.json.
+# Returns the path of the written table.
+def write_sensor_table(df, folder, name, dtype=np.float32):
+    os.makedirs(folder, exist_ok=True)
+
+    numeric_columns = [col for col in df.columns if is_numeric_dtype(df[col])]
+    labels = {}
+    for col in df.columns:
+        if col in numeric_columns:
+            continue
+
+        values = df[col].unique()
+        if len(values) > 1:
+            raise ValueError(f"Column '{col}' of table '{name}' is not numeric and holds more than one value.")
+        value = values[0] if len(values) > 0 else None
+        labels[col] = value.item() if isinstance(value, np.generic) else value
+
+    metadata = {
+        'version': FORMAT_VERSION,
+        'rows': len(df),
+        'columns': [str(col) for col in df.columns],
+        'numeric_columns': [str(col) for col in numeric_columns],
+        'dtypes': {str(col): str(df[col].dtype) for col in numeric_columns},
+        'labels': labels
+    }
+
+    path = os.path.join(folder, name + TABLE_EXTENSION)
+    np.save(path, df[numeric_columns].to_numpy(dtype=dtype))
+    with open(os.path.join(folder, name + METADATA_EXTENSION), 'w') as file:
+        json.dump(metadata, file)
+
+    return path
+
+# Converts every CSV table of the input folder into the binary format
+def convert_folder(input_folder, output_folder):
+    for name, path in list_sensor_tables(input_folder).items():
+        write_sensor_table(read_sensor_table(path), output_folder, name)
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("Usage: python sensor_store.py <input_folder> <output_folder>")
+        sys.exit(1)
+
+    convert_folder(sys.argv[1], sys.argv[2])
@@ -0,0 +1,101 @@
+import importlib.util
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+# Tests of the TFLite export (tflite_export.py) and backend (tflite_backend.py).
+# Skipped when TensorFlow is not installed:
+#   python -m pytest ./ml/test_tflite_export.py
+#   python -m unittest discover -s ./ml -p 'test_*.py'
+# The parity of the exported forecast models is only tested when ./ml/models/model_<type>.h5 exist.
+
+HAS_TENSORFLOW = importlib.util.find_spec('tensorflow') is not None
+MODELS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
+# Maximum absolute difference between the Keras and TFLite outputs per quantization
+TOLERANCE = {'none': 1e-4, 'float16': 1e-2, 'int8': 1e-1}
+# Batch sizes of consecutive predict() calls, so the input tensor is resized (and kept) in between
+BATCH_SIZES = [1, 7, 3, 3, 1]
+
+# Tiny untrained model with the layout of the baseline models of train.py
+def tiny_model(model_type, input_shape=(6, 4), horizon=2):
+    from keras.models import Sequential
+    from keras.layers import LSTM, GRU, Dense, Reshape
+
+    layer = LSTM if model_type == 'LSTM' else GRU
+
+    model = Sequential()
+    model.add(layer(8, return_sequences=True, input_shape=input_shape))
+    model.add(layer(4, return_sequences=False))
+    model.add(Dense(horizon * input_shape[1]))
+    model.add(Reshape((horizon, input_shape[1])))
+
+    return model
+
+@unittest.skipUnless(HAS_TENSORFLOW, 'TensorFlow is not installed')
+class TFLiteExportTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    # Converts the model with builtin ops only and loads it with tflite_backend.TFLiteModel
+    def export(self, model, quantization, name):
+        from tflite_export import convert_model
+        from tflite_backend import TFLiteModel
+
+        x_calibration = self.rng.standard_normal((32, *model.input_shape[1:])).astype(np.float32)
+        tflite_path = os.path.join(self.folder.name, f'{name}_{quantization}.tflite')
+        with open(tflite_path, 'wb') as file:
+            file.write(convert_model(model, quantization, x_calibration))
+
+        return TFLiteModel(tflite_path)
+
+    # Runs both models on batches of BATCH_SIZES and compares their outputs
+    def assert_parity(self, model, tflite_model, quantization):
+        for batch_size in BATCH_SIZES:
+            x = self.rng.standard_normal((batch_size, *model.input_shape[1:])).astype(np.float32)
+            expected = model.predict(x, verbose=0)
+            output = tflite_model.predict(x)
+
+            self.assertEqual(output.shape, expected.shape)
+            self.assertEqual(tflite_model.batch_size, batch_size)
+            np.testing.assert_allclose(output, expected, atol=TOLERANCE[quantization])
+
+    def test_recurrent_models(self):
+        from tflite_export import QUANTIZATIONS
+
+        for model_type in ['LSTM', 'GRU']:
+            model = tiny_model(model_type)
+            for quantization in QUANTIZATIONS:
+                with self.subTest(model_type=model_type, quantization=quantization):
+                    self.assert_parity(model, self.export(model, quantization, model_type), quantization)
+
+    def test_predict_in_batches(self):
+        model = tiny_model('LSTM')
+        tflite_model = self.export(model, 'none', 'LSTM')
+        x = self.rng.standard_normal((10, *model.input_shape[1:])).astype(np.float32)
+
+        output = tflite_model.predict(x, batch_size=4)
+
+        self.assertEqual(tflite_model.batch_size, 2)
+        np.testing.assert_allclose(output, model.predict(x, verbose=0), atol=TOLERANCE['none'])
+
+    def test_forecast_models(self):
+        from keras.models import load_model
+        from tflite_export import MODEL_TYPES
+
+        model_types = [model_type for model_type in MODEL_TYPES if os.path.exists(os.path.join(MODELS_PATH, f'model_{model_type}.h5'))]
+        if len(model_types) == 0:
+            self.skipTest('The forecast models are not trained')
+
+        for model_type in model_types:
+            with self.subTest(model_type=model_type):
+                model = load_model(os.path.join(MODELS_PATH, f'model_{model_type}.h5'))
+                self.assert_parity(model, self.export(model, 'none', model_type), 'none')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import numpy as np
+
+# TFLite backend of the forecast models, used by predict.py with --backend tflite.
+# The models exported by tflite_export.py are run with the standalone tflite_runtime
+# interpreter when it is installed, so the full TensorFlow/Keras runtime is not imported.
+# Falls back to the interpreter bundled with TensorFlow otherwise.
+try:
+    from tflite_runtime.interpreter import Interpreter
+except ImportError:
+    from tensorflow.lite import Interpreter
+
+# Wrapper of a TFLite model with the predict() interface of a Keras model
+class TFLiteModel:
+    def __init__(self, model_path):
+        self.interpreter = Interpreter(model_path=model_path)
+        self.input_index = self.interpreter.get_input_details()[0]['index']
+        self.output_index = self.interpreter.get_output_details()[0]['index']
+        self.batch_size = None
+
+    # Resizes the batch dimension of the input tensor, the tensors are only reallocated on a change
+    def resize(self, batch_size, input_shape):
+        if batch_size == self.batch_size:
+            return
+
+        self.interpreter.resize_tensor_input(self.input_index, [batch_size, *input_shape])
+        self.interpreter.allocate_tensors()
+        self.batch_size = batch_size
+
+    def predict(self, x, batch_size=None, verbose=0):
+        x = np.asarray(x, dtype=np.float32)
+        batch_size = batch_size or len(x)
+
+        outputs = []
+        for i in range(0, len(x), batch_size):
+            batch = x[i:i+batch_size]
+            self.resize(len(batch), batch.shape[1:])
+            self.interpreter.set_tensor(self.input_index, batch)
+            self.interpreter.invoke()
+            outputs.append(self.interpreter.get_tensor(self.output_index).copy())
+
+        return np.concatenate(outputs)
+
+# Ensemble of TFLite models with the interface of ensemble.EnsembleModel.
+# The members are run one after another, the weighted average is computed with NumPy.
+class TFLiteEnsembleModel:
+    def __init__(self, members, member_weights):
+        self.members = members
+        self.member_weights = member_weights
+
+    def predict(self, inputs, batch_size=None, verbose=0):
+        outputs = [member.predict(x, batch_size=batch_size) for member, x in zip(self.members, inputs)]
+        ensemble = sum(weight * output for weight, output in zip(self.member_weights, outputs))
+
+        return outputs + [ensemble]
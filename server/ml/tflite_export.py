@@ -0,0 +1,154 @@
+import argparse
+import datetime
+import json
+import os
+import pickle
+import time
+
+import numpy as np
+
+# Disable AVX warnings (might also disable errors output)
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+
+import tensorflow as tf
+from keras.models import load_model
+
+# Exports the forecast models (./ml/models/model_<type>.h5) to TFLite for the tflite backend of predict.py.
+# Optionally quantizes the weights to float16 or int8 (the latter calibrated on samples of x_train)
+# and writes an accuracy report comparing the exported models with the .h5 models on x_test:
+#   python ./ml/tflite_export.py --quantization float16
+# The models are converted to TFLite builtin ops only, so they run with the standalone tflite_runtime.
+# Models that need select TF ops (Flex) are only exported with --allow-select-ops, they can then
+# only be run with the interpreter bundled with TensorFlow.
+# The conversion and the TFLite backend are tested by test_tflite_export.py (skipped without TensorFlow):
+#   python -m pytest ./ml/test_tflite_export.py
+
+MODEL_TYPES = ['LSTM', 'GRU', 'CNN']
+QUANTIZATIONS = ['none', 'float16', 'int8']
+MODELS_PATH = './ml/models'
+TFLITE_MODELS_PATH = './ml/models/tflite'
+DATASET_PATH = './ml/data/dataset.pkl'
+INFERENCE_BATCH_SIZE = 1024
+
+def load_dataset():
+    with open(DATASET_PATH, 'rb') as file:
+        x_train, y_train, x_val, y_val, x_test, y_test = pickle.load(file)
+
+    return x_train, x_test, y_test
+
+# Converts a Keras model to a TFLite flatbuffer.
+# The int8 quantization uses samples of x_calibration as the representative dataset,
+# the inputs and outputs of the model stay float32 in all cases.
+# Only TFLite builtin ops are allowed unless allow_select_ops is set, a model that needs
+# select TF ops then fails to convert instead of failing to load in tflite_runtime.
+def convert_model(model, quantization='none', x_calibration=None, allow_select_ops=False):
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS]
+    if allow_select_ops:
+        converter.target_spec.supported_ops.append(tf.lite.OpsSet.SELECT_TF_OPS)
+
+    if quantization == 'float16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == 'int8':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: ([sample[np.newaxis].astype(np.float32)] for sample in x_calibration)
+
+    try:
+        return converter.convert()
+    except Exception as err:
+        if allow_select_ops:
+            raise
+        raise RuntimeError(f"The model can not be converted to TFLite builtin ops: {err}\n"
+                           "Use --allow-select-ops to export it with select TF ops (requires the full TensorFlow runtime).") from err
+
+# Runs a TFLite flatbuffer on x in batches of INFERENCE_BATCH_SIZE
+def predict_tflite(tflite_model, x):
+    interpreter = tf.lite.Interpreter(model_content=tflite_model)
+    input_index = interpreter.get_input_details()[0]['index']
+    output_index = interpreter.get_output_details()[0]['index']
+
+    outputs = []
+    for i in range(0, len(x), INFERENCE_BATCH_SIZE):
+        batch = x[i:i+INFERENCE_BATCH_SIZE].astype(np.float32)
+        interpreter.resize_tensor_input(input_index, batch.shape)
+        interpreter.allocate_tensors()
+        interpreter.set_tensor(input_index, batch)
+        interpreter.invoke()
+        outputs.append(interpreter.get_tensor(output_index).copy())
+
+    return np.concatenate(outputs)
+
+# Compares the predicted metrics (eCO2, sound, light) of the exported model with the .h5 model
+# and the errors of both models with respect to y_test, all in the normalized space
+def compare_predictions(keras_predictions, tflite_predictions, y_test):
+    keras_metrics = keras_predictions[..., 2:5]
+    tflite_metrics = tflite_predictions[..., 2:5]
+    y_metrics = y_test[..., 2:5]
+
+    return {
+        'max_abs_diff': float(np.max(np.abs(tflite_metrics - keras_metrics))),
+        'mean_abs_diff': float(np.mean(np.abs(tflite_metrics - keras_metrics))),
+        'keras_mae': float(np.mean(np.abs(keras_metrics - y_metrics))),
+        'tflite_mae': float(np.mean(np.abs(tflite_metrics - y_metrics)))
+    }
+
+def export_models(model_types=MODEL_TYPES, quantization='none', calibration_samples=500, allow_select_ops=False):
+    os.makedirs(TFLITE_MODELS_PATH, exist_ok=True)
+
+    x_train, x_test, y_test = load_dataset()
+    rng = np.random.default_rng(0)
+    x_calibration = x_train[rng.choice(len(x_train), min(calibration_samples, len(x_train)), replace=False)]
+
+    report = {
+        'created': datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+        'quantization': quantization,
+        'select_ops': allow_select_ops,
+        'test_samples': len(x_test),
+        'models': {}
+    }
+
+    for model_type in model_types:
+        h5_path = f'{MODELS_PATH}/model_{model_type}.h5'
+        tflite_path = f'{TFLITE_MODELS_PATH}/model_{model_type}.tflite'
+
+        model = load_model(h5_path)
+        tflite_model = convert_model(model, quantization, x_calibration, allow_select_ops)
+        with open(tflite_path, 'wb') as file:
+            file.write(tflite_model)
+
+        stage_start = time.perf_counter()
+        keras_predictions = model.predict(x_test, batch_size=INFERENCE_BATCH_SIZE, verbose=0)
+        keras_time = time.perf_counter() - stage_start
+
+        stage_start = time.perf_counter()
+        tflite_predictions = predict_tflite(tflite_model, x_test)
+        tflite_time = time.perf_counter() - stage_start
+
+        report['models'][model_type] = {
+            'h5_size': os.path.getsize(h5_path),
+            'tflite_size': len(tflite_model),
+            'keras_inference_time': keras_time,
+            'tflite_inference_time': tflite_time,
+            **compare_predictions(keras_predictions, tflite_predictions, y_test)
+        }
+
+        print(f"[{model_type}] Exported {tflite_path} ({quantization}): {report['models'][model_type]}")
+
+    with open(f'{TFLITE_MODELS_PATH}/report.json', 'w') as file:
+        json.dump(report, file, indent=4)
+
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the forecast models to TFLite.')
+    parser.add_argument('--models', nargs='+', choices=MODEL_TYPES, default=MODEL_TYPES)
+    parser.add_argument('--quantization', choices=QUANTIZATIONS, default='none')
+    parser.add_argument('--calibration-samples', type=int, default=500, help='Number of x_train samples used to calibrate the int8 quantization.')
+    parser.add_argument('--allow-select-ops', action='store_true', help='Allows select TF ops, the exported models then require the full TensorFlow runtime instead of tflite_runtime.')
+    args = parser.parse_args()
+
+    if args.allow_select_ops:
+        print("[TFLITE] Warning: select TF ops are allowed, models that use them can not be run with tflite_runtime.")
+
+    export_models(args.models, args.quantization, args.calibration_samples, args.allow_select_ops)
@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+
+# Batched fitting of the medium/high thresholds.
+# Every (sensor, day, hour, metric) cell clusters its values into 3 groups (low, medium, high).
+# Instead of a separate KMeans fit per cell, all cells are solved at once with the exact
+# 1-D optimal partition: in one dimension the clusters of an optimal k-means solution are
+# contiguous runs of the sorted values, so the best 3-clustering is found by trying every
+# pair of split points using prefix sums.
+
+NR_OF_CLUSTERS = 3
+# Upper bound on the number of (cell, split, split) costs evaluated at once
+MAX_BLOCK_SIZE = 2 ** 22
+
+# Sum of squared deviations of the sorted values in [start, end) from their mean,
+# given the prefix sums s1 (values) and s2 (squared values)
+def segment_cost(s1, s2, start, end):
+    size = end - start
+    total = np.take_along_axis(s1, end, axis=1) - np.take_along_axis(s1, start, axis=1)
+    total_sq = np.take_along_axis(s2, end, axis=1) - np.take_along_axis(s2, start, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(size > 0, total_sq - total ** 2 / size, 0)
+
+# Cluster centers (low, medium, high) of a block of cells with sorted, NaN-padded values
+def fit_block(values):
+    nr_of_cells, length = values.shape
+    n = np.sum(~np.isnan(values), axis=1)
+
+    # Values are shifted by the cell minimum to keep the prefix sums well conditioned
+    shifted = np.nan_to_num(values - values[:, :1])
+    s1 = np.concatenate([np.zeros((nr_of_cells, 1)), np.cumsum(shifted, axis=1)], axis=1)
+    s2 = np.concatenate([np.zeros((nr_of_cells, 1)), np.cumsum(shifted ** 2, axis=1)], axis=1)
+
+    # Split points i < j divide the values into [0, i), [i, j) and [j, n)
+    i, j = np.triu_indices(length + 1, k=1)
+    valid = (i >= 1)[None, :] & (j <= n[:, None] - 1)
+    i = np.broadcast_to(i, valid.shape)
+    j = np.broadcast_to(j, valid.shape)
+    end = np.broadcast_to(n[:, None], valid.shape)
+    zero = np.zeros_like(i)
+
+    cost = segment_cost(s1, s2, zero, i) + segment_cost(s1, s2, i, j) + segment_cost(s1, s2, j, end)
+    best = np.argmin(np.where(valid, cost, np.inf), axis=1)[:, None]
+    i = np.take_along_axis(i, best, axis=1)
+    j = np.take_along_axis(j, best, axis=1)
+    end = n[:, None]
+
+    bounds = [(np.zeros_like(i), i), (i, j), (j, end)]
+    centers = np.stack([
+        (np.take_along_axis(s1, stop, axis=1) - np.take_along_axis(s1, start, axis=1))[:, 0] / (stop - start)[:, 0]
+        for start, stop in bounds
+    ], axis=1)
+
+    return centers + values[:, :1]
+
+# Fits the thresholds of many cells at once.
+# values is an (..., L) array holding the values of every cell, padded with NaN.
+# Returns an (..., 2) array with the (medium, high) thresholds of every cell:
+#   levels='centers'    - the middle and top cluster centers, the same thresholds
+#                         as the per-cell KMeans fit previously used in train.py
+#   levels='boundaries' - the decision boundaries between the low/medium and medium/high clusters
+# Cells with less than 3 values use their largest value as both thresholds,
+# cells without values get NaN.
+def fit_thresholds(values, levels='centers'):
+    values = np.asarray(values, dtype=np.float64)
+    shape = values.shape[:-1]
+    values = np.sort(values.reshape(-1, values.shape[-1]), axis=1)
+
+    n = np.sum(~np.isnan(values), axis=1)
+    length = int(n.max()) if len(n) > 0 else 0
+    values = values[:, :length]
+
+    centers = np.full((len(values), NR_OF_CLUSTERS), np.nan)
+    if length > 0:
+        top = values[np.arange(len(values)), np.maximum(n - 1, 0)]
+        centers[n > 0] = top[n > 0, None]
+
+    cells = np.nonzero(n >= NR_OF_CLUSTERS)[0]
+    block_size = max(1, MAX_BLOCK_SIZE // ((length + 1) ** 2))
+    for block_start in range(0, len(cells), block_size):
+        block = cells[block_start:block_start + block_size]
+        centers[block] = fit_block(values[block])
+
+    if levels == 'centers':
+        result = centers[:, 1:]
+    elif levels == 'boundaries':
+        result = (centers[:, :-1] + centers[:, 1:]) / 2
+    else:
+        raise ValueError(f"Unknown threshold levels: {levels}")
+
+    return result.reshape(shape + (2,))
+
+# Groups the values of a per-sensor hourly table by day and hour.
+# Returns the (day, hour) index of the cells and an (cells, metrics, L) array of their values,
+# padded with NaN up to the size of the largest cell, ready to be passed to fit_thresholds().
+def day_hour_values(df, metrics):
+    df = df.sort_values(['day', 'hour'], kind='stable')
+    grouped = df.groupby(['day', 'hour'], sort=True)
+
+    cell = grouped.ngroup().to_numpy()
+    rank = grouped.cumcount().to_numpy()
+    nr_of_cells = int(cell.max()) + 1 if len(cell) > 0 else 0
+    length = int(rank.max()) + 1 if len(rank) > 0 else 0
+
+    values = np.full((nr_of_cells, len(metrics), length), np.nan)
+    values[cell, :, rank] = df[metrics].to_numpy(dtype=np.float64)
+
+    index = pd.MultiIndex.from_frame(df[['day', 'hour']].drop_duplicates())
+
+    return index, values
@@ -2,32 +2,33 @@ import array
 import json
 import sys
 import os
-import warnings
 from keras.models import Model, Sequential, load_model
 from keras.layers import Input, LSTM, Dense, Flatten, Reshape, GRU, Conv1D, MaxPooling1D, Dropout
 from keras.optimizers import Adam
 from keras.callbacks import EarlyStopping, ReduceLROnPlateau
 import keras_tuner
+import tensorflow as tf
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import pandas as pd
 from scipy.stats import zscore
-from glob import glob
 from dotenv import load_dotenv
 import matplotlib.pyplot as plt
 import seaborn as sns
 from sklearn.calibration import LabelEncoder
 import pickle
-from sklearn.cluster import KMeans
-from sklearn.exceptions import ConvergenceWarning
-
-warnings.filterwarnings("ignore", category=ConvergenceWarning)
 
+from sensor_store import list_sensor_tables, read_sensor_table, write_sensor_table, load_sensor_matrix, read_metadata
+from parallel import DEFAULT_WORKERS, run_per_sensor, report_failures
+from lookup_tables import normalization_params_toJSON, thresholds_toJSON, export_lookup_tables
+from threshold_fitting import fit_thresholds, day_hour_values
 
 load_dotenv()
 
 DATASET_PATH = os.getenv('PROCESSED_BYSENSOR_REM_DATA_PATH')
-FILE_PATHS = glob(os.path.join(DATASET_PATH, '*.csv'))
-SENSOR_NAMES = [os.path.splitext(os.path.basename(file_path))[0] for file_path in FILE_PATHS]
+SENSOR_TABLES = list_sensor_tables(DATASET_PATH)
+FILE_PATHS = list(SENSOR_TABLES.values())
+SENSOR_NAMES = list(SENSOR_TABLES.keys())
 ROOMTYPES = pd.read_excel(os.getenv('ROOM_DATA_PATH'))['Room type'].dropna().unique()
 
 WINDOW_SIZE = 6
@@ -36,59 +37,34 @@ NR_OF_FEATURES = 13
 INPUT_SHAPE = (WINDOW_SIZE, NR_OF_FEATURES)
 OUTPUT_SHAPE = (PREDICTION_HORIZON, NR_OF_FEATURES)
 
+# Per-sensor normalized arrays used by the streaming input pipeline
+SENSOR_ARRAYS_PATH = './ml/data/sensors'
+# Number of sensors whose windows are interleaved by the streaming input pipeline
+INTERLEAVE_CYCLE_LENGTH = 16
+
 normalization_params = {}
 thresholds = {}
 sensor_label_encoder = LabelEncoder()
 roomtype_label_encoder = LabelEncoder()
 
-def normalization_params_toJSON(normalization_params):
-    json_obj = {}
-    for sensor_name, days in normalization_params.items():
-        sensor_data = {}
-        for day, hours in days.items():
-            day_data = {}
-            for hour, values in hours.items():
-                key = f"{hour}"
-                day_data[key] = {
-                    'std_eCO2': values['std_eCO2'],
-                    'mean_eCO2': values['mean_eCO2'],
-                    'std_sound': values['std_sound'],
-                    'mean_sound': values['mean_sound'],
-                    'std_light': values['std_light'],
-                    'mean_light': values['mean_light'],
-                }
-            sensor_data[str(day)] = day_data
-        json_obj[sensor_name] = sensor_data
-
-    return json_obj
-
-def thresholds_toJSON(thresholds):
-    json_obj = {}
-    for sensor_name, days in thresholds.items():
-        sensor_data = {}
-        for day, hours in days.items():
-            day_data = {}
-            for hour, cols in hours.items():
-                hour_data = {}
-                for col, levels in cols.items():
-                    col_data = {}
-                    for level, value in levels.items():
-                        col_data[level] = value
-                    hour_data[col] = col_data
-                day_data[str(hour)] = hour_data
-            sensor_data[str(day)] = day_data
-        json_obj[sensor_name] = sensor_data
-    return json_obj
-    
-
-def preprocess_data():
+def preprocess_data(streaming=False, workers=DEFAULT_WORKERS):
     global sensor_label_encoder, roomtype_label_encoder, normalization_params, x_train, y_train, x_val, y_val, x_test, y_test
     sensor_dfs = []
 
-    for sensor_name, file_path in zip(SENSOR_NAMES, FILE_PATHS):
-        sensor_df = normalize_sensor_data(sensor_name, file_path)
+    # In the streaming mode every sensor is written to SENSOR_ARRAYS_PATH as soon as it is normalized,
+    # so the tables of all sensors are never held in memory at the same time
+    tasks = {sensor_name: (sensor_name, file_path, streaming) for sensor_name, file_path in zip(SENSOR_NAMES, FILE_PATHS)}
+    results, failures = run_per_sensor(normalize_sensor_task, tasks, workers)
+    report_failures('train', results, failures)
+    
+    # Sensors that failed to be processed are left out of the dataset and the encoders
+    sensor_names = list(results.keys())
+    for sensor_name, (sensor_df, sensor_normalization_params, sensor_thresholds) in results.items():
+        normalization_params[sensor_name] = sensor_normalization_params
+        thresholds[sensor_name] = sensor_thresholds
         # print(sensor_df)
-        sensor_dfs.append(sensor_df)
+        if not streaming:
+            sensor_dfs.append(sensor_df)
         
     with open('./ml/obj/normalization_params.pkl', 'wb') as file:
         pickle.dump(normalization_params, file)
@@ -103,7 +79,7 @@ def preprocess_data():
         json.dump(thresholds_toJSON(thresholds), file, indent=4)
 
     # df = pd.concat(sensor_dfs, ignore_index=True)
-    sensor_label_encoder.fit(SENSOR_NAMES)
+    sensor_label_encoder.fit(sensor_names)
     roomtype_label_encoder.fit(ROOMTYPES)
 
     with open('./ml/obj/sensor_label_encoder.pkl', 'wb') as file:
@@ -112,10 +88,20 @@ def preprocess_data():
     with open('./ml/obj/roomtype_label_encoder.pkl', 'wb') as file:
         pickle.dump(roomtype_label_encoder, file)
 
+    export_lookup_tables(normalization_params, thresholds, sensor_label_encoder.classes_)
+
+    # In the streaming mode the windows are generated on the fly by make_dataset()
+    if streaming:
+        for sensor_name, sensor_idx in zip(sensor_names, sensor_label_encoder.transform(sensor_names)):
+            set_sensor_index(sensor_name, sensor_idx)
+        return
+
     for df in sensor_dfs:
         df['sensor'] = sensor_label_encoder.transform(df['sensor'])
         df['roomtype'] = roomtype_label_encoder.transform(df['roomtype'])
     
+    save_sensor_arrays(sensor_names, sensor_dfs)
+    
     x_train, y_train, x_val, y_val, x_test, y_test = create_sliding_window_sequences(sensor_dfs, WINDOW_SIZE, PREDICTION_HORIZON)
     
     with open('./ml/data/dataset.pkl', 'wb') as file:
@@ -126,9 +112,9 @@ def preprocess_data():
 def calculate_zscores(val, mean, std):
     return (val - mean) / std if std != 0 else 0
 
-# Read and preprocess a CSV file for a specific sensor
+# Read and preprocess the table of a specific sensor
 def normalize_sensor_data(sensor_name, file_path):
-    df = pd.read_csv(file_path)
+    df = read_sensor_table(file_path)
 
     df = df[['sensor','hour', 'eCO2', 'sound', 'light', 'roomtype', 'day']]
     
@@ -152,6 +138,18 @@ def normalize_sensor_data(sensor_name, file_path):
 
     return df
 
+# Normalizes the table of a single sensor in a worker process.
+# Returns the normalization params and thresholds of the sensor along with the table,
+# since the globals of a worker process are not shared with the parent process.
+# In the streaming mode the table is written by the worker instead and None is returned in its place.
+def normalize_sensor_task(sensor_name, file_path, streaming=False):
+    df = normalize_sensor_data(sensor_name, file_path)
+    if streaming:
+        write_sensor_array(df, sensor_name)
+        df = None
+    
+    return df, normalization_params[sensor_name], thresholds[sensor_name]
+
 def create_normalization_params(df, sensor_name):
     global normalization_params
     
@@ -179,69 +177,78 @@ def create_normalization_params(df, sensor_name):
             normalization_params[sensor_name][day][hour][f'mean_{col}'] = group[col].mean()
             normalization_params[sensor_name][day][hour][f'std_{col}'] = group[col].std()
 
-def compute_thresholds(df, sensor_name):
+# Computes the medium/high thresholds of every day-hour of the sensor.
+# All day-hours and metrics are fitted at once by the batched 1-D clustering of threshold_fitting.py,
+# levels='centers' keeps the thresholds at the middle/top cluster centers.
+def compute_thresholds(df, sensor_name, levels='centers'):
     global thresholds
-    grouped = df.groupby(['day', 'hour'])
-    
+    metrics = ['eCO2', 'sound', 'light']
+    cells, values = day_hour_values(df, metrics)
+    fitted = fit_thresholds(values, levels)
+
     if sensor_name not in thresholds:
         thresholds[sensor_name] = {}
 
-    for (day, hour), group in grouped:
-        data = group[['eCO2', 'sound', 'light']]
+    for (day, hour), cell in zip(cells, fitted):
         if day not in thresholds[sensor_name]:
             thresholds[sensor_name][day] = {}
-        
-        if hour not in thresholds[sensor_name][day]:
-            thresholds[sensor_name][day][hour] = {}
 
-        for col in ['eCO2', 'sound', 'light']:
-            kmeans = KMeans(n_clusters=3, n_init='auto')
-            kmeans.fit(data[[col]])
+        thresholds[sensor_name][day][hour] = {
+            col: {'medium': cell[col_idx, 0], 'high': cell[col_idx, 1]}
+            for col_idx, col in enumerate(metrics)
+        }
+
+# Returns the (start, end) window indices of the provided split ('train', 'val' or 'test')
+# for a sensor with total_samples hourly entries.
+# The last validation_ratio and test_ratio parts of the windows are used for validation and testing.
+def get_split_bounds(total_samples, input_size, output_size, split, validation_ratio=0.1, test_ratio=0.1):
+    test_samples = int(total_samples * test_ratio)
+    val_samples = int(total_samples * validation_ratio)
+    train_samples = total_samples - val_samples - test_samples - input_size - output_size + 1
+
+    bounds = {
+        'train': (0, train_samples),
+        'val': (train_samples, train_samples + val_samples),
+        'test': (train_samples + val_samples, train_samples + val_samples + test_samples)
+    }
+    start, end = bounds[split]
+
+    return max(start, 0), max(end, 0)
+
+# Lazily yields the (x, y) windows of the provided split, one sensor at a time.
+# Windows are strided views over the float32 matrix of each sensor, so no window is copied
+# until the caller stacks them. x has the shape (windows, input_size, features),
+# y has the shape (windows, output_size, features).
+def iter_sliding_windows(dfs, input_size, output_size, split, validation_ratio=0.1, test_ratio=0.1):
+    for df in dfs:
+        data = np.asarray(df, dtype=np.float32)
+        start, end = get_split_bounds(len(data), input_size, output_size, split, validation_ratio, test_ratio)
+        if end <= start:
+            continue
 
-            cluster_centers = kmeans.cluster_centers_
-            cluster_centers_sorted = sorted(cluster_centers.flatten())
+        windows = sliding_window_view(data, input_size + output_size, axis=0).transpose(0, 2, 1)[start:end]
 
-            low_to_medium_threshold = cluster_centers_sorted[1]
-            medium_to_high_threshold = cluster_centers_sorted[2]
-            
-            if col not in thresholds[sensor_name][day][hour]:
-                thresholds[sensor_name][day][hour][col] = {}
-                thresholds[sensor_name][day][hour][col]['medium'] = {}
-                thresholds[sensor_name][day][hour][col]['high'] = {}
+        yield windows[:, :input_size], windows[:, input_size:]
 
-            thresholds[sensor_name][day][hour][col]['medium'] = low_to_medium_threshold
-            thresholds[sensor_name][day][hour][col]['high'] = medium_to_high_threshold
+# Stacks the windows yielded by iter_sliding_windows() into two arrays
+def stack_windows(windows, input_size, output_size, nr_of_features):
+    windows = list(windows)
+    if len(windows) == 0:
+        return np.empty((0, input_size, nr_of_features), dtype=np.float32), np.empty((0, output_size, nr_of_features), dtype=np.float32)
+
+    return np.concatenate([x for x, _ in windows]), np.concatenate([y for _, y in windows])
 
 def create_sliding_window_sequences(dfs, input_size, output_size, validation_ratio=0.1, test_ratio=0.1):
-    x_train = []
-    y_train = []
-    x_val = []
-    y_val = []
-    x_test = []
-    y_test = []
+    nr_of_features = dfs[0].shape[1] if len(dfs) > 0 else NR_OF_FEATURES
     
-    for df in dfs:
-        total_samples = len(df)
-        test_samples = int(total_samples * test_ratio)
-        val_samples = int(total_samples * validation_ratio)
-        train_samples = total_samples - val_samples - test_samples - input_size - output_size + 1
-        
-        for i in range(train_samples):
-            x_train.append(df[i:i+input_size])
-            y_train.append(df[i+input_size:i+input_size+output_size])
-        
-        for i in range(train_samples, train_samples + val_samples):
-            x_val.append(df[i:i+input_size])
-            y_val.append(df[i+input_size:i+input_size+output_size])
-
-        for i in range(train_samples + val_samples, train_samples + val_samples + test_samples):
-            x_test.append(df[i:i+input_size])
-            y_test.append(df[i+input_size:i+input_size+output_size])
+    x_train, y_train = stack_windows(iter_sliding_windows(dfs, input_size, output_size, 'train', validation_ratio, test_ratio), input_size, output_size, nr_of_features)
+    x_val, y_val = stack_windows(iter_sliding_windows(dfs, input_size, output_size, 'val', validation_ratio, test_ratio), input_size, output_size, nr_of_features)
+    x_test, y_test = stack_windows(iter_sliding_windows(dfs, input_size, output_size, 'test', validation_ratio, test_ratio), input_size, output_size, nr_of_features)
     
     return (
-        np.array(x_train), np.array(y_train),
-        np.array(x_val), np.array(y_val),
-        np.array(x_test), np.array(y_test)
+        x_train, y_train,
+        x_val, y_val,
+        x_test, y_test
     )
 
 def load_dataset():
@@ -249,7 +256,79 @@ def load_dataset():
     with open('./ml/data/dataset.pkl', 'rb') as file:
         x_train, y_train, x_val, y_val, x_test, y_test = pickle.load(file)
 
-def train_LSTM_baseline(loss_func):
+# Stores the normalized matrix of every sensor as a separate float32 table,
+# which is used by make_dataset() to stream the windows.
+def save_sensor_arrays(sensor_names, sensor_dfs):
+    for sensor_name, df in zip(sensor_names, sensor_dfs):
+        write_sensor_table(df, SENSOR_ARRAYS_PATH, sensor_name)
+
+# Stores the normalized matrix of a single sensor from its worker process (streaming mode).
+# The room type encoder is fitted on ROOMTYPES, so it can be refitted in every worker.
+# The sensor index depends on the sensors that were processed successfully,
+# the column is filled in by set_sensor_index() once all sensors are done.
+def write_sensor_array(df, sensor_name):
+    df['sensor'] = -1
+    df['roomtype'] = LabelEncoder().fit(ROOMTYPES).transform(df['roomtype'])
+    write_sensor_table(df, SENSOR_ARRAYS_PATH, sensor_name)
+
+# Sets the 'sensor' column of a table written by write_sensor_array() in place
+def set_sensor_index(sensor_name, sensor_idx):
+    path = os.path.join(SENSOR_ARRAYS_PATH, sensor_name + '.npy')
+    matrix = np.load(path, mmap_mode='r+')
+    matrix[:, read_metadata(path)['numeric_columns'].index('sensor')] = sensor_idx
+    matrix.flush()
+    del matrix
+
+# Creates a tf.data pipeline for the provided split ('train', 'val' or 'test').
+# The windows are generated on the fly from the memory-mapped sensor arrays,
+# so the dataset never has to fit in memory as a whole.
+# The windows of INTERLEAVE_CYCLE_LENGTH sensors are interleaved, with shuffle the order of the
+# sensors is reshuffled every epoch as well, so the shuffle buffer mixes the windows of many sensors.
+# Returns unbatched (x, y) pairs if batch_size is not provided.
+def make_dataset(split, batch_size=None, shuffle=False, shuffle_buffer_size=10000):
+    sensor_paths = list(list_sensor_tables(SENSOR_ARRAYS_PATH).values())
+    
+    def generator(path):
+        yield from iter_sliding_windows([load_sensor_matrix(path.decode())[0]], WINDOW_SIZE, PREDICTION_HORIZON, split)
+    
+    def sensor_windows(path):
+        return tf.data.Dataset.from_generator(generator, args=(path,), output_signature=(
+            tf.TensorSpec(shape=(None, *INPUT_SHAPE), dtype=tf.float32),
+            tf.TensorSpec(shape=(None, *OUTPUT_SHAPE), dtype=tf.float32)
+        )).unbatch()
+    
+    dataset = tf.data.Dataset.from_tensor_slices(tf.constant(sensor_paths, dtype=tf.string))
+    if shuffle:
+        dataset = dataset.shuffle(max(len(sensor_paths), 1), reshuffle_each_iteration=True)
+    dataset = dataset.interleave(sensor_windows, cycle_length=INTERLEAVE_CYCLE_LENGTH, block_length=1)
+    
+    if shuffle:
+        dataset = dataset.shuffle(shuffle_buffer_size)
+    if batch_size is not None:
+        dataset = dataset.batch(batch_size)
+    
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+# Fits the model either on the in-memory dataset or on the streamed one
+def fit_model(model, callbacks, streaming=False, epochs=72, batch_size=32):
+    if streaming:
+        return model.fit(make_dataset('train', batch_size, shuffle=True), epochs=epochs, validation_data=make_dataset('val', batch_size), callbacks=callbacks)
+    
+    return model.fit(x_train, y_train, epochs=epochs, batch_size=batch_size, validation_data=(x_val, y_val), callbacks=callbacks)
+
+# Batches the streamed training and validation data with the tuned batch size.
+# In-memory arrays are passed through, the batch size is then provided to fit() instead.
+def batch_tuner_data(args, kwargs, batch_size):
+    if len(args) > 0 and isinstance(args[0], tf.data.Dataset):
+        args = (args[0].batch(batch_size), *args[1:])
+        if isinstance(kwargs.get('validation_data'), tf.data.Dataset):
+            kwargs['validation_data'] = kwargs['validation_data'].batch(batch_size)
+    else:
+        kwargs['batch_size'] = batch_size
+    
+    return args, kwargs
+
+def train_LSTM_baseline(loss_func, streaming=False):
     model = Sequential()
     model.add(LSTM(64, return_sequences=True, input_shape=INPUT_SHAPE, recurrent_dropout=0))
     model.add(LSTM(32, return_sequences=False))
@@ -260,7 +339,7 @@ def train_LSTM_baseline(loss_func):
     early_stopping = EarlyStopping(monitor='val_loss', patience=5, restore_best_weights=True)
     reduce_lr = ReduceLROnPlateau(monitor='val_loss', factor=0.2, patience=3, min_lr=1e-6)
 
-    history = model.fit(x_train, y_train, epochs=72, batch_size=32, validation_data=(x_val, y_val), callbacks=[early_stopping, reduce_lr])
+    history = fit_model(model, [early_stopping, reduce_lr], streaming)
     
     model.save(f'./ml/models/baseline/LSTM_{loss_func}.h5')
     # with open(f'./ml/stats/baselines/LSTM_{loss_func}_changed.pkl', 'wb') as file:
@@ -268,7 +347,7 @@ def train_LSTM_baseline(loss_func):
         
     return model
 
-def train_GRU_baseline(loss_func):
+def train_GRU_baseline(loss_func, streaming=False):
     model = Sequential()
     model.add(GRU(64, return_sequences=True, input_shape=INPUT_SHAPE, recurrent_dropout=0))
     model.add(GRU(32, return_sequences=False))
@@ -279,7 +358,7 @@ def train_GRU_baseline(loss_func):
     early_stopping_cb = EarlyStopping(monitor='val_loss', patience=5, restore_best_weights=True)
     reduce_lr_cb = ReduceLROnPlateau(monitor='val_loss', factor=0.2, patience=3, min_lr=1e-6)
 
-    history = model.fit(x_train, y_train, epochs=72, batch_size=32, validation_data=(x_val, y_val), callbacks=[early_stopping_cb, reduce_lr_cb])
+    history = fit_model(model, [early_stopping_cb, reduce_lr_cb], streaming)
 
     model.save(f'./ml/models/baseline/GRU_{loss_func}.h5')
     # with open(f'./ml/stats/baselines/GRU_{loss_func}.pkl', 'wb') as file:
@@ -287,7 +366,7 @@ def train_GRU_baseline(loss_func):
     
     return model
 
-def train_CNN_baseline(loss_func):
+def train_CNN_baseline(loss_func, streaming=False):
     model = Sequential()
     model.add(Conv1D(64, 3, activation='relu', input_shape=INPUT_SHAPE))
     model.add(Conv1D(32, 3, activation='relu'))
@@ -300,7 +379,7 @@ def train_CNN_baseline(loss_func):
     early_stopping_cb = EarlyStopping(monitor='val_loss', patience=5, restore_best_weights=True)
     reduce_lr_cb = ReduceLROnPlateau(monitor='val_loss', factor=0.2, patience=3, min_lr=1e-6)
 
-    history = model.fit(x_train, y_train, epochs=72, batch_size=32, validation_data=(x_val, y_val), callbacks=[early_stopping_cb, reduce_lr_cb])
+    history = fit_model(model, [early_stopping_cb, reduce_lr_cb], streaming)
     
     model.save(f'./ml/models/baselines/CNN_{loss_func}_nopol.h5')
     with open(f'./ml/stats/baselines/CNN_{loss_func}_nopol.pkl', 'wb') as file:
@@ -327,9 +406,9 @@ class CustomModelLSTM(keras_tuner.HyperModel):
         return model
     
     def fit(self, hp, model, *args, **kwargs):
+        args, kwargs = batch_tuner_data(args, kwargs, hp.Choice('batch_size', values=[2, 4, 8, 16, 32, 64, 128, 256]))
         return model.fit(
             *args,
-            batch_size=hp.Choice('batch_size', values=[2, 4, 8, 16, 32, 64, 128, 256]),
             **kwargs,
         )
         
@@ -353,13 +432,13 @@ class CustomModelGRU(keras_tuner.HyperModel):
         return model
     
     def fit(self, hp, model, *args, **kwargs):
+        args, kwargs = batch_tuner_data(args, kwargs, hp.Choice('batch_size', values=[4, 8, 16, 32, 64, 128, 256]))
         return model.fit(
             *args,
-            batch_size=hp.Choice('batch_size', values=[4, 8, 16, 32, 64, 128, 256]),
             **kwargs,
         )
 
-def get_best_hps(build_model, loss_func, model_name):    
+def get_best_hps(build_model, loss_func, model_name, streaming=False):    
     tuner= keras_tuner.Hyperband(
         hypermodel=build_model(),
         objective='val_loss',
@@ -372,7 +451,10 @@ def get_best_hps(build_model, loss_func, model_name):
     early_stopping_cb = EarlyStopping(monitor='val_loss', patience=5, restore_best_weights=True)
     reduce_lr_cb = ReduceLROnPlateau(monitor='val_loss', factor=0.2, patience=3, min_lr=1e-6)
     
-    tuner.search(x_train, y_train, epochs=36, validation_data=(x_val, y_val), callbacks=[early_stopping_cb, reduce_lr_cb])
+    if streaming:
+        tuner.search(make_dataset('train', shuffle=True), epochs=36, validation_data=make_dataset('val'), callbacks=[early_stopping_cb, reduce_lr_cb])
+    else:
+        tuner.search(x_train, y_train, epochs=36, validation_data=(x_val, y_val), callbacks=[early_stopping_cb, reduce_lr_cb])
     best_hyperparameters = tuner.get_best_hyperparameters()[0]
     print(best_hyperparameters)
     
@@ -384,24 +466,34 @@ def get_best_hps(build_model, loss_func, model_name):
 #         history = pickle.load(file)
 #         print(history)
     
-# preprocess_data()
-load_dataset()
+if __name__ == '__main__':
+    # preprocess_data()
+    # preprocess_data(workers=os.cpu_count())
+    load_dataset()
+
+    # Streaming mode, the windows are generated from the per-sensor arrays instead of dataset.pkl
+    # preprocess_data(streaming=True)
+    # train_LSTM_baseline('huber_loss', streaming=True)
+    # get_best_hps(CustomModelLSTM, 'huber_loss', 'LSTM', streaming=True)
+
+    # train_LSTM_baseline('mse')
+    # train_LSTM_baseline('mae')
+    # train_LSTM_baseline('huber_loss')
 
-# train_LSTM_baseline('mse')
-# train_LSTM_baseline('mae')
-# train_LSTM_baseline('huber_loss')
+    # train_GRU_baseline('mse')
+    # train_GRU_baseline('mae')
+    # train_GRU_baseline('huber_loss')
 
-# train_GRU_baseline('mse')
-# train_GRU_baseline('mae')
-# train_GRU_baseline('huber_loss')
+    # train_CNN_baseline('mse')
+    # train_CNN_baseline('mae')
+    # train_CNN_baseline('huber_loss')
 
-# train_CNN_baseline('mse')
-# train_CNN_baseline('mae')
-# train_CNN_baseline('huber_loss')
+    # print_history('CNN', 'mse')
+    # print_history('CNN', 'mae')
+    # print_history('LSTM', 'huber_loss')
 
-# print_history('CNN', 'mse')
-# print_history('CNN', 'mae')
-# print_history('LSTM', 'huber_loss')
+    # get_best_hps(CustomModelLSTM, 'huber_loss', 'LSTM')
+    # get_best_hps(CustomModelGRU, 'huber_loss', 'GRU')
 
-# get_best_hps(CustomModelLSTM, 'huber_loss', 'LSTM')
-# get_best_hps(CustomModelGRU, 'huber_loss', 'GRU')
\ No newline at end of file
+    # The chosen models (./ml/models/model_<type>.h5) are exported for the TFLite backend of predict.py
+    # by a separate step: python ./ml/tflite_export.py --quantization float16
@@ -0,0 +1,164 @@
+import datetime
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from lookup_tables import LOOKUP_TABLES_PATH, METRICS, NR_OF_DAYS, NR_OF_HOURS, load_lookup_tables
+
+# Synthetic sensor workload for scale testing.
+# Every synthetic sensor gets a profile: the mean and standard deviation of every metric per
+# (day, hour), so the generated data follows the day/hour seasonality of the real sensors.
+# Profiles are either parametric (an occupancy curve of the working hours) or copied from the
+# normalization tables of the real sensors (lookup_tables.py), with a small per-sensor jitter.
+# From a profile an hourly table in the format of the per-sensor tables is generated
+# (sensor, hour, eCO2, sound, light, roomtype, day), with autocorrelated noise, injected outliers
+# and gaps of missing hours. The hourly table can in turn be expanded into raw readings with the
+# fields of the 'sensordatas' collection, which average back to the hourly values.
+# Used by generate-workload.py and benchmark.py.
+
+TABLE_COLUMNS = ['sensor', 'hour', 'eCO2', 'sound', 'light', 'roomtype', 'day']
+ROOMTYPE_ENCODER_PATH = './ml/obj/roomtype_label_encoder.pkl'
+# Correlation of the noise of consecutive hours
+NOISE_CORRELATION = 0.7
+NOISE_KERNEL_SIZE = 12
+# Outliers deviate from the mean of their day-hour by OUTLIER_SCALE standard deviations
+OUTLIER_SCALE = (4, 8)
+# Share of every color channel in the light level (mean of color_r, color_g and color_b)
+COLOR_SHARES = np.array([1.1, 1.0, 0.9])
+
+def sensor_names(nr_of_sensors, prefix='synth'):
+    return [f'{prefix}{idx:05d}' for idx in range(nr_of_sensors)]
+
+def load_roomtypes(path=ROOMTYPE_ENCODER_PATH):
+    with open(path, 'rb') as file:
+        return [str(roomtype) for roomtype in pickle.load(file).classes_]
+
+# Room types are assigned round-robin, so every room type is equally represented
+def assign_roomtypes(sensors, roomtypes):
+    return {sensor: roomtypes[idx % len(roomtypes)] for idx, sensor in enumerate(sensors)}
+
+# Occupancy (0-1) of every (day, hour): a bump around midday on weekdays (days 1-5, 0 = Sunday)
+# and a fraction of it in the weekend, shifted and scaled per sensor
+def occupancy_curve(peak_hour, width, weekend_share, level):
+    hours = np.arange(NR_OF_HOURS)
+    bump = np.exp(-0.5 * ((hours - peak_hour) / width) ** 2)
+    days = np.where(np.isin(np.arange(NR_OF_DAYS), [0, 6]), weekend_share, 1.0)
+
+    return level * days[:, None] * bump[None, :]
+
+# Parametric profiles of shape (sensors, days, hours, metrics) for the mean and std.
+# eCO2 and sound rise with the occupancy, light follows the daylight and the occupancy.
+def parametric_profiles(nr_of_sensors, rng):
+    mean = np.empty((nr_of_sensors, NR_OF_DAYS, NR_OF_HOURS, len(METRICS)))
+    hours = np.arange(NR_OF_HOURS)
+    daylight = np.clip(np.sin((hours - 6) / 14 * np.pi), 0, None)
+
+    for idx in range(nr_of_sensors):
+        occupancy = occupancy_curve(rng.uniform(11, 15), rng.uniform(2, 4), rng.uniform(0, 0.2), rng.uniform(0.3, 1))
+        mean[idx, ..., 0] = rng.uniform(400, 700) + occupancy * rng.uniform(300, 900)
+        mean[idx, ..., 1] = rng.uniform(120, 150) + occupancy * rng.uniform(10, 30)
+        mean[idx, ..., 2] = daylight[None, :] * rng.uniform(5, 40) + occupancy * rng.uniform(20, 80)
+
+    std = 0.1 * mean + np.array([20, 5, 2])
+
+    return mean, std
+
+# Profiles copied from the normalization tables of the real sensors (round-robin),
+# scaled by a per-sensor jitter. Cells without statistics use the mean of the sensor.
+def lookup_profiles(nr_of_sensors, rng, path=LOOKUP_TABLES_PATH, jitter=0.05):
+    sensors, normalization_table, threshold_table = load_lookup_tables(path, mmap_mode=None)
+
+    table = np.asarray(normalization_table, dtype=np.float64)
+    table = np.where(np.isnan(table), np.nanmean(table, axis=(1, 2), keepdims=True), table)
+    table = np.nan_to_num(table)[np.arange(nr_of_sensors) % len(sensors)]
+
+    scale = rng.normal(1, jitter, size=(nr_of_sensors, 1, 1, len(METRICS)))
+
+    return table[..., 0] * scale, table[..., 1] * scale
+
+# Zero-mean noise of unit variance, correlated between consecutive hours
+def correlated_noise(nr_of_hours, rng):
+    kernel = NOISE_CORRELATION ** np.arange(NOISE_KERNEL_SIZE)
+    kernel /= np.sqrt(np.sum(kernel ** 2))
+    white = rng.standard_normal((nr_of_hours + NOISE_KERNEL_SIZE - 1, len(METRICS)))
+
+    return np.stack([np.convolve(white[:, col], kernel, mode='valid') for col in range(len(METRICS))], axis=1)
+
+# Marks the hours that fall into a gap. Gaps start with probability gap_rate at every hour
+# and last a geometrically distributed number of hours with mean mean_gap_hours.
+def gap_mask(nr_of_hours, rng, gap_rate, mean_gap_hours):
+    missing = np.zeros(nr_of_hours, dtype=bool)
+    if gap_rate <= 0:
+        return missing
+
+    for start in np.nonzero(rng.random(nr_of_hours) < gap_rate)[0]:
+        missing[start:start + rng.geometric(1 / mean_gap_hours)] = True
+
+    return missing
+
+# Generates the hourly table of a single sensor from its (days, hours, metrics) profile,
+# covering nr_of_hours hours from start_time (the start of an hour).
+# A share outlier_rate of the hours gets one metric OUTLIER_SCALE standard deviations away
+# from its mean. Returns the table with the TABLE_COLUMNS and the 'timestamp' of every hour.
+def generate_hourly(sensor, roomtype, mean, std, start_time, nr_of_hours, rng, gap_rate=0.0, mean_gap_hours=6, outlier_rate=0.0):
+    timestamps = pd.date_range(start_time, periods=nr_of_hours, freq='h')
+    day = ((timestamps.dayofweek.to_numpy() + 1) % 7).astype(int)
+    hour = timestamps.hour.to_numpy().astype(int)
+
+    values = mean[day, hour] + std[day, hour] * correlated_noise(nr_of_hours, rng)
+
+    outliers = np.nonzero(rng.random(nr_of_hours) < outlier_rate)[0]
+    metric = rng.integers(0, len(METRICS), size=len(outliers))
+    deviation = rng.choice([-1, 1], size=len(outliers)) * rng.uniform(*OUTLIER_SCALE, size=len(outliers))
+    values[outliers, metric] = mean[day[outliers], hour[outliers], metric] + deviation * std[day[outliers], hour[outliers], metric]
+
+    df = pd.DataFrame(np.round(np.clip(values, 0, None)).astype(int), columns=METRICS)
+    df['sensor'] = sensor
+    df['roomtype'] = roomtype
+    df['day'] = day
+    df['hour'] = hour
+    df['timestamp'] = timestamps
+
+    keep = ~gap_mask(nr_of_hours, rng, gap_rate, mean_gap_hours)
+
+    return df.loc[keep, TABLE_COLUMNS + ['timestamp']].reset_index(drop=True)
+
+# Expands an hourly table into readings_per_hour raw readings per hour with the fields of
+# the 'sensordatas' collection. The readings are evenly spaced within the hour and their
+# noise is centered per hour, so the hourly averages match the table up to rounding.
+def hourly_to_readings(df, readings_per_hour, rng, noise=0.05):
+    interval = datetime.timedelta(minutes=60 / readings_per_hour)
+    offsets = np.arange(readings_per_hour) * interval
+
+    values = df[METRICS].to_numpy(dtype=np.float64)
+    spread = rng.normal(0, noise, size=(len(df), readings_per_hour, len(METRICS)))
+    spread -= spread.mean(axis=1, keepdims=True)
+    readings = np.clip(values[:, None, :] * (1 + spread), 0, None)
+
+    colors = np.round(readings[..., 2, None] * COLOR_SHARES).astype(int)
+    readings = np.round(readings).astype(int)
+
+    documents = []
+    for row, (sensor, timestamp) in enumerate(zip(df['sensor'], df['timestamp'])):
+        timestamp = timestamp.to_pydatetime()
+        for idx in range(readings_per_hour):
+            documents.append({
+                'sensor': sensor,
+                'timestamp': timestamp + offsets[idx],
+                'eCO2': int(readings[row, idx, 0]),
+                'sound': int(readings[row, idx, 1]),
+                'color_r': int(colors[row, idx, 0]),
+                'color_g': int(colors[row, idx, 1]),
+                'color_b': int(colors[row, idx, 2]),
+                'color_c': int(readings[row, idx, 2])
+            })
+
+    return documents
+
+# Inserts the documents in batches of batch_size, returns the number of inserted documents
+def insert_readings(collection, documents, batch_size=10000):
+    for i in range(0, len(documents), batch_size):
+        collection.insert_many(documents[i:i+batch_size], ordered=False)
+
+    return len(documents)
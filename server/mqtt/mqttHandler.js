@@ -9,6 +9,11 @@ const LatestSensorData = require('../db/models/LatestSensorData');
 const Prediction = require('../db/models/Prediction');
 
 let thresholds = {};
+let thresholdTable = null;
+
+const LOOKUP_TABLES_PATH = './ml/obj/lookup_tables';
+const LOOKUP_TABLES_VERSION = 1;
+const THRESHOLDS_JSON_PATH = './ml/obj/thresholds.json';
 
 const mqttOptions = {
     clientId: `mqtt_${Math.random().toString(16).slice(3)}`,
@@ -18,7 +23,8 @@ const mqttOptions = {
 
 const connect = (io) => {
     const mqttClient = mqtt.connect(`mqtt://${process.env.MQTT_HOST}`, mqttOptions)
-    loadThresholdsJSON();
+    loadThresholds();
+    watchThresholds();
 
     mqttClient.on('connect', () => {
         console.log(`[MQTT] ${colors.green("Connection established successfully")}`);
@@ -87,7 +93,88 @@ const isType2Message = (message) => {
 }
 
 const loadThresholdsJSON = () => {
-    thresholds = JSON.parse(fs.readFileSync('./ml/obj/thresholds.json', 'utf8'));
+    thresholds = JSON.parse(fs.readFileSync(THRESHOLDS_JSON_PATH, 'utf8'));
+}
+
+// Reads the float32 threshold table of the lookup tables artifact written by ml/lookup_tables.py.
+// The table is indexed by (sensor, day, hour, metric, level), the manifest holds the sensor index,
+// the axis labels and the offset of the data in the .npy file.
+const loadThresholdTable = () => {
+    const manifest = JSON.parse(fs.readFileSync(`${LOOKUP_TABLES_PATH}/manifest.json`, 'utf8'));
+    if (manifest.version !== LOOKUP_TABLES_VERSION) {
+        throw new Error(`Unsupported lookup tables version: ${manifest.version}`);
+    }
+
+    const table = manifest.tables.thresholds;
+    const buffer = fs.readFileSync(`${LOOKUP_TABLES_PATH}/${table.file}`);
+    const data = new Float32Array(buffer.buffer.slice(buffer.byteOffset + table.offset, buffer.byteOffset + buffer.length));
+
+    thresholdTable = {
+        data,
+        shape: table.shape,
+        sensors: new Map(manifest.sensors.map((sensor, idx) => [sensor, idx])),
+        metrics: manifest.metrics,
+        levels: table.levels
+    };
+}
+
+// Loads the threshold table, falling back to the JSON thresholds if the artifact is not available.
+// The JSON thresholds are also loaded along with the table (if present), for the cells without a value in the table.
+const loadThresholds = () => {
+    if (fs.existsSync(`${LOOKUP_TABLES_PATH}/manifest.json`)) {
+        loadThresholdTable();
+        if (fs.existsSync(THRESHOLDS_JSON_PATH)) {
+            loadThresholdsJSON();
+        }
+    } else {
+        thresholdTable = null;
+        loadThresholdsJSON();
+    }
+}
+
+// Returns NaN if there is no threshold for the cell, so every comparison with it is false and the metric is skipped
+const getThresholdJSON = (sensor, day, hour, metric, level) => {
+    const threshold = thresholds[sensor]?.[day]?.[hour]?.[metric]?.[level];
+    return threshold === undefined || threshold === null ? NaN : threshold;
+}
+
+// Cells without data for the sensor/day/hour are NaN in the threshold table, they fall back to the JSON thresholds like
+// the sensors that are not in the table
+const getThreshold = (sensor, day, hour, metric, level) => {
+    if (!thresholdTable) {
+        return getThresholdJSON(sensor, day, hour, metric, level);
+    }
+
+    const [, nrOfDays, nrOfHours, nrOfMetrics, nrOfLevels] = thresholdTable.shape;
+    const sensorIdx = thresholdTable.sensors.get(sensor);
+    const metricIdx = thresholdTable.metrics.indexOf(metric);
+    const levelIdx = thresholdTable.levels.indexOf(level);
+    // Sensors added after the table was written (and unknown metrics/levels) are looked up in the JSON thresholds
+    if (sensorIdx === undefined || metricIdx === -1 || levelIdx === -1) {
+        return getThresholdJSON(sensor, day, hour, metric, level);
+    }
+    const idx = (((sensorIdx * nrOfDays + day) * nrOfHours + hour) * nrOfMetrics + metricIdx) * nrOfLevels + levelIdx;
+
+    const threshold = thresholdTable.data[idx];
+    return Number.isNaN(threshold) ? getThresholdJSON(sensor, day, hour, metric, level) : threshold;
+}
+
+// Reloads the thresholds once they are updated by the incremental statistics job.
+// Both files are watched, so the table is picked up once the artifact is written for the first time.
+const watchThresholds = () => {
+    const reloadThresholds = (curr, prev) => {
+        if (curr.mtimeMs === prev.mtimeMs) return;
+
+        try {
+            loadThresholds();
+            console.log(`[MQTT] ${colors.green("Reloaded the thresholds.")}`);
+        } catch (err) {
+            console.log(`[MQTT] ${colors.red("Error occurred while reloading the thresholds:")} ${err}`);
+        }
+    };
+
+    fs.watchFile(`${LOOKUP_TABLES_PATH}/manifest.json`, reloadThresholds);
+    fs.watchFile(THRESHOLDS_JSON_PATH, reloadThresholds);
 }
 
 const calcRoomColorCode = (message) => {
@@ -121,15 +208,15 @@ const calcRoomColorCode = (message) => {
         const metric = metrics[i];
         if (metric === 'light') {
             const light = calculateAverageLightLevel(message);
-            if (light > thresholds[message['sensor']][day][hour][metric]['high']) {
+            if (light > getThreshold(message['sensor'], day, hour, metric, 'high')) {
                 highCounter++;
-            } else if (light > thresholds[message['sensor']][day][hour][metric]['medium']) {
+            } else if (light > getThreshold(message['sensor'], day, hour, metric, 'medium')) {
                 midCounter++;
             }
         } else {
-            if (message[metric] > thresholds[message['sensor']][day][hour][metric]['high']) {
+            if (message[metric] > getThreshold(message['sensor'], day, hour, metric, 'high')) {
                 highCounter++;
-            } else if (message[metric] > thresholds[message['sensor']][day][hour][metric]['medium']) {
+            } else if (message[metric] > getThreshold(message['sensor'], day, hour, metric, 'medium')) {
                 midCounter++;
             }
         }
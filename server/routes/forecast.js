@@ -1,9 +1,9 @@
 const express = require('express');
-const child_process = require('child_process');
 const colors = require('colors');
 
 const Room = require('../db/models/Room');
 const Sensor = require('../db/models/Sensor');
+const workerHandler = require('../worker/workerHandler');
 
 const router = express.Router();
 
@@ -106,22 +106,15 @@ router.get('/sensors/:modelType', async (req, res, next) => {
 })
 
 router.get('/update', async (req, res, next) => {
-    const childProcess = child_process.spawn('python', [`${process.env.PREDICT_PYTHON_PATH}`, ['--live']]);
-    console.log(`[CHILD_PROCESS] ${colors.green("Prediction script child process spawned manually.")}`);
-
-    childProcess.stdout.on('data', (data) => {
-        console.log(`[CHILD_PROCESS] ${colors.green("stdout:")} ${data.toString().trim()}`);
-    });
-
-    childProcess.stderr.on('data', (err) => {
-        console.error(`[CHILD_PROCESS] ${colors.red(`Exited with an error code: ${err}`)}`);
-    });
-
-    childProcess.on('close', async (status) => {
-        console.log(`[CHILD_PROCESS] ${colors.green("Finished executing.")}`);
+    console.log(`[PREDICT_WORKER] ${colors.green("Forecast requested manually.")}`);
 
+    try {
+        await workerHandler.requestForecast(['--live']);
         res.status(200).send()
-    });
+    } catch (err) {
+        console.error(`[PREDICT_WORKER] ${colors.red(`Forecast failed: ${err}`)}`);
+        res.status(500).send()
+    }
 })
 
 module.exports = router;
\ No newline at end of file
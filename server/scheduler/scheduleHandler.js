@@ -8,6 +8,7 @@ const Prediction = require('../db/models/Prediction');
 const SensorData = require('../db/models/SensorData');
 const Sensor = require('../db/models/Sensor');
 const Room = require('../db/models/Room');
+const workerHandler = require('../worker/workerHandler');
 
 
 const schedulePredictions = async (io) => {
@@ -19,6 +20,10 @@ const schedulePredictions = async (io) => {
         execMarkOldEntries();
         // execDatabaseBackup();
 
+        // The forecast reads the hourly rollup, which is brought up to date first
+        console.log(`[SCHEDULER] ${colors.blue(`${new Date().toLocaleTimeString()}`)} ${colors.green("Started rolling up the hourly readings.")}`);
+        await execRollupUpdate();
+
         console.log(`[SCHEDULER] ${colors.blue(`${new Date().toLocaleTimeString()}`)} ${colors.green("Started forecasting.")}`);
         execPredictScript(io);
     });
@@ -26,6 +31,68 @@ const schedulePredictions = async (io) => {
     return job;
 }
 
+// Merges the data of the last day into the normalization parameters and thresholds.
+// Runs before the hourly database cleanup removes the recordings older than 3 days.
+const scheduleStatsUpdate = async () => {
+    const everyDay = '55 23 * * *';
+    const job = schedule.scheduleJob(everyDay, () => {
+        console.log(`[SCHEDULER] ${colors.blue(`${new Date().toLocaleTimeString()}`)} ${colors.green("Started updating the normalization parameters and thresholds.")}`);
+        execStatsUpdate();
+    });
+
+    return job;
+}
+
+const execStatsUpdate = async () => {
+    const statsPath = process.env.INCREMENTAL_STATS_PYTHON_PATH || './ml/incremental_stats.py';
+    const childProcess = child_process.spawn('python', [statsPath, 'update']);
+
+    childProcess.stdout.on('data', (data) => {
+        console.log(`[STATS] ${colors.green("stdout:")} ${data.toString().trim()}`);
+    });
+
+    childProcess.stderr.on('data', (data) => {
+        console.log(`[STATS] ${colors.yellow("stderr:")} ${data.toString().trim()}`);
+    });
+
+    childProcess.on('close', (status) => {
+        if (status === 0) {
+            console.log(`[STATS] ${colors.green("Finished updating the normalization parameters and thresholds.")}`);
+        } else {
+            console.error(`[STATS] ${colors.red(`Updating the normalization parameters and thresholds failed with code ${status}`)}`);
+        }
+    });
+}
+
+// Rolls up the raw readings of the new hours into the hourly rollup collection (ml/rollup.py).
+// Resolves once the script has finished, a failed rollup is logged and the forecast falls back to the raw readings.
+const execRollupUpdate = () => {
+    const rollupPath = process.env.ROLLUP_PYTHON_PATH || './ml/rollup.py';
+
+    return new Promise((resolve) => {
+        const childProcess = child_process.spawn('python', [rollupPath]);
+
+        childProcess.stdout.on('data', (data) => {
+            console.log(`[ROLLUP] ${colors.green("stdout:")} ${data.toString().trim()}`);
+        });
+
+        childProcess.stderr.on('data', (data) => {
+            console.log(`[ROLLUP] ${colors.yellow("stderr:")} ${data.toString().trim()}`);
+        });
+
+        childProcess.on('error', (err) => {
+            console.error(`[ROLLUP] ${colors.red(`Rolling up the hourly readings failed: ${err}`)}`);
+        });
+
+        childProcess.on('close', (status) => {
+            if (status !== 0) {
+                console.error(`[ROLLUP] ${colors.red(`Rolling up the hourly readings failed with code ${status}`)}`);
+            }
+            resolve();
+        });
+    });
+}
+
 const execDatabaseBackup = async () => {
     console.log(`[DB] ${colors.green("Database backup script started.")}`);
 
@@ -163,28 +230,20 @@ const execMarkOldEntries = async () => {
 }
 
 const execPredictScript = async (io) => {
-    const childProcess = child_process.spawn('python', [`${process.env.PREDICT_PYTHON_PATH}`]);
-    console.log(`[CHILD_PROCESS] ${colors.green("Prediction script child process spawned.")}`);
-
-    childProcess.stdout.on('data', (data) => {
-        console.log(`[CHILD_PROCESS] ${colors.green("stdout:")} ${data.toString().trim()}`);
-    });
-
-    childProcess.stderr.on('data', (err) => {
-        console.error(`[CHILD_PROCESS] ${colors.red(`Exited with an error code: ${err}`)}`);
-    });
+    try {
+        await workerHandler.requestForecast();
+    } catch (err) {
+        console.error(`[PREDICT_WORKER] ${colors.red(`Forecast failed: ${err}`)}`);
+    }
 
-    childProcess.on('close', async (status) => {
-        console.log(`[CHILD_PROCESS] ${colors.green("Finished executing.")}`);
-        const predictions = await Prediction.find();
+    const predictions = await Prediction.find();
 
-        io.emit('forecastData', {
-            ...predictions
-        })
-        
-        console.log(`[SCHEDULER] ${colors.green("Sent the predictions over a socket.")}`);
-    });
+    io.emit('forecastData', {
+        ...predictions
+    })
+    
+    console.log(`[SCHEDULER] ${colors.green("Sent the predictions over a socket.")}`);
 }
 
 
-module.exports = { schedulePredictions };
\ No newline at end of file
+module.exports = { schedulePredictions, scheduleStatsUpdate };
\ No newline at end of file
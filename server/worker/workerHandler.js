@@ -0,0 +1,129 @@
+const colors = require('colors');
+const child_process = require('child_process');
+const readline = require('readline');
+
+let worker = null;
+let ready = null;
+let nextRequestId = 1;
+const pendingRequests = new Map();
+
+// Counters reported next to the timings (number of sensors and forecast upserts)
+const counters = ['sensors', 'raw_fallback', 'matched', 'modified', 'upserted', 'failed'];
+
+const formatTimings = (timings) => {
+    return Object.entries(timings)
+        .map(([stage, value]) => counters.includes(stage) ? `${stage}=${value}` : `${stage}=${value.toFixed(2)}s`)
+        .join(' ');
+}
+
+// Spawns the long-lived prediction worker, which loads the models once
+// and then handles forecast requests sent over stdin (one JSON object per line).
+const start = () => {
+    if (worker) return ready;
+
+    const workerPath = process.env.PREDICT_WORKER_PYTHON_PATH || './ml/predict_worker.py';
+    const spawnedWorker = child_process.spawn('python', [workerPath]);
+    worker = spawnedWorker;
+    console.log(`[PREDICT_WORKER] ${colors.green("Prediction worker process spawned.")}`);
+
+    ready = new Promise((resolve, reject) => {
+        pendingRequests.set('ready', { resolve, reject });
+    });
+
+    readline.createInterface({ input: spawnedWorker.stdout }).on('line', (line) => {
+        let message;
+        try {
+            message = JSON.parse(line);
+        } catch (err) {
+            console.log(`[PREDICT_WORKER] ${colors.green("stdout:")} ${line}`);
+            return;
+        }
+
+        const requestId = message.status === 'ready' ? 'ready' : message.id;
+        const request = pendingRequests.get(requestId);
+        if (!request) return;
+
+        pendingRequests.delete(requestId);
+        if (message.status === 'error') {
+            request.reject(new Error(message.error));
+        } else {
+            request.resolve(message);
+        }
+    });
+
+    spawnedWorker.stderr.on('data', (data) => {
+        console.log(`[PREDICT_WORKER] ${colors.yellow("stderr:")} ${data.toString().trim()}`);
+    });
+
+    // Writes to a worker that has exited fail with EPIPE, the pending requests are rejected on exit
+    spawnedWorker.stdin.on('error', (err) => {
+        console.error(`[PREDICT_WORKER] ${colors.red("Error occurred while writing to the prediction worker:")} ${err}`);
+    });
+
+    spawnedWorker.on('error', (err) => {
+        console.error(`[PREDICT_WORKER] ${colors.red("Error occurred in the prediction worker process:")} ${err}`);
+    });
+
+    // Rejects all pending requests once the worker has exited and its output is read, the next request spawns a new worker
+    spawnedWorker.on('close', (status) => {
+        console.error(`[PREDICT_WORKER] ${colors.red(`Prediction worker exited with code ${status}`)}`);
+        for (const request of pendingRequests.values()) {
+            request.reject(new Error(`Prediction worker exited with code ${status}`));
+        }
+        pendingRequests.clear();
+        if (worker === spawnedWorker) {
+            worker = null;
+            ready = null;
+        }
+    });
+
+    ready.then((message) => {
+        console.log(`[PREDICT_WORKER] ${colors.green("Models loaded:")} ${formatTimings(message.timings)}`);
+    }).catch(() => {});
+
+    return ready;
+}
+
+// Sends a request to the worker, (re)spawning it if needed.
+// Resolves with the worker response once the request is processed,
+// rejects right away if the worker has exited in the meantime.
+const sendRequest = async (request) => {
+    await start();
+    if (!worker || !worker.stdin.writable) {
+        throw new Error("Prediction worker is not running");
+    }
+
+    const id = nextRequestId++;
+    const response = new Promise((resolve, reject) => {
+        pendingRequests.set(id, { resolve, reject });
+    });
+    worker.stdin.write(JSON.stringify({ id, ...request }) + '\n');
+
+    return response;
+}
+
+// Runs a forecast with the provided predict.py command line flags, e.g. ['--live'].
+// The number of forecasted hours is taken from the FORECAST_HORIZON env variable unless --horizon is provided.
+// Resolves with the per-stage timings of the run.
+const requestForecast = async (args = []) => {
+    if (process.env.FORECAST_HORIZON && !args.includes('--horizon')) {
+        args = [...args, '--horizon', process.env.FORECAST_HORIZON];
+    }
+
+    const response = await sendRequest({ cmd: 'forecast', args });
+    console.log(`[PREDICT_WORKER] ${colors.green("Forecast finished:")} ${formatTimings(response.timings)}`);
+
+    return response.timings;
+}
+
+// Shuts the worker down, resolves once the process has exited
+const stop = async () => {
+    if (!worker) return;
+
+    const stoppedWorker = worker;
+    const closed = new Promise((resolve) => stoppedWorker.once('close', resolve));
+    await sendRequest({ cmd: 'shutdown' });
+    await closed;
+}
+
+module.exports = { start, requestForecast, stop };